@@ -2,7 +2,7 @@ import streamlit as st
 from dotenv import load_dotenv
 import os
 import utils_db
-from utils_rag import initialize_rag_components
+from utils_rag import start_rag_startup, get_rag_readiness
 
 # Muat variabel lingkungan dari .env
 load_dotenv(override=True)
@@ -14,13 +14,31 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+COMPONENT_STATE_ICONS = {"pending": "⏳", "loading": "🔄", "ready": "✅", "failed": "❌", "skipped": "➖"}
+
+def show_rag_readiness_sidebar():
+    readiness = get_rag_readiness()
+    if readiness["ready"]:
+        st.sidebar.success("Komponen AI Siap!")
+    elif readiness.get("finished"):
+        st.sidebar.error("Komponen AI gagal dimuat. Chatbot mungkin tidak berfungsi.")
+    else:
+        st.sidebar.info(f"Komponen AI sedang dimuat ({readiness.get('elapsed_seconds', 0)} detik)...")
+    with st.sidebar.expander("Status komponen AI", expanded=not readiness["ready"]):
+        for name, component in readiness["components"].items():
+            icon = COMPONENT_STATE_ICONS.get(component["state"], "")
+            detail = component["error"] or component["detail"] or ""
+            st.markdown(f"{icon} **{name}**: {component['state']} {detail}")
+        st.button("Perbarui Status", key="refresh_rag_readiness")
+
 def main_app_content(): # Mengganti nama fungsi agar lebih jelas
     st.sidebar.title(f"Selamat Datang, {st.session_state.get('username', 'Pengguna Tamu')}!")
     
     if st.session_state.get('logged_in_admin', False):
         st.sidebar.info("Anda login sebagai Admin.")
         if st.sidebar.button("Logout Admin", key="logout_button_main_app"):
-            keys_to_delete = ['logged_in_admin', 'username', 'rag_initialized_status', 'initial_greeting_displayed', 'chat_history_display', 'session_id']
+            # Komponen RAG milik proses (bukan sesi), jadi logout tidak memicu inisialisasi ulang
+            keys_to_delete = ['logged_in_admin', 'username', 'initial_greeting_displayed', 'chat_history_display', 'session_id']
             for key in keys_to_delete:
                 if key in st.session_state:
                     del st.session_state[key]
@@ -32,35 +50,10 @@ def main_app_content(): # Mengganti nama fungsi agar lebih jelas
     st.title("🍎 Sistem Informasi Gizi dan Kesehatan Masyarakat")
     st.markdown("Navigasi melalui menu di bilah sisi kiri.")
 
-    # Inisialisasi pipeline RAG jika belum dilakukan
-    if 'rag_initialized_status' not in st.session_state:
-        st.session_state.rag_initialized_status = "pending"
-
-    # Selalu coba inisialisasi jika statusnya pending, atau jika diminta oleh tombol
-    # Tombol ini bisa ditambahkan jika ingin ada cara manual re-init dari UI utama
-    # if st.sidebar.button("Inisialisasi Ulang Sistem AI", key="reinit_ai_main"):
-    #    st.session_state.rag_initialized_status = "pending"
-    #    st.experimental_rerun() # atau st.rerun()
-
-    if st.session_state.rag_initialized_status == "pending":
-        # Tidak menggunakan st.spinner di sini karena initialize_rag_components sudah punya st.write/st.spinner internal
-        # st.write("Memulai inisialisasi komponen RAG dari app.py...") # Untuk debug jika perlu
-        success = initialize_rag_components() # Fungsi ini sekarang mengembalikan True/False
-        if success:
-            st.session_state.rag_initialized_status = "success"
-            # st.rerun() # Mungkin tidak perlu rerun di sini, biarkan UI update alami
-        else:
-            st.session_state.rag_initialized_status = "failed"
-            # st.rerun() # Mungkin tidak perlu rerun di sini
-
-    # Tampilkan status setelah upaya inisialisasi
-    if st.session_state.rag_initialized_status == "failed":
-        st.sidebar.error("Komponen AI gagal dimuat. Chatbot mungkin tidak berfungsi.")
-    elif st.session_state.rag_initialized_status == "success":
-        st.sidebar.success("Komponen AI Siap!")
-    else: # Pending (jika tidak ada rerun setelah status diubah)
-        st.sidebar.info("Status inisialisasi AI: Tertunda.")
-
+    # Komponen RAG dimuat bertahap di thread latar belakang (sekali per proses),
+    # sehingga halaman langsung tampil tanpa menunggu model selesai dimuat
+    start_rag_startup()
+    show_rag_readiness_sidebar()
 
     st.markdown(
         """
@@ -0,0 +1,315 @@
+"""
+Tanya-jawab batch tanpa Streamlit untuk kumpulan pertanyaan offline
+(uji regresi, pra-komputasi jawaban).
+
+Menjalankan: python batch_qa.py --input pertanyaan.jsonl --output jawaban.jsonl [--batch-size 32]
+Input berisi satu JSON per baris: {"id": ..., "session_id": ..., "question": "..."};
+id dan session_id opsional (default: nomor baris). Pertanyaan dalam satu sesi diproses
+berurutan, sehingga pertanyaan lanjutan dikontekstualisasi dengan jawaban sebelumnya di
+sesi yang sama (riwayat disimpan di memori, bukan dibaca dari DB, dan tidak ditulis ke chat_logs).
+
+Memakai engine yang sama dengan get_rag_response_streamlit. Per batch: kontekstualisasi,
+embedding semua pertanyaan dalam satu panggilan, pencarian vektor dalam satu query Chroma,
+lalu generasi LLM dijalankan lewat penjadwal inferensi sementara batch berikutnya disiapkan.
+Setiap hasil (beserta waktu per tahap) langsung ditambahkan ke file output; menjalankan
+ulang perintah yang sama melanjutkan dari item yang belum ada di output.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def load_records(path):
+    records = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            if not item.get("question"):
+                print(f"Baris {line_number} dilewati: tidak ada 'question'.")
+                continue
+            record_id = str(item.get("id", line_number))
+            records.append({
+                "order": len(records),
+                "id": record_id,
+                "session_id": str(item.get("session_id") or f"batch-{record_id}"),
+                "question": item["question"],
+            })
+    return records
+
+
+def load_completed(path, retry_errors=False):
+    """Hasil yang sudah ada di file output (checkpoint), per id. Baris terakhir untuk id yang sama menang."""
+    completed = {}
+    if not os.path.exists(path):
+        return completed
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                result = json.loads(line)
+            except ValueError:
+                # Baris terakhir bisa terpotong jika proses sebelumnya dihentikan paksa
+                continue
+            if retry_errors and result.get("error"):
+                completed.pop(result["id"], None)
+                continue
+            completed[result["id"]] = result
+    return completed
+
+
+def build_batches(records, batch_size):
+    """
+    Membagi record menjadi batch. Satu batch berisi paling banyak satu pertanyaan per sesi,
+    dan pertanyaan ke-n sebuah sesi selalu berada di batch setelah pertanyaan ke-(n-1),
+    sehingga pertanyaan lanjutan bisa menunggu jawaban sebelumnya. Sisa tempat di batch
+    awal diisi pertanyaan dari sesi lain.
+    """
+    batches = []
+    next_batch_for_session = {}
+    first_open = 0
+    for record in records:
+        index = max(first_open, next_batch_for_session.get(record["session_id"], 0))
+        while index < len(batches) and len(batches[index]) >= batch_size:
+            index += 1
+        if index == len(batches):
+            batches.append([])
+        batches[index].append(record)
+        next_batch_for_session[record["session_id"]] = index + 1
+        while first_open < len(batches) and len(batches[first_open]) >= batch_size:
+            first_open += 1
+    return batches
+
+
+class ResultWriter:
+    """Menambahkan hasil ke file JSONL; fsync setiap checkpoint_every hasil."""
+
+    def __init__(self, path, checkpoint_every):
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+        self.checkpoint_every = max(1, checkpoint_every)
+        self.written = 0
+
+    def write(self, result):
+        with self._lock:
+            self._file.write(json.dumps(result, ensure_ascii=False) + "\n")
+            self._file.flush()
+            self.written += 1
+            if self.written % self.checkpoint_every == 0:
+                os.fsync(self._file.fileno())
+
+    def close(self):
+        with self._lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+
+
+class BatchRunner:
+    def __init__(self, engine, writer, generation_workers, use_semantic_cache=False, busy_retries=5):
+        import utils_rag
+        self.rag = utils_rag
+        self.engine = engine
+        self.writer = writer
+        self.use_semantic_cache = use_semantic_cache
+        self.busy_retries = busy_retries
+        self.executor = ThreadPoolExecutor(max_workers=generation_workers, thread_name_prefix="batch-generation")
+        self.histories = {}  # session_id -> list (urutan input, pertanyaan, jawaban)
+        self.pending = {}  # session_id -> list future generasi yang belum selesai
+        self.outcomes = {}
+        self._lock = threading.Lock()
+
+    def add_history(self, record, answer):
+        with self._lock:
+            self.histories.setdefault(record["session_id"], []).append((record["order"], record["question"], answer))
+
+    def _history_messages(self, session_id):
+        from langchain_core.messages import HumanMessage, AIMessage
+        with self._lock:
+            turns = sorted(self.histories.get(session_id, []))
+        messages = []
+        for _, question, answer in turns:
+            messages.extend([HumanMessage(content=question), AIMessage(content=answer or "")])
+        return messages
+
+    def _needs_history(self, question):
+        return not (self.rag.CONTEXTUALIZE_FAST_PATH_ENABLED and self.rag.is_self_contained_question(question))
+
+    def _wait_for_sessions(self, batch):
+        """Pertanyaan lanjutan menunggu semua jawaban sebelumnya di sesinya."""
+        for record in batch:
+            futures = self.pending.get(record["session_id"], [])
+            if self._needs_history(record["question"]):
+                for future in futures:
+                    future.result()
+            self.pending[record["session_id"]] = [future for future in futures if not future.done()]
+
+    def run_batch(self, batch):
+        self._wait_for_sessions(batch)
+        batch_started = time.monotonic()
+        items = []
+        for record in batch:
+            started = time.monotonic()
+            history = self._history_messages(record["session_id"])
+            try:
+                standalone = self.rag._contextualize_question(
+                    self.engine, record["session_id"], record["question"], chat_history=history
+                )
+            except self.rag.ServerBusyError:
+                standalone = record["question"]
+            items.append({
+                "record": record,
+                "standalone_question": standalone,
+                "timings": {"contextualize_ms": round((time.monotonic() - started) * 1000, 2)},
+            })
+
+        questions = [item["standalone_question"] for item in items]
+        started = time.monotonic()
+        embeddings = self.rag.embed_questions(self.engine, questions)
+        embedding_ms = round((time.monotonic() - started) * 1000, 2)
+
+        cached_answers = [None] * len(items)
+        if self.use_semantic_cache and embeddings is not None:
+            cached_answers = [self.rag._lookup_cached_answer(q, e) for q, e in zip(questions, embeddings)]
+
+        to_retrieve = [i for i, answer in enumerate(cached_answers) if answer is None]
+        started = time.monotonic()
+        contexts = self.rag.retrieve_contexts_bulk(
+            self.engine, [questions[i] for i in to_retrieve],
+            [embeddings[i] for i in to_retrieve] if embeddings is not None else None
+        )
+        retrieval_ms = round((time.monotonic() - started) * 1000, 2)
+        contexts_by_index = dict(zip(to_retrieve, contexts))
+
+        for index, item in enumerate(items):
+            item["timings"].update({
+                "embedding_batch_ms": embedding_ms,
+                "retrieval_batch_ms": retrieval_ms,
+                "batch_size": len(items),
+            })
+            item["query_embedding"] = embeddings[index] if embeddings is not None else None
+            item["cached_answer"] = cached_answers[index]
+            item["context"] = contexts_by_index.get(index)
+            item["started"] = batch_started
+            # Generasi berjalan di thread pool; loop utama langsung menyiapkan batch berikutnya
+            self.pending.setdefault(item["record"]["session_id"], []).append(self.executor.submit(self._generate, item))
+
+    def _generate(self, item):
+        record = item["record"]
+        result = {
+            "id": record["id"],
+            "session_id": record["session_id"],
+            "question": record["question"],
+            "standalone_question": item["standalone_question"],
+        }
+        try:
+            if item["cached_answer"] is not None:
+                answer, outcome, timings = item["cached_answer"], "cache_hit", {}
+            else:
+                answer, outcome, timings = self._answer_with_retry(item)
+            result.update({"answer": answer, "outcome": outcome})
+            item["timings"].update(timings)
+        except Exception as e:
+            print(f"Error pada item {record['id']}: {e}")
+            answer = None
+            result.update({"answer": None, "outcome": "error", "error": str(e)})
+        item["timings"]["total_ms"] = round((time.monotonic() - item["started"]) * 1000, 2)
+        result["timings"] = item["timings"]
+
+        self.add_history(record, answer)
+        with self._lock:
+            self.outcomes[result["outcome"]] = self.outcomes.get(result["outcome"], 0) + 1
+        self.writer.write(result)
+        return result
+
+    def _answer_with_retry(self, item):
+        retrieved_docs_str, is_relevant = item["context"]
+        for attempt in range(self.busy_retries + 1):
+            try:
+                answer, outcome, timings = self.rag.answer_from_context(
+                    self.engine, item["standalone_question"], retrieved_docs_str, is_relevant
+                )
+                break
+            except self.rag.ServerBusyError:
+                # Antrean inferensi penuh: tunggu lalu coba lagi, batch tidak perlu ditolak
+                if attempt == self.busy_retries:
+                    raise
+                time.sleep(0.5 * (attempt + 1))
+        if self.use_semantic_cache:
+            self.rag._store_cached_answer(item["standalone_question"], item["query_embedding"], answer)
+        return answer, outcome, timings
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Tanya-jawab batch (JSONL) tanpa Streamlit.")
+    parser.add_argument("--input", required=True, help="File JSONL berisi question (dan opsional id, session_id)")
+    parser.add_argument("--output", required=True, help="File JSONL hasil; juga dipakai sebagai checkpoint")
+    parser.add_argument("--batch-size", type=int, default=32, help="Pertanyaan per batch embedding/pencarian")
+    parser.add_argument("--generation-workers", type=int, default=0,
+                        help="Permintaan generasi yang dikirim bersamaan (default: 2 x LLM_REPLICAS)")
+    parser.add_argument("--checkpoint-every", type=int, default=20, help="fsync file output setiap N hasil")
+    parser.add_argument("--retry-errors", action="store_true", help="Ulangi item yang sebelumnya gagal")
+    parser.add_argument("--semantic-cache", action="store_true",
+                        help="Pakai semantic answer cache (default: setiap pertanyaan dijawab ulang)")
+    parser.add_argument("--limit", type=int, help="Hanya proses N pertanyaan pertama yang belum selesai")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    records = load_records(args.input)
+    completed = load_completed(args.output, args.retry_errors)
+    todo = [record for record in records if record["id"] not in completed]
+    if args.limit is not None:
+        todo = todo[:args.limit]
+    print(f"{len(records)} pertanyaan, {len(completed)} sudah selesai, {len(todo)} akan diproses.")
+    if not todo:
+        return
+
+    import utils_rag
+    from utils_llm import LLM_REPLICAS
+    started = time.monotonic()
+    if not utils_rag.initialize_rag_components(background_services=False):
+        print("Inisialisasi komponen RAG gagal.", file=sys.stderr)
+        sys.exit(1)
+    print(f"Komponen RAG siap dalam {time.monotonic() - started:.1f} detik.")
+
+    writer = ResultWriter(args.output, args.checkpoint_every)
+    runner = BatchRunner(
+        utils_rag.get_rag_engine(), writer,
+        generation_workers=args.generation_workers or 2 * max(1, LLM_REPLICAS),
+        use_semantic_cache=args.semantic_cache,
+    )
+    todo_ids = {record["id"] for record in todo}
+    for record in records:
+        if record["id"] in completed and record["id"] not in todo_ids:
+            # Riwayat sesi dibangun ulang dari checkpoint agar pertanyaan lanjutan tetap kontekstual
+            runner.add_history(record, completed[record["id"]].get("answer"))
+
+    started = time.monotonic()
+    try:
+        batches = build_batches(todo, max(1, args.batch_size))
+        for index, batch in enumerate(batches, start=1):
+            runner.run_batch(batch)
+            print(f"Batch {index}/{len(batches)} disiapkan ({writer.written} hasil tertulis).")
+    finally:
+        runner.close()
+        writer.close()
+    elapsed = time.monotonic() - started
+    print(f"Selesai: {writer.written} hasil dalam {elapsed:.1f} detik "
+          f"({writer.written / elapsed if elapsed else 0:.2f} pertanyaan/detik). Outcome: {runner.outcomes}")
+
+
+if __name__ == "__main__":
+    main()
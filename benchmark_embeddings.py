@@ -0,0 +1,187 @@
+"""
+Uji kesetaraan dan benchmark throughput backend embedding (utils_embeddings).
+
+Menjalankan: python benchmark_embeddings.py [--texts teks.txt|teks.jsonl] [--questions pertanyaan.jsonl]
+Tanpa --texts, teks diambil dari chunk acak di koleksi Chroma. Model ONNX harus sudah
+diekspor (export_onnx_embeddings.py).
+
+SentenceTransformerEmbeddings (PyTorch) menjadi acuan. Untuk setiap backend ONNX (float32
+dan int8) diukur:
+  - kesetaraan: kemiripan kosinus vektor per teks terhadap acuan (rata-rata dan minimum);
+  - kesepakatan retrieval: irisan top-k terhadap hasil acuan, baik untuk query ONNX terhadap
+    dokumen yang di-embed acuan (indeks lama, hanya backend query yang diganti) maupun
+    query dan dokumen ONNX (setelah ingestion ulang);
+  - throughput embed_documents (teks/detik) dan latensi embed_query (p50/p95).
+Keluar dengan kode 1 jika kosinus minimum suatu backend di bawah --min-cosine.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+import numpy as np
+from dotenv import load_dotenv
+
+from eval_retriever import percentile
+from utils_embeddings import (
+    OnnxEmbeddings, create_embeddings, default_onnx_model_dir, ONNX_MODEL_FILE, ONNX_QUANTIZED_MODEL_FILE
+)
+
+load_dotenv(override=True)
+
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", "intfloat/multilingual-e5-large")
+CHROMA_PERSIST_DIRECTORY = os.getenv("CHROMA_PERSIST_DIR", "./chroma_db_streamlit_app")
+COLLECTION_NAME = os.getenv("CHROMA_COLLECTION_NAME", "giziai_knowledge_app")
+
+
+def read_texts(path, field):
+    """Baris teks biasa, atau JSONL dengan kolom field."""
+    texts = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            texts.append(json.loads(line)[field] if path.endswith(".jsonl") else line)
+    return texts
+
+
+def sample_collection_texts(samples, seed):
+    from langchain_chroma import Chroma
+    collection = Chroma(collection_name=COLLECTION_NAME, persist_directory=CHROMA_PERSIST_DIRECTORY)._collection
+    count = collection.count()
+    offsets = sorted(random.Random(seed).sample(range(count), min(samples, count)))
+    return [collection.get(limit=1, offset=offset, include=["documents"])["documents"][0] for offset in offsets]
+
+
+def embed_matrix(embeddings, texts):
+    return np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+
+
+def cosine_rows(a, b):
+    return (a * b).sum(axis=1) / np.maximum(np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1), 1e-12)
+
+
+def top_k(query_vectors, document_vectors, k, exclude_self):
+    query_vectors = query_vectors / np.linalg.norm(query_vectors, axis=1, keepdims=True)
+    document_vectors = document_vectors / np.linalg.norm(document_vectors, axis=1, keepdims=True)
+    scores = query_vectors @ document_vectors.T
+    if exclude_self:
+        # Teks dipakai sebagai query terhadap dirinya sendiri; hasil dirinya tidak dihitung
+        np.fill_diagonal(scores, -np.inf)
+    return np.argsort(-scores, axis=1)[:, :k]
+
+
+def overlap_at_k(got, expected):
+    return float(np.mean([len(set(a) & set(b)) / len(b) for a, b in zip(got, expected)]))
+
+
+def measure_throughput(embeddings, texts, query_texts, repeats):
+    """(teks per detik untuk embed_documents, latensi embed_query per query dalam ms)."""
+    embeddings.embed_documents(texts[:8])  # pemanasan (alokasi sesi/graf)
+    started = time.perf_counter()
+    for _ in range(repeats):
+        embeddings.embed_documents(texts)
+    texts_per_second = len(texts) * repeats / max(time.perf_counter() - started, 1e-9)
+    latencies = []
+    for text in query_texts:
+        started = time.perf_counter()
+        embeddings.embed_query(text)
+        latencies.append((time.perf_counter() - started) * 1000)
+    return texts_per_second, latencies
+
+
+def format_table(results):
+    header = (f"{'backend':<22} {'kosinus rata2':>13} {'kosinus min':>11} {'top-k q':>8} {'top-k q+d':>9} "
+              f"{'teks/dtk':>9} {'speedup':>8} {'query p50':>9} {'query p95':>9}")
+    lines = [header, "-" * len(header)]
+    for r in results:
+        parity = (f"{r['cosine_mean']:>13.4f} {r['cosine_min']:>11.4f} {r['topk_query_only']:>8.3f} "
+                  f"{r['topk_reembedded']:>9.3f}") if "cosine_mean" in r else f"{'(acuan)':>13} {'':>11} {'':>8} {'':>9}"
+        lines.append(
+            f"{r['backend']:<22} {parity} {r['texts_per_second']:>9.1f} {r['speedup']:>7.2f}x "
+            f"{r['query_p50_ms']:>9.1f} {r['query_p95_ms']:>9.1f}"
+        )
+    return "\n".join(lines)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Kesetaraan dan throughput backend embedding ONNX vs sentence-transformers.")
+    parser.add_argument("--model", default=EMBEDDING_MODEL_NAME)
+    parser.add_argument("--onnx-dir", help="Direktori model ONNX (default: lokasi yang dipakai utils_embeddings)")
+    parser.add_argument("--texts", help="File teks (satu per baris) atau JSONL berisi 'text' (default: chunk koleksi)")
+    parser.add_argument("--questions", help="File JSONL berisi 'question' sebagai query retrieval")
+    parser.add_argument("--samples", type=int, default=256, help="Jumlah chunk yang diambil dari koleksi")
+    parser.add_argument("--queries", type=int, default=50, help="Jumlah query untuk latensi dan top-k")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--repeats", type=int, default=1, help="Ulangan embed_documents untuk throughput")
+    parser.add_argument("--min-cosine", type=float, default=0.97, help="Batas kosinus minimum agar lulus")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Tulis hasil ke file JSON ini")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    texts = read_texts(args.texts, "text") if args.texts else sample_collection_texts(args.samples, args.seed)
+    if not texts:
+        print("Tidak ada teks untuk diuji (koleksi kosong dan --texts tidak diberikan).")
+        sys.exit(1)
+    exclude_self = not args.questions
+    query_texts = (read_texts(args.questions, "question") if args.questions else texts)[:args.queries]
+    k = min(args.k, len(texts) - (1 if exclude_self else 0))
+    onnx_dir = args.onnx_dir or default_onnx_model_dir(args.model)
+
+    backends = [("sentence-transformers", lambda: create_embeddings(args.model, backend="sentence-transformers"))]
+    if os.path.exists(os.path.join(onnx_dir, ONNX_MODEL_FILE)):
+        backends.append(("onnx float32", lambda: OnnxEmbeddings(onnx_dir, quantized=False)))
+    if os.path.exists(os.path.join(onnx_dir, ONNX_QUANTIZED_MODEL_FILE)):
+        backends.append(("onnx int8", lambda: OnnxEmbeddings(onnx_dir, quantized=True)))
+    if len(backends) == 1:
+        print(f"Model ONNX tidak ditemukan di {onnx_dir}; jalankan export_onnx_embeddings.py terlebih dahulu.")
+        sys.exit(1)
+    print(f"{len(texts)} teks, {len(query_texts)} query, k={k}, model {args.model}, ONNX dari {onnx_dir}.")
+
+    results = []
+    reference = None
+    for name, factory in backends:
+        embeddings = factory()
+        document_vectors = embed_matrix(embeddings, texts)
+        query_vectors = document_vectors[:len(query_texts)] if exclude_self else embed_matrix(embeddings, query_texts)
+        texts_per_second, latencies = measure_throughput(embeddings, texts, query_texts, args.repeats)
+        result = {"backend": name, "texts_per_second": texts_per_second,
+                  "query_p50_ms": percentile(latencies, 50), "query_p95_ms": percentile(latencies, 95)}
+        if reference is None:
+            reference = {"documents": document_vectors, "queries": query_vectors, "texts_per_second": texts_per_second,
+                         "top_k": top_k(query_vectors, document_vectors, k, exclude_self)}
+        else:
+            cosines = cosine_rows(document_vectors, reference["documents"])
+            result.update({
+                "cosine_mean": float(cosines.mean()), "cosine_min": float(cosines.min()),
+                "topk_query_only": overlap_at_k(top_k(query_vectors, reference["documents"], k, exclude_self),
+                                                reference["top_k"]),
+                "topk_reembedded": overlap_at_k(top_k(query_vectors, document_vectors, k, exclude_self),
+                                                reference["top_k"]),
+            })
+        result["speedup"] = texts_per_second / reference["texts_per_second"]
+        results.append(result)
+        del embeddings
+
+    print(format_table(results))
+    print("top-k q: query backend vs dokumen acuan; top-k q+d: query dan dokumen backend (ingestion ulang).")
+    failed = [r["backend"] for r in results if r.get("cosine_min", 1.0) < args.min_cosine]
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"model": args.model, "texts": len(texts), "queries": len(query_texts), "k": k,
+                       "min_cosine": args.min_cosine, "results": results}, f, indent=2)
+        print(f"Hasil ditulis ke {args.output}")
+    if failed:
+        print(f"GAGAL: kosinus minimum di bawah {args.min_cosine} untuk {', '.join(failed)}.")
+        sys.exit(1)
+    print(f"Lulus: semua backend ONNX memiliki kosinus minimum >= {args.min_cosine}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+"""
+Benchmark RAG offline (CPU, tanpa jaringan) untuk mendeteksi regresi performa.
+
+Menjalankan: python benchmark_rag.py --docs 50 --queries 40 --output bench.json
+Korpus sintetis ditulis ke direktori kerja sementara, lalu di-ingest lewat
+utils_rag._run_ingestion dan ditanya lewat get_rag_response_streamlit.
+Pengganti yang dipakai:
+- LLM: FakeLlamaCpp, deterministik dengan kecepatan token/detik yang bisa diatur
+- MySQL: utils_db_sqlite (SQLite in-memory dengan API utils_db)
+- Embedding (opsional, --fake-embeddings): HashingEmbeddings berbasis hashing kata
+Hasil berupa JSON: p50/p95 per span (dari trace per giliran), throughput ingestion,
+dan RSS puncak.
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+TOPIC_WORDS = [
+    "protein", "zat besi", "kalsium", "vitamin a", "vitamin d", "serat", "karbohidrat", "lemak",
+    "asi eksklusif", "mpasi", "stunting", "anemia", "obesitas", "diabetes", "hipertensi", "yodium",
+    "zinc", "asam folat", "omega 3", "air minum", "sayuran hijau", "buah", "kacang", "ikan", "telur",
+]
+FILLER_WORDS = [
+    "kebutuhan", "harian", "anak", "balita", "remaja", "ibu", "hamil", "menyusui", "lansia", "porsi",
+    "makanan", "sumber", "penyerapan", "tubuh", "kesehatan", "gizi", "seimbang", "pola", "konsumsi",
+    "rekomendasi", "takaran", "gram", "miligram", "puskesmas", "posyandu", "pertumbuhan", "energi",
+]
+FOLLOW_UP_QUESTIONS = ["Bagaimana dengan manfaatnya?", "Berapa takarannya per hari?", "Apa sumber lainnya?"]
+
+
+class HashingEmbeddings:
+    """
+    Embedding deterministik tanpa model: kata di-hash ke dimensi tetap lalu dinormalisasi.
+    Teks dengan kata yang sama menghasilkan vektor yang mirip, cukup untuk retrieval sintetis.
+    """
+
+    def __init__(self, model_name=None, dimensions=384, **kwargs):
+        self.model_name = model_name
+        self.dimensions = dimensions
+
+    def _embed(self, text):
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for word in text.lower().split():
+            digest = hashlib.md5(word.encode("utf-8")).digest()
+            index = int.from_bytes(digest[:4], "little") % self.dimensions
+            vector[index] += 1.0 if digest[4] % 2 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm > 0 else vector).tolist()
+
+    def embed_documents(self, texts):
+        import utils_rag
+        utils_rag._increment_retrieval_call_stat("embed_documents")
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        import utils_rag
+        utils_rag._increment_retrieval_call_stat("embed_query")
+        return self._embed(text)
+
+
+def make_fake_llm_class():
+    """Kelas LLM LangChain palsu; dibuat di dalam fungsi agar langchain baru diimpor setelah env diatur."""
+    from langchain_core.language_models.llms import LLM
+    from langchain_core.outputs import GenerationChunk
+
+    class FakeLlamaCpp(LLM):
+        """
+        Pengganti LlamaCpp: waktu evaluasi prompt dan generasi disimulasikan dengan sleep
+        sesuai prompt_tokens_per_second dan tokens_per_second. Jawaban diambil dari kata-kata
+        di bagian konteks prompt, sehingga deterministik untuk prompt yang sama.
+        """
+        tokens_per_second: float = 20.0
+        prompt_tokens_per_second: float = 400.0
+        answer_tokens: int = 64
+
+        @property
+        def _llm_type(self):
+            return "fake-llamacpp"
+
+        def _answer_words(self, prompt, max_tokens):
+            if "Konteks:" in prompt:
+                source = prompt.split("Konteks:", 1)[1].split("Pertanyaan:", 1)[0]
+            else:
+                # Prompt kontekstualisasi: ulangi pertanyaan terakhir pengguna
+                source = prompt.rsplit("Human:", 1)[-1]
+                return (source.strip().rstrip("?") + "?").split()[:max_tokens]
+            words = source.split() or ["jawaban"]
+            return [words[i % len(words)] for i in range(max_tokens)]
+
+        def _stream(self, prompt, stop=None, run_manager=None, **kwargs):
+            max_tokens = int(kwargs.get("max_tokens", self.answer_tokens))
+            time.sleep(max(1, len(prompt) // 4) / self.prompt_tokens_per_second)
+            for word in self._answer_words(prompt, max_tokens):
+                time.sleep(1.0 / self.tokens_per_second)
+                chunk = GenerationChunk(text=word + " ")
+                if run_manager:
+                    run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+                yield chunk
+
+        def _call(self, prompt, stop=None, run_manager=None, **kwargs):
+            return "".join(chunk.text for chunk in self._stream(prompt, stop, run_manager, **kwargs))
+
+    return FakeLlamaCpp
+
+
+def generate_corpus(directory, doc_count, paragraphs_per_doc, rng):
+    """Menulis file .txt sintetis; setiap file membahas satu topik. Mengembalikan list (path, topik)."""
+    os.makedirs(directory, exist_ok=True)
+    files = []
+    for doc_index in range(doc_count):
+        topic = TOPIC_WORDS[doc_index % len(TOPIC_WORDS)]
+        paragraphs = []
+        for _ in range(paragraphs_per_doc):
+            words = [rng.choice(FILLER_WORDS) for _ in range(rng.randint(40, 90))]
+            for _ in range(4):
+                words.insert(rng.randrange(len(words)), topic)
+            paragraphs.append(" ".join(words).capitalize() + ".")
+        path = os.path.join(directory, f"dokumen_{doc_index:05d}.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n\n".join(paragraphs))
+        files.append((path, topic))
+    return files
+
+
+def generate_questions(query_count, rng):
+    """List (session_id, pertanyaan); sebagian pertanyaan adalah pertanyaan lanjutan di sesi yang sama."""
+    questions = []
+    session_index = 0
+    while len(questions) < query_count:
+        session_id = f"bench-session-{session_index}"
+        topic = rng.choice(TOPIC_WORDS)
+        questions.append((session_id, f"Apa pentingnya {topic} untuk {rng.choice(FILLER_WORDS)} anak balita?"))
+        if len(questions) < query_count and rng.random() < 0.5:
+            questions.append((session_id, rng.choice(FOLLOW_UP_QUESTIONS)))
+        session_index += 1
+    return questions
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+def summarize_latencies(values_by_name):
+    return {
+        name: {"count": len(values), "p50_ms": percentile(values, 50), "p95_ms": percentile(values, 95),
+               "mean_ms": float(np.mean(values)) if values else 0.0}
+        for name, values in sorted(values_by_name.items())
+    }
+
+
+def peak_rss_mb():
+    # ru_maxrss dalam KB di Linux; anak proses (parser ingestion) dilaporkan terpisah
+    self_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children_kb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return {"self_mb": self_kb / 1024, "children_mb": children_kb / 1024}
+
+
+def configure_environment(workdir, args):
+    """Mengarahkan semua path dan pengaturan ke direktori kerja benchmark sebelum modul aplikasi diimpor."""
+    import dotenv
+    # .env pengembang tidak boleh menimpa pengaturan benchmark
+    dotenv.load_dotenv = lambda *a, **k: False
+    fake_model_path = os.path.join(workdir, "fake-model.gguf")
+    open(fake_model_path, "wb").close()
+    os.environ.update({
+        "LLM_MODEL_PATH": fake_model_path,
+        "LLM_REPLICAS": "1",
+        "CHROMA_PERSIST_DIR": os.path.join(workdir, "chroma"),
+        "CHROMA_COLLECTION_NAME": "benchmark",
+        "UPLOAD_FOLDER": os.path.join(workdir, "corpus"),
+        "MODEL_CACHE_DIR": os.path.join(workdir, "model"),
+        "EMBEDDING_CACHE_PATH": os.path.join(workdir, "embedding_cache.sqlite3"),
+        "EMBEDDING_CACHE_ENABLED": "true" if args.embedding_cache else "false",
+        "SEMANTIC_CACHE_ENABLED": "false",
+        "INGEST_WORKER_MODE": "off",
+        "METRICS_PORT": "0",
+        "RAG_LOG_LEVEL": "INFO",
+        "HF_TOKEN": "",
+        "VECTOR_STORE_BACKEND": args.vector_backend,
+    })
+    if args.fake_embeddings:
+        os.environ["EMBEDDING_MODEL_NAME"] = "hashing-embeddings"
+
+
+def run_benchmark(args):
+    rng = random.Random(args.seed)
+    workdir = args.workdir or tempfile.mkdtemp(prefix="rag_bench_")
+    os.makedirs(workdir, exist_ok=True)
+    configure_environment(workdir, args)
+
+    import utils_db_sqlite
+    utils_db = utils_db_sqlite.install()
+    import utils_rag
+
+    fake_llm_class = make_fake_llm_class()
+    utils_rag._create_main_llm = lambda: fake_llm_class(
+        tokens_per_second=args.tokens_per_second,
+        prompt_tokens_per_second=args.prompt_tokens_per_second,
+        answer_tokens=args.answer_tokens,
+    )
+    if args.fake_embeddings:
+        utils_rag._create_base_embeddings = lambda: HashingEmbeddings(model_name=utils_rag.EMBEDDING_MODEL_NAME)
+
+    report = {"config": vars(args), "workdir": workdir}
+
+    started = time.monotonic()
+    if not utils_rag.initialize_rag_components():
+        print("Inisialisasi komponen RAG gagal.", file=sys.stderr)
+        return None
+    report["startup_seconds"] = time.monotonic() - started
+
+    corpus = generate_corpus(os.path.join(workdir, "corpus"), args.docs, args.paragraphs, rng)
+    files = [
+        {"id": utils_db.store_file_metadata(os.path.basename(path), path, status="pending"), "filepath": path}
+        for path, _ in corpus
+    ]
+    started = time.monotonic()
+    results, ingestion_summary = utils_rag._run_ingestion(files)
+    ingestion_summary["wall_seconds"] = time.monotonic() - started
+    ingestion_summary["files_succeeded"] = sum(1 for success, _ in results.values() if success)
+    report["ingestion"] = ingestion_summary
+
+    turn_latencies = []
+    for session_id, question in generate_questions(args.queries, rng):
+        turn_started = time.monotonic()
+        utils_rag.get_rag_response_streamlit(session_id, question)
+        turn_latencies.append((time.monotonic() - turn_started) * 1000)
+
+    span_latencies = {}
+    outcomes = {}
+    for trace in utils_db.get_turn_traces():
+        outcomes[trace["outcome"]] = outcomes.get(trace["outcome"], 0) + 1
+        for span in json.loads(trace["spans"]):
+            span_latencies.setdefault(span["name"], []).append(span["duration_ms"])
+    span_latencies["turn_total"] = turn_latencies
+    report["turns"] = {"count": len(turn_latencies), "outcomes": outcomes}
+    report["latency"] = summarize_latencies(span_latencies)
+    report["peak_rss"] = peak_rss_mb()
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark RAG offline dengan LLM dan DB pengganti.")
+    parser.add_argument("--docs", type=int, default=50, help="Jumlah dokumen sintetis")
+    parser.add_argument("--paragraphs", type=int, default=8, help="Paragraf per dokumen")
+    parser.add_argument("--queries", type=int, default=40, help="Jumlah pertanyaan")
+    parser.add_argument("--tokens-per-second", type=float, default=20.0, help="Kecepatan generasi LLM palsu")
+    parser.add_argument("--prompt-tokens-per-second", type=float, default=400.0,
+                        help="Kecepatan evaluasi prompt LLM palsu")
+    parser.add_argument("--answer-tokens", type=int, default=64, help="Panjang jawaban LLM palsu (token)")
+    parser.add_argument("--fake-embeddings", action="store_true",
+                        help="Pakai HashingEmbeddings alih-alih model SentenceTransformer")
+    parser.add_argument("--embedding-cache", action="store_true", help="Aktifkan cache embedding SQLite")
+    parser.add_argument("--vector-backend", choices=["chroma", "compact"], default="chroma",
+                        help="Backend pencarian vektor (lihat utils_vector_index)")
+    parser.add_argument("--seed", type=int, default=13)
+    parser.add_argument("--workdir", help="Direktori kerja (default: direktori sementara baru)")
+    parser.add_argument("--output", help="Tulis laporan JSON ke file ini (default: stdout)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = run_benchmark(args)
+    if report is None:
+        sys.exit(1)
+    output = json.dumps(report, indent=2, default=str)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+        print(f"Laporan benchmark ditulis ke {args.output}")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
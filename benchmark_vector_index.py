@@ -0,0 +1,189 @@
+"""
+Benchmark indeks vektor ringkas (utils_vector_index) terhadap koleksi Chroma yang sebenarnya.
+
+Menjalankan: python benchmark_vector_index.py [--questions pertanyaan.jsonl] [--dtypes float16 int8]
+Tanpa --questions, query diambil dari embedding chunk acak di koleksi (tidak perlu model
+embedding). Dengan --questions (JSONL berisi "question"), pertanyaan di-embed dengan model
+yang sama seperti aplikasi.
+
+Kebenaran dasar adalah pencarian exact float32 atas seluruh embedding koleksi. Untuk Chroma
+(HNSW) dan setiap dtype indeks ringkas diukur recall@k terhadap kebenaran dasar, latensi
+per query (p50/p95), throughput batch, dan ukuran indeks di disk (untuk backend ringkas,
+ukuran ini dibagi bersama semua proses lewat page cache).
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+from dotenv import load_dotenv
+
+from eval_retriever import percentile
+from utils_vector_index import (
+    CompactVectorIndex, collection_distance_space, compute_distances, COMPACT_INDEX_DTYPES
+)
+
+load_dotenv(override=True)
+
+CHROMA_PERSIST_DIRECTORY = os.getenv("CHROMA_PERSIST_DIR", "./chroma_db_streamlit_app")
+COLLECTION_NAME = os.getenv("CHROMA_COLLECTION_NAME", "giziai_knowledge_app")
+
+
+def load_collection():
+    from langchain_chroma import Chroma
+    return Chroma(collection_name=COLLECTION_NAME, persist_directory=CHROMA_PERSIST_DIRECTORY)._collection
+
+
+def export_embeddings(collection, page_size=2000):
+    """Seluruh embedding koleksi sebagai float32 (hanya untuk kebenaran dasar benchmark)."""
+    ids, pages = [], []
+    offset = 0
+    while True:
+        page = collection.get(include=["embeddings"], limit=page_size, offset=offset)
+        if not len(page["ids"]):
+            break
+        ids.extend(page["ids"])
+        pages.append(np.asarray(page["embeddings"], dtype=np.float32))
+        offset += len(page["ids"])
+    return ids, np.concatenate(pages) if pages else np.empty((0, 0), dtype=np.float32)
+
+
+def load_query_embeddings(args, vectors):
+    if args.questions:
+        with open(args.questions, "r", encoding="utf-8") as f:
+            questions = [json.loads(line)["question"] for line in f if line.strip()]
+        from utils_ingest import load_ingestion_components
+        _, embedding_function = load_ingestion_components()
+        return np.asarray(embedding_function.embed_documents(questions[:args.queries]), dtype=np.float32)
+    rows = random.Random(args.seed).sample(range(len(vectors)), min(args.queries, len(vectors)))
+    return vectors[rows]
+
+
+def exact_top_k(vectors, queries, k, space):
+    dots = queries @ vectors.T
+    distances = compute_distances(dots, np.linalg.norm(queries, axis=1), np.linalg.norm(vectors, axis=1), space)
+    return np.argsort(distances, axis=1)[:, :k]
+
+
+def recall_at_k(retrieved_ids, expected_ids):
+    hits = sum(len(set(got) & set(expected)) for got, expected in zip(retrieved_ids, expected_ids))
+    return hits / max(1, sum(len(expected) for expected in expected_ids))
+
+
+def measure(search_one, search_batch, queries, repeats, batch_size):
+    """(hasil per query, latensi per query dalam ms, query per detik dalam mode batch)."""
+    latencies = []
+    results = []
+    for query in queries:
+        for _ in range(repeats):
+            started = time.perf_counter()
+            result = search_one(query)
+            latencies.append((time.perf_counter() - started) * 1000)
+        results.append(result)
+    started = time.perf_counter()
+    for start in range(0, len(queries), batch_size):
+        search_batch(queries[start:start + batch_size])
+    throughput = len(queries) / max(time.perf_counter() - started, 1e-9)
+    return results, latencies, throughput
+
+
+def directory_size(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def format_table(results):
+    header = (f"{'backend':<16} {'recall@k':>8} {'p50 ms':>8} {'p95 ms':>8} {'batch q/s':>10} "
+              f"{'vektor MB':>10} {'total MB':>9} {'build s':>8}")
+    lines = [header, "-" * len(header)]
+    for r in results:
+        vector_mb = f"{r['vector_bytes'] / 1e6:>10.1f}" if r.get("vector_bytes") is not None else f"{'-':>10}"
+        total_mb = f"{r['disk_bytes'] / 1e6:>9.1f}" if r.get("disk_bytes") is not None else f"{'-':>9}"
+        build = f"{r['build_seconds']:>8.2f}" if r.get("build_seconds") is not None else f"{'-':>8}"
+        lines.append(
+            f"{r['backend']:<16} {r['recall_at_k']:>8.3f} {r['latency_p50_ms']:>8.2f} {r['latency_p95_ms']:>8.2f} "
+            f"{r['batch_qps']:>10.1f} {vector_mb} {total_mb} {build}"
+        )
+    return "\n".join(lines)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Recall dan latensi indeks vektor ringkas vs Chroma.")
+    parser.add_argument("--questions", help="File JSONL berisi question (default: embedding chunk acak)")
+    parser.add_argument("--queries", type=int, default=200, help="Jumlah query")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--dtypes", nargs="+", default=list(COMPACT_INDEX_DTYPES), choices=COMPACT_INDEX_DTYPES)
+    parser.add_argument("--repeats", type=int, default=3, help="Ulangan pencarian per query untuk latensi")
+    parser.add_argument("--batch-size", type=int, default=32, help="Ukuran batch untuk pengukuran throughput")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Tulis hasil ke file JSON ini")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    collection = load_collection()
+    space = collection_distance_space(collection)
+    ids, vectors = export_embeddings(collection)
+    if not ids:
+        print(f"Koleksi '{COLLECTION_NAME}' di {CHROMA_PERSIST_DIRECTORY} kosong.")
+        sys.exit(1)
+    queries = load_query_embeddings(args, vectors)
+    k = min(args.k, len(ids))
+    print(f"{len(ids)} chunk, {vectors.shape[1]} dimensi, jarak {space}; {len(queries)} query, k={k}.")
+    expected_ids = [[ids[row] for row in rows] for rows in exact_top_k(vectors, queries, k, space)]
+
+    results = []
+    chroma_ids, latencies, throughput = measure(
+        lambda query: collection.query(query_embeddings=[query.tolist()], n_results=k, include=[])["ids"][0],
+        lambda batch: collection.query(query_embeddings=batch.tolist(), n_results=k, include=[]),
+        queries, args.repeats, args.batch_size,
+    )
+    results.append({
+        "backend": "chroma (HNSW)", "recall_at_k": recall_at_k(chroma_ids, expected_ids),
+        "latency_p50_ms": percentile(latencies, 50), "latency_p95_ms": percentile(latencies, 95),
+        "batch_qps": throughput, "vector_bytes": vectors.nbytes,
+        "disk_bytes": directory_size(CHROMA_PERSIST_DIRECTORY), "build_seconds": None,
+    })
+
+    with tempfile.TemporaryDirectory(prefix="compact_index_bench_") as workdir:
+        for dtype in args.dtypes:
+            index = CompactVectorIndex(os.path.join(workdir, dtype))
+            started = time.perf_counter()
+            index.build_from_collection(collection, dtype=dtype)
+            build_seconds = time.perf_counter() - started
+            snapshot = index.snapshot()
+
+            def search_one(query):
+                rows, _ = snapshot.search(query[None, :], k)
+                return [int(row) for row in rows[0]]
+
+            compact_rows, latencies, throughput = measure(
+                search_one, lambda batch: snapshot.search(batch, k), queries, args.repeats, args.batch_size
+            )
+            # Baris indeks dipetakan ke chunk_id lewat tabel samping (di luar pengukuran latensi)
+            compact_ids = [[doc.id for doc in snapshot.get_documents(rows)] for rows in compact_rows]
+            usage = index.disk_usage()
+            results.append({
+                "backend": f"compact {dtype}", "recall_at_k": recall_at_k(compact_ids, expected_ids),
+                "latency_p50_ms": percentile(latencies, 50), "latency_p95_ms": percentile(latencies, 95),
+                "batch_qps": throughput,
+                "vector_bytes": usage.get("vectors.npy", 0) + usage.get("scales.npy", 0) + usage.get("norms.npy", 0),
+                "disk_bytes": sum(usage.values()), "build_seconds": build_seconds,
+            })
+            snapshot.close()
+
+    print(format_table(results))
+    print("vektor MB: embedding dalam RAM/page cache (Chroma: float32 mentah, tanpa overhead graf HNSW).")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"chunks": len(ids), "queries": len(queries), "k": k, "space": space, "results": results},
+                      f, indent=2)
+        print(f"Hasil ditulis ke {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""
+Evaluasi kualitas vs kecepatan retriever terhadap koleksi Chroma yang sebenarnya.
+
+Menjalankan: python eval_retriever.py --labels labels.jsonl [--hybrid] [--write-config]
+File label berisi satu JSON per baris: {"question": "...", "sources": ["nama_file.pdf", ...]}.
+Sebuah chunk dianggap relevan jika nama file sumbernya ada di "sources".
+Setiap kombinasi search_type dan parameternya diukur dengan recall@k, MRR, dan
+latensi pencarian per pertanyaan (embedding pertanyaan dihitung sekali dan tidak
+ikut diukur). Hasilnya berupa tabel dengan penanda Pareto; pengaturan terbaik
+dalam batas latensi dapat ditulis ke RETRIEVER_CONFIG_PATH yang dibaca utils_rag.
+"""
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+
+from dotenv import load_dotenv
+
+from utils_retrieval import reciprocal_rank_fusion, get_documents_by_ids, save_retriever_config, search_vectorstore
+from utils_vector_index import is_compact_backend_enabled
+
+load_dotenv(override=True)
+
+RETRIEVER_CONFIG_PATH = os.getenv("RETRIEVER_CONFIG_PATH", "retriever_config.json")
+HYBRID_BM25_K = int(os.getenv("HYBRID_BM25_K", 10))
+HYBRID_RRF_K = int(os.getenv("HYBRID_RRF_K", 60))
+
+
+def load_labels(path):
+    labels = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            if not item.get("question") or not item.get("sources"):
+                print(f"Baris {line_number} dilewati: butuh 'question' dan 'sources'.")
+                continue
+            labels.append({"question": item["question"], "sources": {os.path.basename(s) for s in item["sources"]}})
+    return labels
+
+
+def build_settings(args):
+    """Daftar (search_type, search_kwargs) yang akan diuji."""
+    settings = []
+    if "similarity" in args.search_types:
+        settings.extend(("similarity", {"k": k}) for k in args.k)
+    if "mmr" in args.search_types:
+        for k, fetch_k, lambda_mult in itertools.product(args.k, args.fetch_k, args.lambda_mult):
+            if fetch_k >= k:
+                settings.append(("mmr", {"k": k, "fetch_k": fetch_k, "lambda_mult": lambda_mult}))
+    return settings
+
+
+def search(vectorstore, query_embedding, search_type, search_kwargs):
+    """Jalur pencarian yang sama dengan utils_rag.retrieve_documents."""
+    return search_vectorstore(vectorstore, [query_embedding], search_type, search_kwargs)[0]
+
+
+def hybrid_search(vectorstore, lexical_index, question, query_embedding, search_type, search_kwargs):
+    """Sama dengan utils_rag._hybrid_retrieve: BM25 + vektor digabung dengan RRF."""
+    lexical_hits = lexical_index.search(question, k=HYBRID_BM25_K)
+    lexical_docs = get_documents_by_ids(vectorstore._collection, [chunk_id for chunk_id, _ in lexical_hits])
+    vector_docs = search(vectorstore, query_embedding, search_type, search_kwargs)
+    fused = reciprocal_rank_fusion([vector_docs, lexical_docs], rrf_k=HYBRID_RRF_K)
+    return [doc for doc, _ in fused[:search_kwargs["k"]]]
+
+
+def score_ranking(docs, relevant_sources):
+    """(recall sumber di top-k, reciprocal rank chunk relevan pertama)."""
+    retrieved_sources = [os.path.basename((doc.metadata or {}).get("source", "")) for doc in docs]
+    found = relevant_sources & set(retrieved_sources)
+    recall = len(found) / len(relevant_sources)
+    reciprocal_rank = 0.0
+    for rank, source in enumerate(retrieved_sources, start=1):
+        if source in relevant_sources:
+            reciprocal_rank = 1.0 / rank
+            break
+    return recall, reciprocal_rank
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, int(round(q / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def evaluate_setting(vectorstore, lexical_index, labels, query_embeddings, search_type, search_kwargs, repeats):
+    recalls, reciprocal_ranks, latencies = [], [], []
+    for label, query_embedding in zip(labels, query_embeddings):
+        for repeat in range(repeats):
+            started = time.perf_counter()
+            if lexical_index is not None:
+                docs = hybrid_search(vectorstore, lexical_index, label["question"], query_embedding,
+                                     search_type, search_kwargs)
+            else:
+                docs = search(vectorstore, query_embedding, search_type, search_kwargs)
+            latencies.append((time.perf_counter() - started) * 1000)
+        recall, reciprocal_rank = score_ranking(docs, label["sources"])
+        recalls.append(recall)
+        reciprocal_ranks.append(reciprocal_rank)
+    return {
+        "search_type": search_type,
+        "search_kwargs": search_kwargs,
+        "recall_at_k": sum(recalls) / len(recalls),
+        "mrr": sum(reciprocal_ranks) / len(reciprocal_ranks),
+        "latency_p50_ms": percentile(latencies, 50),
+        "latency_p95_ms": percentile(latencies, 95),
+    }
+
+
+def mark_pareto(results):
+    """Menandai hasil yang tidak didominasi (recall, MRR lebih tinggi; latensi p50 lebih rendah)."""
+    for result in results:
+        result["pareto"] = not any(
+            other is not result
+            and other["recall_at_k"] >= result["recall_at_k"]
+            and other["mrr"] >= result["mrr"]
+            and other["latency_p50_ms"] <= result["latency_p50_ms"]
+            and (other["recall_at_k"] > result["recall_at_k"] or other["mrr"] > result["mrr"]
+                 or other["latency_p50_ms"] < result["latency_p50_ms"])
+            for other in results
+        )
+    return results
+
+
+def choose_setting(results, max_latency_ms=None):
+    """Recall tertinggi (lalu MRR, lalu latensi) di antara titik Pareto dalam batas latensi p50."""
+    candidates = [r for r in results if r["pareto"]]
+    if max_latency_ms is not None:
+        within_budget = [r for r in candidates if r["latency_p50_ms"] <= max_latency_ms]
+        candidates = within_budget or candidates
+    return max(candidates, key=lambda r: (r["recall_at_k"], r["mrr"], -r["latency_p50_ms"]), default=None)
+
+
+def format_table(results, chosen=None):
+    header = f"{'':2}{'search_type':<11} {'params':<38} {'recall@k':>8} {'MRR':>6} {'p50 ms':>8} {'p95 ms':>8}"
+    lines = [header, "-" * len(header)]
+    ordered = sorted(results, key=lambda r: (not r["pareto"], r["latency_p50_ms"]))
+    for r in ordered:
+        marker = ("*" if r["pareto"] else " ") + (">" if r is chosen else " ")
+        params = ", ".join(f"{key}={value}" for key, value in r["search_kwargs"].items())
+        lines.append(
+            f"{marker}{r['search_type']:<11} {params:<38} {r['recall_at_k']:>8.3f} {r['mrr']:>6.3f} "
+            f"{r['latency_p50_ms']:>8.2f} {r['latency_p95_ms']:>8.2f}"
+        )
+    lines.append("* = Pareto-optimal, > = pengaturan terpilih")
+    return "\n".join(lines)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Sweep parameter retriever: recall@k, MRR, dan latensi.")
+    parser.add_argument("--labels", required=True, help="File JSONL berisi question dan sources")
+    parser.add_argument("--search-types", nargs="+", default=["similarity", "mmr"], choices=["similarity", "mmr"])
+    parser.add_argument("--k", nargs="+", type=int, default=[3, 5, 8])
+    parser.add_argument("--fetch-k", nargs="+", type=int, default=[10, 20, 40, 100])
+    parser.add_argument("--lambda-mult", nargs="+", type=float, default=[0.5, 0.7, 1.0])
+    parser.add_argument("--hybrid", action="store_true", help="Ukur retrieval hybrid (BM25 + vektor) seperti di aplikasi")
+    parser.add_argument("--repeats", type=int, default=3, help="Ulangan pencarian per pertanyaan untuk latensi")
+    parser.add_argument("--max-latency-ms", type=float, help="Batas latensi p50 untuk pengaturan terpilih")
+    parser.add_argument("--write-config", action="store_true", help=f"Tulis pengaturan terpilih ke {RETRIEVER_CONFIG_PATH}")
+    parser.add_argument("--output", help="Tulis semua hasil ke file JSON ini")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    labels = load_labels(args.labels)
+    if not labels:
+        print("Tidak ada pertanyaan berlabel yang valid.")
+        sys.exit(1)
+
+    from utils_ingest import load_ingestion_components, get_lexical_index
+    vectorstore, embedding_function = load_ingestion_components()
+    if is_compact_backend_enabled():
+        from utils_vector_index import CompactVectorStore, ensure_compact_index
+        vectorstore = CompactVectorStore(vectorstore, ensure_compact_index(vectorstore._collection))
+        print(f"Mengukur backend indeks ringkas ({len(vectorstore.index)} chunk).")
+    lexical_index = get_lexical_index(vectorstore._collection) if args.hybrid else None
+
+    started = time.perf_counter()
+    query_embeddings = embedding_function.embed_documents([label["question"] for label in labels])
+    print(f"{len(labels)} pertanyaan di-embed dalam {time.perf_counter() - started:.2f} detik.")
+
+    settings = build_settings(args)
+    results = []
+    for search_type, search_kwargs in settings:
+        results.append(evaluate_setting(vectorstore, lexical_index, labels, query_embeddings,
+                                        search_type, search_kwargs, args.repeats))
+    mark_pareto(results)
+    chosen = choose_setting(results, args.max_latency_ms)
+    print(format_table(results, chosen))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"hybrid": args.hybrid, "results": results, "chosen": chosen}, f, indent=2)
+        print(f"Hasil ditulis ke {args.output}")
+    if args.write_config and chosen:
+        metrics = {key: chosen[key] for key in ("recall_at_k", "mrr", "latency_p50_ms", "latency_p95_ms")}
+        save_retriever_config(RETRIEVER_CONFIG_PATH, chosen["search_type"], chosen["search_kwargs"], metrics)
+        print(f"Pengaturan terpilih ditulis ke {RETRIEVER_CONFIG_PATH}; muat ulang sistem RAG dari halaman admin untuk memakainya.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+"""
+Ekspor model embedding ke ONNX dengan kuantisasi dinamis int8 untuk EMBEDDING_BACKEND=onnx.
+
+Menjalankan: python export_onnx_embeddings.py [--model intfloat/multilingual-e5-large] [--output DIR]
+Butuh optimum[onnxruntime] dan PyTorch (hanya di mesin yang melakukan ekspor); aplikasi
+dan worker ingestion cukup memakai onnxruntime dan tokenizers. Hasil default ditulis ke
+MODEL_CACHE_DIR/onnx/<nama model>, lokasi yang dibaca utils_embeddings. Periksa kesetaraan
+vektornya dengan benchmark_embeddings.py sebelum backend diaktifkan.
+"""
+import argparse
+import os
+
+from utils_embeddings import default_onnx_model_dir, export_onnx_model
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Ekspor model embedding ke ONNX (int8).")
+    parser.add_argument("--model", default=os.getenv("EMBEDDING_MODEL_NAME", "intfloat/multilingual-e5-large"))
+    parser.add_argument("--output", help="Direktori keluaran (default: MODEL_CACHE_DIR/onnx/<nama model>)")
+    parser.add_argument("--no-quantize", action="store_true", help="Hanya ekspor float32, tanpa model int8")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    output_dir = export_onnx_model(args.model, args.output or default_onnx_model_dir(args.model),
+                                   quantize=not args.no_quantize)
+    for name in sorted(os.listdir(output_dir)):
+        if name.endswith((".onnx", ".onnx_data")):
+            print(f"  {name}: {os.path.getsize(os.path.join(output_dir, name)) / 1e6:.1f} MB")
+    print(f"Selesai. Aktifkan dengan EMBEDDING_BACKEND=onnx (direktori: {output_dir}).")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+"""
+Worker ingestion mandiri, untuk memproses dokumen saat aplikasi Streamlit tidak berjalan
+(misalnya ingestion awal dalam jumlah besar).
+
+Menjalankan: python ingest_worker.py
+Worker mengklaim file 'pending'/'processing' dari tabel knowledge_files dan
+memprosesnya ke vector store. Chroma PersistentClient tidak mendukung beberapa proses
+pada direktori yang sama, jadi worker ini dan aplikasi saling mengunci direktori Chroma
+(utils_ingest.acquire_chroma_process_lock): yang kedua berhenti dengan pesan error.
+Selama aplikasi berjalan, dokumen diproses oleh worker thread di dalam aplikasi.
+"""
+import sys
+import signal
+
+import utils_db
+from utils_ingest import IngestionWorker, load_ingestion_components
+
+
+def main():
+    utils_db.ensure_schema()
+    try:
+        vectorstore, embedding_function = load_ingestion_components()
+    except RuntimeError as e:
+        print(f"Worker ingestion tidak dijalankan: {e}", file=sys.stderr)
+        sys.exit(1)
+    worker = IngestionWorker(vectorstore, embedding_function)
+
+    def handle_signal(signum, frame):
+        print(f"Sinyal {signum} diterima, menghentikan worker...")
+        worker.stop()
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+    worker.run_forever()
+
+
+if __name__ == "__main__":
+    main()
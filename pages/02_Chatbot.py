@@ -4,7 +4,7 @@ import os # Untuk os.path.basename jika diperlukan nanti
 
 # utils_db dan utils_rag akan diimpor oleh app.py dan komponennya sudah di-cache/inisialisasi
 from utils_db import get_chat_history_from_db # insert_chat_log dipanggil dari dalam RAG system
-from utils_rag import get_rag_response_streamlit # Menggunakan fungsi RAG baru
+from utils_rag import stream_rag_response_streamlit, start_rag_startup, is_rag_ready, get_rag_readiness
 from langchain_core.messages import HumanMessage, AIMessage
 
 st.set_page_config(page_title="Chatbot GiziAI", layout="wide")
@@ -12,12 +12,18 @@ st.title("💬 Chatbot GiziAI")
 st.markdown("Ajukan pertanyaan Anda seputar gizi dan kesehatan masyarakat kepada GiziAI!")
 
 # --- Cek Status Inisialisasi RAG ---
-# Diasumsikan initialize_rag_components() sudah dipanggil di app.py atau halaman utama
-# dan statusnya tersimpan di st.session_state.rag_initialized_status
-if st.session_state.get('rag_initialized_status') != "success":
-    st.warning("Komponen AI belum siap atau gagal dimuat. Chatbot tidak dapat berfungsi saat ini.")
-    st.info("Silakan periksa halaman utama untuk status inisialisasi AI atau hubungi admin.")
-    # Tombol untuk mencoba inisialisasi ulang bisa ada di halaman utama (app.py)
+# Startup bertahap berjalan sekali per proses; halaman ini juga memicunya
+# jika pengguna langsung membuka chatbot tanpa melalui halaman utama
+start_rag_startup()
+if not is_rag_ready():
+    readiness = get_rag_readiness()
+    if readiness.get("finished"):
+        st.warning("Komponen AI gagal dimuat. Chatbot tidak dapat berfungsi saat ini.")
+    else:
+        st.warning("Komponen AI sedang dimuat. Silakan tunggu sebentar lalu perbarui halaman.")
+    pending = [name for name, c in readiness["components"].items() if c["state"] in ("pending", "loading", "failed")]
+    st.info(f"Komponen yang belum siap: {', '.join(pending) or '-'}. Status lengkap ada di halaman utama.")
+    st.button("Perbarui Status", key="refresh_rag_readiness_chatbot")
     st.stop()
 
 # --- Manajemen Sesi Chat ---
@@ -50,6 +56,12 @@ for message in st.session_state.chat_history_display:
     with st.chat_message(message.type, avatar=avatar_map.get(message.type)):
         st.markdown(message.content)
 
+def _chain_first_chunk(first_chunk, response_stream):
+    """Gabungkan kembali chunk pertama (diambil di bawah spinner) dengan sisa stream."""
+    if first_chunk:
+        yield first_chunk
+    yield from response_stream
+
 # --- Tangani Input Pengguna ---
 user_query = st.chat_input("Ketik pertanyaan Anda di sini...")
 
@@ -60,15 +72,16 @@ if user_query:
     st.chat_message("human", avatar="🧑‍💻").markdown(user_query)
     st.session_state.chat_history_display.append(HumanMessage(content=user_query))
     
-    # Dapatkan respons dari RAG system
-    with st.spinner("GiziAI sedang berpikir dan mencari informasi... 🧠"):
-        # Panggil fungsi RAG baru Anda
-        # Fungsi ini sudah menangani penyimpanan ke DB di dalamnya
-        ai_response_content = get_rag_response_streamlit(st.session_state.session_id, user_query)
+    # Dapatkan respons dari RAG system secara streaming agar token pertama langsung tampil.
+    # Fungsi ini sudah menangani post-processing dan penyimpanan ke DB setelah stream selesai.
+    with st.chat_message("ai", avatar="🍎"):
+        with st.spinner("GiziAI sedang berpikir dan mencari informasi... 🧠"):
+            response_stream = stream_rag_response_streamlit(st.session_state.session_id, user_query)
+            first_chunk = next(response_stream, "")
+        ai_response_content = st.write_stream(_chain_first_chunk(first_chunk, response_stream))
     
-    # Tampilkan respons AI di UI dan tambahkan ke histori display
-    st.chat_message("ai", avatar="🍎").markdown(ai_response_content)
-    st.session_state.chat_history_display.append(AIMessage(content=ai_response_content))
+    # Tambahkan respons AI ke histori display
+    st.session_state.chat_history_display.append(AIMessage(content=ai_response_content.strip()))
     
-    # Tidak perlu insert_chat_log lagi di sini karena sudah dihandle di get_rag_response_streamlit
+    # Tidak perlu insert_chat_log lagi di sini karena sudah dihandle di stream_rag_response_streamlit
     # st.rerun() # Tidak selalu perlu, st.chat_input biasanya memicu rerun. Jika ada update aneh, baru tambahkan.
\ No newline at end of file
@@ -1,8 +1,8 @@
 import streamlit as st
 import os
 from werkzeug.utils import secure_filename # Untuk mengamankan nama file
-from utils_db import store_file_metadata, update_file_status, verify_admin, get_active_knowledge_files
-from utils_rag import initialize_rag_components, process_document_to_vectorstore_streamlit # Impor fungsi yang relevan
+from utils_db import store_file_metadata, verify_admin, get_active_knowledge_files, get_knowledge_files_overview
+from utils_rag import reload_rag_engine, get_rag_readiness # Impor fungsi yang relevan
 
 st.set_page_config(page_title="Panel Admin", layout="centered")
 
@@ -30,7 +30,7 @@ def admin_panel_content():
     )
 
     if uploaded_files:
-        files_processed_successfully_count = 0
+        files_queued_count = 0
         files_failed_count = 0
 
         for uploaded_file in uploaded_files:
@@ -42,20 +42,13 @@ def admin_panel_content():
                     f.write(uploaded_file.getbuffer())
                 st.info(f"File '{filename}' berhasil disimpan ke server.")
                 
-                # Simpan metadata ke DB dengan status awal 'processing'
-                # Fungsi process_document_to_vectorstore_streamlit akan mengupdate ke 'active' atau 'error'
-                file_id = store_file_metadata(filename, filepath, status='processing')
+                # Simpan metadata ke DB dengan status awal 'pending'.
+                # Worker ingestion latar belakang akan mengklaim file ini dan mengupdate ke 'active' atau 'error'
+                file_id = store_file_metadata(filename, filepath, status='pending')
                 
                 if file_id:
-                    st.success(f"Metadata untuk '{filename}' (ID DB: {file_id}) dicatat. Memulai proses embedding...")
-                    # Langsung proses file setelah diunggah
-                    with st.spinner(f"Memproses '{filename}' dan menambahkan ke basis pengetahuan..."):
-                        if process_document_to_vectorstore_streamlit(filepath, file_id):
-                            st.success(f"File '{filename}' berhasil diproses dan ditambahkan ke RAG.")
-                            files_processed_successfully_count += 1
-                        else:
-                            st.error(f"Gagal memproses file '{filename}' untuk RAG. Status di DB akan menjadi 'error'.")
-                            files_failed_count += 1
+                    st.success(f"'{filename}' (ID DB: {file_id}) masuk antrean pemrosesan.")
+                    files_queued_count += 1
                 else:
                     st.error(f"Gagal menyimpan metadata untuk '{filename}' ke database.")
                     files_failed_count += 1
@@ -63,12 +56,28 @@ def admin_panel_content():
                 st.error(f"Gagal menyimpan atau memproses file '{filename}': {e}")
                 files_failed_count += 1
         
-        if files_processed_successfully_count > 0 or files_failed_count > 0:
-            st.info(f"Total file berhasil diproses: {files_processed_successfully_count}, Gagal: {files_failed_count}.")
+        if files_queued_count > 0 or files_failed_count > 0:
+            st.info(f"Total file masuk antrean: {files_queued_count}, Gagal: {files_failed_count}.")
             # Ubah akhiran kunci agar uploader di-reset pada run berikutnya
             st.session_state.uploader_key_suffix += 1
             st.rerun() # Panggil rerun untuk memperbarui UI dengan kunci baru dan membersihkan uploader
 
+    st.subheader("Progres Pemrosesan File")
+    st.button("Perbarui Status", key="refresh_ingestion_status_admin")
+    files_overview = get_knowledge_files_overview()
+    in_progress_files = [f for f in files_overview if f['status'] in ('pending', 'processing')]
+    if in_progress_files:
+        st.write("File yang sedang menunggu atau diproses:")
+        for f in in_progress_files:
+            st.markdown(f"- `{f['filename']}` (ID {f['id']}): **{f['status']}** — {f['progress'] or 'menunggu worker'}")
+    else:
+        st.info("Tidak ada file dalam antrean pemrosesan.")
+    failed_files = [f for f in files_overview if f['status'] == 'error']
+    if failed_files:
+        with st.expander(f"File gagal diproses ({len(failed_files)})"):
+            for f in failed_files:
+                st.markdown(f"- `{f['filename']}` (ID {f['id']}): {f['progress'] or 'error'}")
+
     st.subheader("Status Basis Pengetahuan Saat Ini")
     active_files_paths = get_active_knowledge_files()
     if active_files_paths:
@@ -78,14 +87,25 @@ def admin_panel_content():
     else:
         st.info("Belum ada file aktif dalam basis pengetahuan.")
 
+    # Engine baru dibangun di samping engine aktif lalu ditukar; chat yang sedang berjalan tidak terputus
+    reload_models = st.checkbox(
+        "Muat ulang model LLM dan embedding juga (memori sempat dua kali lipat selama pemuatan)",
+        key="reload_models_checkbox_admin"
+    )
     if st.button("Muat Ulang Sistem RAG & Proses Dokumen Pending", key="reinit_rag_button_admin"):
-        with st.spinner("Memuat ulang sistem RAG dan memproses dokumen yang mungkin tertunda..."):
-            # Memanggil initialize_rag_components akan memuat ulang komponen
-            # dan juga memanggil process_pending_documents_streamlit di dalamnya
-            if initialize_rag_components(): 
-                st.success("Sistem RAG berhasil dimuat ulang dan dokumen pending (jika ada) telah diproses!")
+        with st.spinner("Memuat ulang sistem RAG..."):
+            # Dokumen pending tidak diproses di sini; worker ingestion latar belakang yang mengambilnya
+            tracker = reload_rag_engine(reload_models=reload_models)
+            tracker.wait()
+            components = tracker.status()
+            if components.get("activate", {}).get("state") == "ready":
+                st.success(f"Sistem RAG berhasil dimuat ulang. {components['activate']['detail']}")
+                ingestion = components.get("ingestion_worker", {})
+                st.info(ingestion.get("detail") or ingestion.get("error") or "")
             else:
-                st.error("Gagal memuat ulang sistem RAG.")
+                failed = {name: c["error"] for name, c in components.items() if c["state"] == "failed"}
+                st.error(f"Gagal memuat ulang sistem RAG; engine sebelumnya tetap dipakai. {failed}")
+    st.caption(f"Generasi engine RAG aktif: {get_rag_readiness().get('engine_generation', '-')}")
 
 # --- Logika Otentikasi Admin ---
 if 'logged_in_admin' not in st.session_state:
@@ -111,7 +131,7 @@ else:
     admin_panel_content()
     if st.button("Logout Admin", key="logout_button_admin_page_v3"):
         keys_to_delete = ['logged_in_admin', 'username', 
-                          'rag_initialized_status', 'initial_greeting_displayed', 
+                          'initial_greeting_displayed', 
                           'chat_history_display', 'session_id',
                           'uploader_key_suffix'] 
         for key_to_del in keys_to_delete:
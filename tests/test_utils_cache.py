@@ -0,0 +1,72 @@
+import json
+import os
+import time
+
+from utils_cache import EmbeddingCache, SemanticAnswerCache
+
+
+def test_add_does_not_write_file_until_saved(tmp_path):
+    path = str(tmp_path / "semantic_cache.json")
+    cache = SemanticAnswerCache(persist_path=path, save_interval=3600)
+    for index in range(20):
+        cache.add(f"pertanyaan {index}", [1.0, float(index)], f"jawaban {index}")
+    assert not os.path.exists(path)
+
+    cache.shutdown()
+    with open(path, "r", encoding="utf-8") as f:
+        assert len(json.load(f)) == 20
+    assert SemanticAnswerCache(persist_path=path).lookup([1.0, 19.0])[0] == "jawaban 19"
+
+
+def test_background_saver_writes_changes(tmp_path):
+    path = str(tmp_path / "semantic_cache.json")
+    cache = SemanticAnswerCache(persist_path=path, save_interval=0.05)
+    cache.add("pertanyaan", [1.0, 0.0], "jawaban")
+    deadline = time.monotonic() + 5
+    while not os.path.exists(path) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert os.path.exists(path)
+
+    cache.clear()
+    cache.shutdown()
+    with open(path, "r", encoding="utf-8") as f:
+        assert json.load(f) == []
+
+
+def _traced_statements(cache):
+    statements = []
+    cache._conn.set_trace_callback(statements.append)
+    return statements
+
+
+def test_embedding_cache_hits_do_not_write_until_flushed(tmp_path):
+    cache = EmbeddingCache(path=str(tmp_path / "embeddings.sqlite3"), max_entries=100, touch_batch=1000,
+                           touch_interval=3600)
+    cache.put_many("model", ["teks a", "teks b"], [[1.0, 0.0], [0.0, 1.0]])
+    statements = _traced_statements(cache)
+
+    for _ in range(20):
+        assert cache.get_many("model", ["teks a"]) == [[1.0, 0.0]]
+    assert not [sql for sql in statements if sql.startswith(("UPDATE", "COMMIT"))]
+
+    cache.flush()
+    assert len([sql for sql in statements if sql.startswith("UPDATE")]) == 1
+
+
+def test_embedding_cache_counts_rows_only_when_over_the_limit(tmp_path):
+    cache = EmbeddingCache(path=str(tmp_path / "embeddings.sqlite3"), max_entries=40, touch_batch=1000,
+                           touch_interval=3600)
+    cache.put_many("model", [f"lama {i}" for i in range(20)], [[float(i), 1.0] for i in range(20)])
+    # Entri yang baru dipakai (last_used tertunda) tidak boleh ikut tergusur
+    cache.get_many("model", ["lama 0"])
+    statements = _traced_statements(cache)
+
+    for i in range(20):
+        cache.put_many("model", [f"baru {i}"], [[float(i), 2.0]])
+    assert not [sql for sql in statements if "COUNT(*)" in sql]
+
+    for i in range(20, 30):
+        cache.put_many("model", [f"baru {i}"], [[float(i), 2.0]])
+    assert cache.get_stats()["entries"] <= 40
+    assert cache.get_many("model", ["lama 0"]) == [[0.0, 1.0]]
+    assert cache.get_many("model", ["lama 1"]) == [None]
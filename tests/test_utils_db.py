@@ -0,0 +1,209 @@
+import json
+
+import mysql.connector
+
+import utils_db
+
+
+class _Connection:
+    def __init__(self):
+        self.closed = False
+
+    def ping(self, reconnect=True, attempts=1, delay=0):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+class _ExhaustedPool:
+    """Pool yang melempar PoolError seperti MySQLConnectionPool saat semua koneksi dipakai."""
+
+    def __init__(self, free_after_attempts=None):
+        self.attempts = 0
+        self.free_after_attempts = free_after_attempts
+
+    def get_connection(self):
+        self.attempts += 1
+        if self.free_after_attempts is not None and self.attempts > self.free_after_attempts:
+            return _Connection()
+        raise mysql.connector.errors.PoolError("Failed getting connection; pool exhausted")
+
+
+def test_exhausted_pool_returns_none_after_timeout(monkeypatch):
+    pool = _ExhaustedPool()
+    monkeypatch.setattr(utils_db, "_get_pool", lambda: pool)
+    monkeypatch.setattr(utils_db, "DB_POOL_TIMEOUT", 0.05)
+    timeouts_before = utils_db.get_pool_stats()["timeouts"]
+
+    assert utils_db.get_db_connection() is None
+    assert pool.attempts > 1
+    assert utils_db.get_pool_stats()["timeouts"] == timeouts_before + 1
+
+
+def test_waits_until_connection_is_returned_to_pool(monkeypatch):
+    pool = _ExhaustedPool(free_after_attempts=3)
+    monkeypatch.setattr(utils_db, "_get_pool", lambda: pool)
+    monkeypatch.setattr(utils_db, "DB_POOL_TIMEOUT", 5)
+
+    conn = utils_db.get_db_connection()
+    assert isinstance(conn, _Connection)
+    assert pool.attempts == 4
+
+
+def test_db_connection_yields_none_when_pool_exhausted(monkeypatch):
+    monkeypatch.setattr(utils_db, "_get_pool", lambda: _ExhaustedPool())
+    monkeypatch.setattr(utils_db, "DB_POOL_TIMEOUT", 0.02)
+
+    with utils_db.db_connection() as conn:
+        assert conn is None
+
+
+def _entry(session_id, query, turn_key):
+    return {"session_id": session_id, "user_query": query, "gpt_response": f"jawaban {query}",
+            "model_name": "test", "created_at": "2026-01-01 00:00:00", "trace": None, "turn_key": turn_key}
+
+
+def test_history_read_does_not_wait_for_slow_flush(tmp_path):
+    import threading
+    import time
+
+    db_rows = []
+    release = threading.Event()
+    flush_started = threading.Event()
+
+    def slow_write_batch(entries):
+        flush_started.set()
+        release.wait(5)  # MySQL lambat: flush menahan _flush_lock
+        db_rows.extend({"user_query": e["user_query"], "gpt_response": e["gpt_response"],
+                        "turn_key": e["turn_key"]} for e in entries)
+        return True
+
+    writer = utils_db.ChatLogWriter(write_batch=slow_write_batch, spill_path=str(tmp_path / "spill.jsonl"))
+    writer._pending.append(_entry("s1", "q1", "k1"))
+    flusher = threading.Thread(target=writer.flush)
+    flusher.start()
+    try:
+        assert flush_started.wait(2)
+        started = time.monotonic()
+        rows = writer.read_with_pending("s1", lambda: list(db_rows))
+        assert time.monotonic() - started < 1
+        assert [row["user_query"] for row in rows] == ["q1"]
+    finally:
+        release.set()
+        flusher.join()
+
+
+def test_turn_written_during_read_is_not_duplicated(tmp_path):
+    writer = utils_db.ChatLogWriter(write_batch=lambda entries: True, spill_path=str(tmp_path / "spill.jsonl"))
+    writer._pending.extend([_entry("s1", "q1", "k1"), _entry("s1", "q2", "k2"), _entry("s2", "x", "k3")])
+
+    def read_rows():
+        # Flush selesai di antara salinan antrean dan pembacaan DB
+        writer.flush()
+        return [{"user_query": "q1", "gpt_response": "jawaban q1", "turn_key": "k1"},
+                {"user_query": "q2", "gpt_response": "jawaban q2", "turn_key": "k2"}]
+
+    rows = writer.read_with_pending("s1", read_rows)
+    assert [row["user_query"] for row in rows] == ["q1", "q2"]
+
+
+def test_traces_are_linked_by_turn_key(monkeypatch):
+    from contextlib import contextmanager
+
+    executed = []
+
+    class _Cursor:
+        def executemany(self, sql, params):
+            executed.append((" ".join(sql.split()), list(params)))
+
+        def close(self):
+            pass
+
+    class _Conn:
+        def cursor(self):
+            return _Cursor()
+
+        def commit(self):
+            pass
+
+    @contextmanager
+    def fake_connection():
+        yield _Conn()
+
+    monkeypatch.setattr(utils_db, "db_connection", fake_connection)
+    traced = _entry("s1", "q1", "k1")
+    traced["trace"] = {"outcome": "answered", "total_ms": 12.5, "spans": "{}"}
+    assert utils_db._write_chat_log_batch([_entry("s1", "q0", "k0"), traced])
+
+    (insert_sql, insert_rows), (trace_sql, trace_rows) = executed
+    assert [row[-1] for row in insert_rows] == ["k0", "k1"]
+    assert "WHERE turn_key = %s" in trace_sql
+    assert trace_rows == [("s1", "answered", 12.5, "{}", "k1")]
+
+
+def test_corrupt_spill_lines_are_skipped(tmp_path):
+    spill_path = tmp_path / "spill.jsonl"
+    spill_path.write_text(
+        json.dumps(_entry("s1", "q1", "k1")) + "\n"
+        + '{"session_id": "s1", "user_query": "terpo\n'
+        + json.dumps({"session_id": "s1"}) + "\n"
+        + json.dumps(_entry("s1", "q2", "k2")) + "\n",
+        encoding="utf-8",
+    )
+    written = []
+    writer = utils_db.ChatLogWriter(write_batch=lambda entries: written.extend(entries) or True,
+                                    spill_path=str(spill_path))
+
+    rows = writer.read_with_pending("s1", lambda: [])
+    assert [row["user_query"] for row in rows] == ["q1", "q2"]
+
+    assert writer.flush()
+    assert [entry["user_query"] for entry in written] == ["q1", "q2"]
+    assert not spill_path.exists()
+    assert len((tmp_path / "spill.jsonl.corrupt").read_text(encoding="utf-8").splitlines()) == 2
+
+
+def test_writer_thread_survives_unexpected_errors(tmp_path):
+    import threading
+
+    calls = []
+    written = threading.Event()
+
+    def flaky_write_batch(entries):
+        calls.append(len(entries))
+        if len(calls) == 1:
+            raise TypeError("nilai tidak bisa diserialisasi")
+        written.set()
+        return True
+
+    writer = utils_db.ChatLogWriter(write_batch=flaky_write_batch, flush_interval=0.01,
+                                    spill_path=str(tmp_path / "spill.jsonl"))
+    writer.submit(_entry("s1", "q1", "k1"))
+    try:
+        assert written.wait(5)
+        assert writer._thread.is_alive()
+        assert writer.get_stats()["pending"] == 0
+    finally:
+        writer.shutdown(timeout=1)
+
+
+def test_history_read_racing_with_a_new_turn_is_not_cached(monkeypatch):
+    monkeypatch.setattr(utils_db, "_chat_history_cache", utils_db.OrderedDict())
+    monkeypatch.setattr(utils_db, "CHAT_LOG_WRITE_BEHIND_ENABLED", False)
+    monkeypatch.setattr(utils_db, "_write_chat_log_batch", lambda entries: True)
+    db_rows = [{"user_query": "q1", "gpt_response": "jawaban q1"}]
+
+    def read_from_db(session_id, max_messages=None):
+        messages = utils_db._rows_to_messages(list(db_rows))
+        # Giliran baru disimpan setelah pembacaan DB selesai, sebelum hasilnya di-cache
+        utils_db.insert_chat_log(session_id, "q2", "jawaban q2")
+        db_rows.append({"user_query": "q2", "gpt_response": "jawaban q2"})
+        return messages
+
+    monkeypatch.setattr(utils_db, "get_chat_history_from_db", read_from_db)
+    assert [m.content for m in utils_db.get_recent_chat_history("s1", 10)] == ["q1", "jawaban q1"]
+
+    monkeypatch.setattr(utils_db, "get_chat_history_from_db",
+                        lambda session_id, max_messages=None: utils_db._rows_to_messages(list(db_rows)))
+    assert [m.content for m in utils_db.get_recent_chat_history("s1", 10)][-2:] == ["q2", "jawaban q2"]
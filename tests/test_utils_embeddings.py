@@ -0,0 +1,80 @@
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip("onnxruntime")
+pytest.importorskip("optimum.exporters.onnx")
+pytest.importorskip("sentence_transformers")
+
+from utils_embeddings import OnnxEmbeddings, export_onnx_model
+
+# Batas yang sama dengan --min-cosine bawaan benchmark_embeddings.py
+MIN_COSINE = 0.97
+
+SAMPLE_TEXTS = [
+    "query: Berapa kebutuhan protein harian anak usia 1 tahun?",
+    "query: Makanan apa yang mengandung zat besi untuk ibu hamil?",
+    "query: Apa itu stunting?",
+    "passage: Vitamin A membantu kesehatan mata dan daya tahan tubuh anak balita.",
+    "passage: Protein hewani seperti telur, ikan, dan susu penting untuk pertumbuhan balita.",
+    "passage: Zat besi dari hati ayam dan bayam mencegah anemia pada ibu hamil.",
+    "passage: Stunting adalah kondisi gagal tumbuh pada anak akibat kekurangan gizi kronis, "
+    "terutama pada 1000 hari pertama kehidupan. Pemantauan berat badan dan tinggi badan "
+    "secara rutin di posyandu membantu mendeteksinya lebih awal.",
+    "passage: Asupan energi 1350 kkal per hari dianjurkan untuk anak usia 4-6 tahun.",
+    "Air susu ibu eksklusif diberikan sampai bayi berusia 6 bulan.",
+    "sayur buah ikan telur nasi",
+]
+
+
+@pytest.fixture(scope="module")
+def model_dirs(tmp_path_factory):
+    """Model XLM-R kecil berbobot acak (tanpa unduhan) dalam format sentence-transformers dan ONNX int8."""
+    import torch
+    from sentence_transformers import SentenceTransformer, models
+    from tokenizers import Tokenizer, normalizers, pre_tokenizers, processors, trainers
+    from tokenizers import models as tokenizer_models
+    from transformers import PreTrainedTokenizerFast, XLMRobertaConfig, XLMRobertaModel
+
+    torch.manual_seed(0)
+    root = tmp_path_factory.mktemp("embedding_parity")
+    tokenizer = Tokenizer(tokenizer_models.Unigram())
+    tokenizer.normalizer = normalizers.NFKC()
+    tokenizer.pre_tokenizer = pre_tokenizers.Metaspace()
+    tokenizer.train_from_iterator(SAMPLE_TEXTS * 20, trainers.UnigramTrainer(
+        vocab_size=300, special_tokens=["<s>", "<pad>", "</s>", "<unk>"], unk_token="<unk>"))
+    tokenizer.post_processor = processors.RobertaProcessing(("</s>", 2), ("<s>", 0))
+    hf_dir, st_dir = str(root / "hf"), str(root / "st")
+    PreTrainedTokenizerFast(tokenizer_object=tokenizer, bos_token="<s>", eos_token="</s>", pad_token="<pad>",
+                            unk_token="<unk>", cls_token="<s>", sep_token="</s>",
+                            model_max_length=512).save_pretrained(hf_dir)
+    XLMRobertaModel(XLMRobertaConfig(
+        vocab_size=tokenizer.get_vocab_size(), hidden_size=128, num_hidden_layers=2, num_attention_heads=4,
+        intermediate_size=512, max_position_embeddings=514, pad_token_id=1, bos_token_id=0, eos_token_id=2,
+    )).save_pretrained(hf_dir)
+    SentenceTransformer(modules=[
+        models.Transformer(hf_dir, max_seq_length=512), models.Pooling(128, "mean"), models.Normalize()
+    ]).save(st_dir)
+    return st_dir, export_onnx_model(st_dir, str(root / "onnx"), quantize=True)
+
+
+def _assert_cosine_floor(st_model, onnx_dir):
+    from sentence_transformers import SentenceTransformer
+
+    reference = SentenceTransformer(st_model, device="cpu").encode(SAMPLE_TEXTS, normalize_embeddings=True)
+    onnx_vectors = np.asarray(OnnxEmbeddings(onnx_dir, quantized=True, batch_size=4).embed_documents(SAMPLE_TEXTS))
+    cosines = (onnx_vectors * reference).sum(axis=1) / np.linalg.norm(onnx_vectors, axis=1)
+    assert cosines.min() >= MIN_COSINE, f"kosinus minimum {cosines.min():.4f} untuk '{SAMPLE_TEXTS[cosines.argmin()]}'"
+
+
+def test_onnx_int8_embeddings_match_sentence_transformers(model_dirs):
+    # Menguji jalur ekspor, tokenisasi, pooling, dan normalisasi; model acak tidak mewakili galat kuantisasi e5
+    _assert_cosine_floor(*model_dirs)
+
+
+@pytest.mark.skipif(not os.getenv("EMBEDDING_PARITY_MODEL"),
+                    reason="Atur EMBEDDING_PARITY_MODEL (mis. intfloat/multilingual-e5-large) untuk model sebenarnya")
+def test_real_model_onnx_int8_embeddings_match_sentence_transformers(tmp_path):
+    model_name = os.environ["EMBEDDING_PARITY_MODEL"]
+    _assert_cosine_floor(model_name, export_onnx_model(model_name, str(tmp_path / "onnx"), quantize=True))
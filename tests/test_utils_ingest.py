@@ -0,0 +1,146 @@
+import os
+import subprocess
+import sys
+import uuid
+from types import SimpleNamespace
+
+import chromadb
+import pytest
+
+import utils_ingest
+from utils_ingest import IngestionPipeline
+
+
+class _Embeddings:
+    """Embedding deterministik; gagal untuk teks yang mengandung fail_marker."""
+
+    def __init__(self, fail_marker=None):
+        self.fail_marker = fail_marker
+
+    def embed_documents(self, texts):
+        if self.fail_marker and any(self.fail_marker in text for text in texts):
+            raise RuntimeError("embedding gagal")
+        return [[float(len(text)), float(sum(map(ord, text)) % 997), 1.0] for text in texts]
+
+
+class _FailingUpsertCollection:
+    """Meneruskan ke koleksi Chroma, tetapi upsert ke-fail_on_call gagal."""
+
+    def __init__(self, collection, fail_on_call):
+        self._collection = collection
+        self.fail_on_call = fail_on_call
+        self.upsert_calls = 0
+
+    def upsert(self, **kwargs):
+        self.upsert_calls += 1
+        if self.upsert_calls == self.fail_on_call:
+            raise RuntimeError("upsert gagal")
+        return self._collection.upsert(**kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+
+def _paragraphs(prefix, count):
+    # Setiap paragraf (~900 karakter) menjadi satu chunk dengan CHUNK_SIZE default 1000
+    return [f"{prefix} paragraf {i}. " + " ".join(f"kata{i}x{j}" for j in range(100)) for i in range(count)]
+
+
+def _ingest(collection, embeddings, filepath, file_id, related_file_ids, write_batch_size=1024):
+    results = {}
+    pipeline = IngestionPipeline(
+        SimpleNamespace(_collection=collection), embeddings,
+        on_file_done=lambda fid, success, message: results.__setitem__(fid, (success, message)),
+        parse_workers=1, embed_batch_size=4, write_batch_size=write_batch_size,
+    )
+    pipeline.run([{"id": file_id, "filepath": filepath, "related_file_ids": related_file_ids}])
+    return results[file_id]
+
+
+def _snapshot(collection):
+    result = collection.get(include=["metadatas", "documents"])
+    return {chunk_id: (document, metadata["file_id"])
+            for chunk_id, document, metadata in zip(result["ids"], result["documents"], result["metadatas"])}
+
+
+@pytest.fixture
+def collection():
+    return chromadb.EphemeralClient().create_collection(f"tes-{uuid.uuid4().hex}")
+
+
+@pytest.fixture
+def first_version(tmp_path, collection):
+    paragraphs = _paragraphs("asli", 12)
+    filepath = tmp_path / "panduan.txt"
+    filepath.write_text("\n\n".join(paragraphs), encoding="utf-8")
+    assert _ingest(collection, _Embeddings(), str(filepath), 1, [1])[0]
+    return filepath, paragraphs
+
+
+def test_failed_embedding_keeps_previous_version_intact(collection, first_version):
+    filepath, paragraphs = first_version
+    before = _snapshot(collection)
+    changed = paragraphs[:4] + [p.replace("asli", "GAGAL") for p in paragraphs[4:8]] + _paragraphs("baru", 4)
+    filepath.write_text("\n\n".join(changed), encoding="utf-8")
+
+    success, _ = _ingest(collection, _Embeddings(fail_marker="GAGAL"), str(filepath), 2, [1, 2])
+
+    assert not success
+    assert _snapshot(collection) == before
+
+
+def test_failed_write_keeps_previous_version_intact(collection, first_version):
+    filepath, paragraphs = first_version
+    before = _snapshot(collection)
+    filepath.write_text("\n\n".join(paragraphs[:6] + _paragraphs("baru", 8)), encoding="utf-8")
+    failing = _FailingUpsertCollection(collection, fail_on_call=2)
+
+    success, _ = _ingest(failing, _Embeddings(), str(filepath), 2, [1, 2], write_batch_size=4)
+
+    assert not success
+    assert failing.upsert_calls >= 2
+    assert _snapshot(collection) == before
+
+
+def test_successful_reingest_relabels_and_removes_stale_chunks(collection, first_version):
+    filepath, paragraphs = first_version
+    filepath.write_text("\n\n".join(paragraphs[:6] + _paragraphs("baru", 2)), encoding="utf-8")
+
+    success, _ = _ingest(collection, _Embeddings(), str(filepath), 2, [1, 2])
+
+    after = _snapshot(collection)
+    assert success
+    assert len(after) == 8
+    assert {file_id for _, file_id in after.values()} == {"2"}
+
+
+def test_chroma_directory_is_locked_against_a_second_process(tmp_path, monkeypatch):
+    pytest.importorskip("fcntl")
+    monkeypatch.setattr(utils_ingest, "CHROMA_PERSIST_DIRECTORY", str(tmp_path))
+    monkeypatch.setattr(utils_ingest, "CHROMA_PROCESS_LOCK_FILE", str(tmp_path / ".process.lock"))
+    monkeypatch.setattr(utils_ingest, "_chroma_process_lock", None)
+    # Proses lain (misalnya ingest_worker.py) memegang direktori Chroma
+    holder = subprocess.Popen(
+        [sys.executable, "-c",
+         "import fcntl, os, sys, time\n"
+         "f = open(sys.argv[1], 'a+')\n"
+         "fcntl.flock(f, fcntl.LOCK_EX)\n"
+         "f.write(str(os.getpid())); f.flush()\n"
+         "print('ok', flush=True)\n"
+         "time.sleep(60)\n",
+         str(tmp_path / ".process.lock")],
+        stdout=subprocess.PIPE, text=True,
+    )
+    try:
+        assert holder.stdout.readline().strip() == "ok"
+        with pytest.raises(RuntimeError, match=str(holder.pid)):
+            utils_ingest.acquire_chroma_process_lock()
+    finally:
+        holder.kill()
+        holder.wait()
+
+    utils_ingest.acquire_chroma_process_lock()
+    # Sekali per proses: pemanggilan berikutnya tidak mengunci ulang
+    utils_ingest.acquire_chroma_process_lock()
+    assert (tmp_path / ".process.lock").read_text() == str(os.getpid())
+    utils_ingest._chroma_process_lock.close()
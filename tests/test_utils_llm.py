@@ -0,0 +1,142 @@
+import threading
+import time
+
+import utils_llm
+from utils_llm import InferenceScheduler
+
+
+def test_abandoned_stream_releases_replica():
+    produced = []
+    generator_closed = threading.Event()
+
+    def generate(replica):
+        try:
+            for index in range(10000):
+                produced.append(index)
+                time.sleep(0.001)
+                yield f"t{index}"
+        finally:
+            generator_closed.set()
+
+    scheduler = InferenceScheduler([object()], max_queue_size=4, request_timeout=5)
+    try:
+        stream = scheduler.stream(generate)
+        assert next(stream) == "t0"
+        stream.close()  # seperti GeneratorExit saat rerun Streamlit atau tab ditutup
+
+        assert generator_closed.wait(2)
+        assert len(produced) < 10000
+        # Replika yang sama langsung bisa melayani permintaan berikutnya
+        assert scheduler.run(lambda replica: "ok", timeout=2) == "ok"
+    finally:
+        scheduler.close()
+
+
+def test_completed_stream_yields_all_chunks():
+    scheduler = InferenceScheduler([object()], max_queue_size=4, request_timeout=5)
+    try:
+        assert list(scheduler.stream(lambda replica: iter(["a", "b", "c"]))) == ["a", "b", "c"]
+    finally:
+        scheduler.close()
+
+
+def test_prompt_cache_capacity_is_split_across_replicas(monkeypatch):
+    monkeypatch.setattr(utils_llm, "LLM_PROMPT_CACHE_BYTES", 4 << 30)
+    monkeypatch.setattr(utils_llm, "_available_memory_bytes", lambda: 64 << 30)
+    assert utils_llm._prompt_cache_capacity_bytes("ram", 4) == 1 << 30
+    assert utils_llm._prompt_cache_capacity_bytes("disk", 4) == 1 << 30
+
+
+def test_ram_prompt_cache_is_capped_by_available_memory(monkeypatch):
+    monkeypatch.setattr(utils_llm, "LLM_PROMPT_CACHE_BYTES", 4 << 30)
+    monkeypatch.setattr(utils_llm, "LLM_PROMPT_CACHE_MAX_MEMORY_FRACTION", 0.25)
+    monkeypatch.setattr(utils_llm, "_available_memory_bytes", lambda: 8 << 30)
+    assert utils_llm._prompt_cache_capacity_bytes("ram", 2) == 1 << 30
+    assert utils_llm._prompt_cache_capacity_bytes("disk", 2) == 2 << 30
+
+
+def _token_generator(count, delay, closed=None):
+    try:
+        for index in range(count):
+            time.sleep(delay)
+            yield f"t{index} "
+    finally:
+        if closed is not None:
+            closed.set()
+
+
+def test_long_stream_is_bounded_by_token_gap_not_total_time():
+    scheduler = InferenceScheduler([object()], max_queue_size=4, request_timeout=0.2, token_timeout=0.2)
+    chunks = list(scheduler.stream(lambda replica: _token_generator(12, 0.05)))
+    assert len(chunks) == 12
+    scheduler.close()
+
+
+def test_stalled_stream_times_out():
+    scheduler = InferenceScheduler([object()], max_queue_size=4, request_timeout=1, token_timeout=0.1)
+
+    def stalls(replica):
+        yield "awal"
+        time.sleep(0.5)
+        yield "terlambat"
+
+    received = []
+    try:
+        for chunk in scheduler.stream(stalls):
+            received.append(chunk)
+        raise AssertionError("stream seharusnya timeout")
+    except utils_llm.InferenceTimeoutError:
+        pass
+    assert received == ["awal"]
+    scheduler.close()
+
+
+def test_timed_out_run_releases_replica():
+    scheduler = InferenceScheduler([object()], max_queue_size=4, request_timeout=5)
+    closed = threading.Event()
+    try:
+        scheduler.run(lambda replica: _token_generator(10000, 0.01, closed), timeout=0.1)
+        raise AssertionError("run seharusnya timeout")
+    except utils_llm.InferenceTimeoutError:
+        pass
+    assert closed.wait(2)
+    assert scheduler.run(lambda replica: _token_generator(3, 0), timeout=2) == "t0 t1 t2 "
+    scheduler.close()
+
+
+def test_close_does_not_block_on_full_queue():
+    scheduler = InferenceScheduler([object()], max_queue_size=1, request_timeout=5)
+    release = threading.Event()
+    started = threading.Event()
+
+    def blocking(replica):
+        started.set()
+        release.wait(5)
+        return "selesai"
+
+    results = {}
+    running = threading.Thread(target=lambda: results.__setitem__("running", scheduler.run(blocking)))
+    running.start()
+    assert started.wait(2)
+
+    def queued():
+        try:
+            scheduler.run(lambda replica: "antre")
+        except utils_llm.ServerBusyError as e:
+            results["queued"] = e
+
+    waiting = threading.Thread(target=queued)
+    waiting.start()
+    deadline = time.monotonic() + 2
+    while scheduler.get_stats()["queue_depth"] < 1 and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    closer = threading.Thread(target=scheduler.close)
+    closer.start()
+    closer.join(1)
+    assert not closer.is_alive()
+    waiting.join(2)
+    assert isinstance(results["queued"], utils_llm.ServerBusyError)
+    release.set()
+    running.join(2)
+    assert results["running"] == "selesai"
@@ -0,0 +1,95 @@
+import threading
+from types import SimpleNamespace
+
+import numpy as np
+from langchain_core.documents import Document
+
+import utils_rag
+from utils_cache import SemanticAnswerCache
+from utils_retrieval import BM25Index
+
+CHUNKS = {
+    "vitamin": "Vitamin A membantu kesehatan mata dan daya tahan tubuh anak balita. " * 2,
+    "protein": "Protein hewani seperti telur dan ikan penting untuk pertumbuhan balita. " * 2,
+    "zat-besi": "Zat besi dari hati ayam dan bayam mencegah anemia pada ibu hamil. " * 2,
+}
+
+
+def _engine(monkeypatch):
+    index = BM25Index()
+    index.add(list(CHUNKS), list(CHUNKS.values()))
+    documents = {chunk_id: Document(page_content=text, id=chunk_id) for chunk_id, text in CHUNKS.items()}
+    monkeypatch.setattr(utils_rag, "get_lexical_index", lambda collection: index)
+    monkeypatch.setattr(utils_rag, "get_documents_by_ids",
+                        lambda collection, chunk_ids: [documents[chunk_id] for chunk_id in chunk_ids])
+    # Pencarian vektor selalu mengembalikan tetangga terdekat, apa pun pertanyaannya
+    monkeypatch.setattr(utils_rag, "retrieve_documents",
+                        lambda engine, question, query_embedding=None: list(documents.values()))
+    return SimpleNamespace(vectorstore=SimpleNamespace(_collection=None), llm=None,
+                           retriever_search_kwargs={"k": 3})
+
+
+def test_off_topic_question_is_rejected(monkeypatch):
+    engine = _engine(monkeypatch)
+    context, relevant = utils_rag._retrieve_context_for_question(engine, "Siapa pemenang piala dunia sepak bola?")
+    assert context
+    assert not relevant
+
+
+def test_question_supported_by_both_rankers_is_relevant(monkeypatch):
+    engine = _engine(monkeypatch)
+    context, relevant = utils_rag._retrieve_context_for_question(engine, "Makanan apa yang mengandung zat besi?")
+    assert "Zat besi" in context
+    assert relevant
+
+
+def _near_duplicate_embeddings(cosine):
+    # Dua pertanyaan yang hanya berbeda angka ("usia 1 tahun" vs "usia 3 tahun") dengan
+    # kemiripan kosinus setinggi yang biasa dihasilkan e5
+    first = np.array([1.0, 0.0, 0.0])
+    second = np.array([cosine, np.sqrt(1 - cosine ** 2), 0.0])
+    return first.tolist(), second.tolist()
+
+
+def test_questions_differing_in_a_number_miss_the_default_semantic_cache(monkeypatch):
+    monkeypatch.setattr(utils_rag, "semantic_answer_cache", SemanticAnswerCache(
+        similarity_threshold=utils_rag.SEMANTIC_CACHE_THRESHOLD, max_entries=10,
+    ))
+    first, second = _near_duplicate_embeddings(0.97)
+    utils_rag._store_cached_answer("Berapa kebutuhan protein anak usia 1 tahun?", first, "Sekitar 13 gram per hari.")
+
+    assert utils_rag._lookup_cached_answer("Berapa kebutuhan protein anak usia 3 tahun?", second) is None
+
+
+def test_uncalibrated_threshold_would_serve_the_wrong_answer():
+    cache = SemanticAnswerCache(similarity_threshold=0.95, max_entries=10)
+    first, second = _near_duplicate_embeddings(0.97)
+    cache.add("Berapa kebutuhan protein anak usia 1 tahun?", first, "Sekitar 13 gram per hari.")
+    assert cache.lookup(second)[0] == "Sekitar 13 gram per hari."
+
+
+def test_close_waits_for_requests_still_using_the_engine():
+    engine = utils_rag.RagEngine()
+    engine.llm = object()
+    assert engine.acquire()
+    closer = threading.Thread(target=engine.close)
+    closer.start()
+    closer.join(0.2)
+    # Permintaan yang masih berjalan tetap melihat komponennya
+    assert closer.is_alive()
+    assert engine.llm is not None
+    engine.release()
+    closer.join(2)
+    assert not closer.is_alive()
+    assert engine.llm is None
+    assert not engine.acquire()
+
+
+def test_serving_engine_skips_a_retired_engine(monkeypatch):
+    retired, active = utils_rag.RagEngine(), utils_rag.RagEngine()
+    retired.close()
+    monkeypatch.setattr(utils_rag, "get_rag_engine", lambda: active)
+    with utils_rag._serving_engine(retired, require_ready=False) as engine:
+        assert engine is active
+        assert active._active_requests == 1
+    assert active._active_requests == 0
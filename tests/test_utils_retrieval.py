@@ -0,0 +1,119 @@
+import re
+
+import numpy as np
+import pytest
+from langchain_core.documents import Document
+from langchain_core.vectorstores.utils import maximal_marginal_relevance as langchain_mmr
+
+from utils_retrieval import maximal_marginal_relevance, merge_overlapping_chunks, pack_context
+
+
+def _assert_same_as_langchain(query, candidates, k, lambda_mult):
+    expected = langchain_mmr(np.asarray(query, dtype=np.float64), np.asarray(candidates, dtype=np.float64).tolist(),
+                             lambda_mult=lambda_mult, k=k)
+    assert maximal_marginal_relevance(query, candidates, k=k, lambda_mult=lambda_mult) == expected
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_matches_langchain_on_random_inputs(seed):
+    rng = np.random.default_rng(seed)
+    fetch_k = int(rng.integers(1, 40))
+    candidates = rng.normal(size=(fetch_k, 16))
+    query = rng.normal(size=16)
+    # k juga bisa sama dengan atau lebih besar dari fetch_k
+    k = int(rng.integers(1, fetch_k + 5))
+    _assert_same_as_langchain(query, candidates, k, float(rng.choice([0.0, 0.25, 0.5, 0.75, 1.0])))
+
+
+@pytest.mark.parametrize("lambda_mult", [0.0, 0.25, 0.5, 1.0])
+def test_matches_langchain_on_ties(lambda_mult):
+    # Vektor satuan dengan komponen 0, +-0.5, atau 1, duplikat, dan salinan berskala 2: semua
+    # kemiripan dan skor MMR eksak di float32 maupun float64, sehingga skor seri benar-benar
+    # sama dan keduanya harus memilih indeks terkecil
+    base = [[1.0, 0.0, 0.0, 0.0], [0.0, 1.0, 0.0, 0.0], [0.0, 0.0, 1.0, 0.0],
+            [0.5, 0.5, 0.5, 0.5], [0.5, 0.5, -0.5, -0.5], [0.5, -0.5, 0.5, -0.5]]
+    candidates = base + base[:3] + [[2 * value for value in row] for row in base[3:]]
+    for query in ([1.0, 0.0, 0.0, 0.0], [0.5, 0.5, 0.5, 0.5], [0.5, 0.5, -0.5, 0.5]):
+        for k in (1, 4, len(candidates)):
+            _assert_same_as_langchain(query, candidates, k, lambda_mult)
+
+    # Dua kandidat simetris terhadap query: skor sama di setiap langkah
+    symmetric = [[1.0, 1.0, 0.0], [1.0, -1.0, 0.0], [1.0, 0.0, 1.0], [1.0, 0.0, -1.0]]
+    _assert_same_as_langchain([1.0, 0.0, 0.0], symmetric, 4, lambda_mult)
+
+
+@pytest.mark.parametrize("k", [5, 6, 50])
+def test_k_at_least_fetch_k_returns_every_candidate(k):
+    rng = np.random.default_rng(k)
+    candidates = rng.normal(size=(5, 4))
+    selected = maximal_marginal_relevance(rng.normal(size=4), candidates, k=k)
+    assert sorted(selected) == list(range(5))
+    _assert_same_as_langchain(rng.normal(size=4), candidates, k, 0.5)
+
+
+def test_duplicate_candidates_resolve_to_the_lowest_index():
+    # Baris identik dengan nilai yang tidak eksak: perkalian matriks float32 bisa memberi skor
+    # yang beda di bit terakhir, tetapi kandidat pertama tetap yang terpilih
+    base = [[1.0, 0.0, 0.0], [0.0, 1.0, 0.0], [3.0, 4.0, 0.0], [4.0, 3.0, 0.0], [0.0, 3.0, 4.0], [0.0, 4.0, 3.0]]
+    candidates = base + base[:3] + [[2 * value for value in row] for row in base[3:]]
+    for lambda_mult in (0.0, 0.5, 1.0):
+        assert maximal_marginal_relevance([3.0, 4.0, 0.0], candidates, k=1, lambda_mult=lambda_mult) == [2]
+    # Hanya relevansi: kedua salinan berurutan menurut indeks
+    assert maximal_marginal_relevance([3.0, 4.0, 0.0], candidates, k=2, lambda_mult=1.0) == [2, 8]
+
+
+def _words(start, end):
+    return " ".join(f"kata{i}" for i in range(start, end))
+
+
+def _chunk(text, source="panduan.pdf"):
+    return Document(page_content=text, metadata={"source": source})
+
+
+def _count_tokens(text):
+    # Satu token per kata, dan pemisah antar passage ("\n\n") dihitung satu token
+    return len(re.findall(r"\S+|\n\n", text))
+
+
+def test_merge_keeps_overlap_once():
+    # Chunk bertetangga dengan chunk_overlap 20 kata, dalam urutan peringkat apa pun
+    first, second = _chunk(_words(0, 60)), _chunk(_words(40, 100))
+    assert merge_overlapping_chunks([first, second]) == [("panduan.pdf", _words(0, 100))]
+    assert merge_overlapping_chunks([second, first]) == [("panduan.pdf", _words(0, 100))]
+
+
+def test_merge_drops_contained_chunks_and_keeps_sources_apart():
+    passages = merge_overlapping_chunks([
+        _chunk(_words(0, 60)),
+        _chunk(_words(10, 30)),
+        _chunk(_words(40, 100), source="lain.pdf"),
+        _chunk(_words(200, 220)),
+    ])
+    assert passages == [("panduan.pdf", _words(0, 60)), ("lain.pdf", _words(40, 100)),
+                        ("panduan.pdf", _words(200, 220))]
+
+
+def test_pack_context_respects_the_token_budget():
+    docs = [_chunk(_words(i * 100, i * 100 + 50)) for i in range(10)]
+    for budget in (1, 49, 50, 120, 333, 1000):
+        context, used_tokens, _ = pack_context(docs, budget, _count_tokens)
+        assert used_tokens == _count_tokens(context)
+        assert used_tokens <= budget
+
+
+def test_pack_context_merges_overlap_before_counting():
+    context, used_tokens, passages = pack_context([_chunk(_words(0, 60)), _chunk(_words(40, 100))], 100, _count_tokens)
+    assert (context, used_tokens, passages) == (_words(0, 100), 100, 1)
+
+
+def test_pack_context_truncates_the_last_passage_to_the_remaining_budget():
+    docs = [_chunk(_words(0, 50)), _chunk(_words(100, 150)), _chunk(_words(200, 250))]
+    context, used_tokens, passages = pack_context(docs, 80, _count_tokens)
+
+    first, last = context.split("\n\n")
+    assert passages == 2
+    assert first == _words(0, 50)
+    assert last and _words(100, 150).startswith(last)
+    assert used_tokens <= 80
+    # Sisa anggaran (80 - 50 - 1 pemisah) hampir terpakai seluruhnya
+    assert _count_tokens(last) >= 25
@@ -0,0 +1,55 @@
+import uuid
+
+import chromadb
+import pytest
+
+import utils_ingest
+import utils_vector_index
+from utils_vector_index import CompactVectorIndex, ensure_compact_index
+
+
+@pytest.fixture
+def collection(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils_ingest, "CHROMA_PERSIST_DIRECTORY", str(tmp_path))
+    monkeypatch.setattr(utils_ingest, "KNOWLEDGE_BASE_VERSION_FILE", str(tmp_path / "kb_version"))
+    monkeypatch.setattr(utils_vector_index, "_compact_index", CompactVectorIndex(str(tmp_path / "compact_index")))
+    collection = chromadb.EphemeralClient().create_collection(f"tes-{uuid.uuid4().hex}")
+    collection.add(ids=["a", "b", "c"], embeddings=[[1.0, 0.0], [0.0, 1.0], [1.0, 1.0]],
+                   documents=["teks a", "teks b", "teks c"], metadatas=[{"file_id": "1"}] * 3)
+    utils_ingest.mark_knowledge_base_changed()
+    return collection
+
+
+def _document(index, chunk_id):
+    snapshot = index.snapshot()
+    return next(doc for doc in snapshot.get_documents(range(snapshot.count)) if doc.id == chunk_id)
+
+
+def test_change_with_same_row_count_makes_the_snapshot_stale(collection):
+    index = ensure_compact_index(collection)
+    assert not index.is_stale(collection)
+
+    # Relabel chunk ke versi file baru: jumlah baris tetap sama
+    collection.update(ids=["a"], metadatas=[{"file_id": "2"}])
+    utils_ingest.mark_knowledge_base_changed()
+
+    assert index.is_stale(collection)
+    ensure_compact_index(collection)
+    assert _document(index, "a").metadata["file_id"] == "2"
+    assert not index.is_stale(collection)
+
+
+def test_stale_snapshot_keeps_serving_while_rebuilding_in_background(collection):
+    index = ensure_compact_index(collection)
+    old_snapshot = index.snapshot()
+    collection.update(ids=["b"], embeddings=[[0.0, 2.0]], documents=["teks b diperbarui"])
+    utils_ingest.mark_knowledge_base_changed()
+
+    with index._build_lock:
+        # Pembangunan ulang tertahan: pemanggil tidak menunggu dan snapshot lama tetap dipakai
+        assert ensure_compact_index(collection, background=True) is index
+        assert index.snapshot() is old_snapshot
+    index._background_build.join(5)
+
+    assert index.snapshot() is not old_snapshot
+    assert _document(index, "b").page_content == "teks b diperbarui"
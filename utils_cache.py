@@ -0,0 +1,402 @@
+import atexit
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from dotenv import load_dotenv
+from langchain_core.embeddings import Embeddings
+
+load_dotenv(override=True)
+
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.sqlite3")
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", 500000))
+# Waktu pakai terakhir (last_used) dari cache hit ditulis per batch, bukan per lookup:
+# setelah sekian entri tertunda atau sekian detik, atau bersama put_many berikutnya
+EMBEDDING_CACHE_TOUCH_BATCH = int(os.getenv("EMBEDDING_CACHE_TOUCH_BATCH", 1024))
+EMBEDDING_CACHE_TOUCH_INTERVAL_SECONDS = float(os.getenv("EMBEDDING_CACHE_TOUCH_INTERVAL_SECONDS", 30))
+
+
+def _normalize(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+class SemanticAnswerCache:
+    """
+    Cache jawaban berdasarkan kemiripan embedding pertanyaan mandiri.
+    Pertanyaan dengan kemiripan kosinus >= similarity_threshold terhadap pertanyaan
+    yang pernah dijawab akan mendapatkan jawaban yang tersimpan tanpa memanggil LLM.
+    Eviction memakai LRU (max_entries) dan TTL (ttl_seconds, 0 = tanpa TTL).
+    Jika persist_path diberikan, isi cache dimuat saat start dan disimpan ke file JSON oleh
+    thread latar belakang paling sering sekali per save_interval detik (hanya jika ada
+    perubahan), serta saat shutdown(). Penulisan file tidak menahan lock lookup.
+    """
+
+    def __init__(self, similarity_threshold=0.95, max_entries=500, ttl_seconds=0, persist_path=None,
+                 save_interval=30.0):
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.persist_path = persist_path
+        self.save_interval = save_interval
+        self._entries = OrderedDict()  # key -> dict(question, answer, embedding, created_at)
+        self._next_key = 0
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._dirty = False
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+        if persist_path:
+            self._load()
+
+    def _is_expired(self, entry, now):
+        return self.ttl_seconds > 0 and now - entry["created_at"] > self.ttl_seconds
+
+    def _evict_expired(self, now):
+        expired_keys = [key for key, entry in self._entries.items() if self._is_expired(entry, now)]
+        for key in expired_keys:
+            del self._entries[key]
+        self._stats["evictions"] += len(expired_keys)
+
+    def lookup(self, query_embedding):
+        """Mengembalikan (jawaban, pertanyaan_tersimpan, skor) jika ada hit, atau None."""
+        query_vector = _normalize(query_embedding)
+        with self._lock:
+            self._evict_expired(time.time())
+            if not self._entries:
+                self._stats["misses"] += 1
+                return None
+            keys = list(self._entries.keys())
+            matrix = np.stack([self._entries[key]["embedding"] for key in keys])
+            scores = matrix @ query_vector
+            best_index = int(np.argmax(scores))
+            best_score = float(scores[best_index])
+            if best_score < self.similarity_threshold:
+                self._stats["misses"] += 1
+                return None
+            best_key = keys[best_index]
+            self._entries.move_to_end(best_key)
+            self._stats["hits"] += 1
+            entry = self._entries[best_key]
+            return entry["answer"], entry["question"], best_score
+
+    def add(self, question, query_embedding, answer):
+        with self._lock:
+            self._entries[self._next_key] = {
+                "question": question,
+                "answer": answer,
+                "embedding": _normalize(query_embedding),
+                "created_at": time.time(),
+            }
+            self._next_key += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+            self._dirty = True
+        self._ensure_save_thread()
+
+    def clear(self):
+        """Kosongkan cache, misalnya saat basis pengetahuan berubah."""
+        with self._lock:
+            self._entries.clear()
+            self._stats["invalidations"] += 1
+            self._dirty = True
+        self._ensure_save_thread()
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+    def _ensure_save_thread(self):
+        if not self.persist_path or (self._thread is not None and self._thread.is_alive()):
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop_event.clear()
+                self._thread = threading.Thread(target=self._run_saver, name="semantic-cache-saver", daemon=True)
+                self._thread.start()
+
+    def _run_saver(self):
+        while not self._stop_event.wait(self.save_interval):
+            self.save()
+
+    def save(self):
+        """Menulis isi cache ke persist_path jika ada perubahan sejak penyimpanan terakhir."""
+        if not self.persist_path:
+            return
+        with self._save_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                # Entri tidak pernah diubah setelah ditambahkan, jadi cukup salin daftar referensinya
+                entries = list(self._entries.values())
+                self._dirty = False
+            data = [
+                {
+                    "question": entry["question"],
+                    "answer": entry["answer"],
+                    "embedding": entry["embedding"].tolist(),
+                    "created_at": entry["created_at"],
+                }
+                for entry in entries
+            ]
+            tmp_path = f"{self.persist_path}.tmp"
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(data, f)
+                os.replace(tmp_path, self.persist_path)
+            except OSError as e:
+                with self._lock:
+                    self._dirty = True
+                print(f"Gagal menyimpan semantic cache ke {self.persist_path}: {e}")
+
+    def shutdown(self):
+        """Menghentikan thread penyimpan dan menulis perubahan terakhir."""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.save()
+
+    def _load(self):
+        if not os.path.exists(self.persist_path):
+            return
+        try:
+            with open(self.persist_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Gagal memuat semantic cache dari {self.persist_path}: {e}")
+            return
+        now = time.time()
+        for item in data[-self.max_entries:]:
+            entry = {
+                "question": item["question"],
+                "answer": item["answer"],
+                "embedding": _normalize(item["embedding"]),
+                "created_at": item["created_at"],
+            }
+            if self._is_expired(entry, now):
+                continue
+            self._entries[self._next_key] = entry
+            self._next_key += 1
+        print(f"Semantic cache dimuat: {len(self._entries)} entri dari {self.persist_path}")
+
+
+def _normalize_text_for_key(text):
+    return " ".join(text.split())
+
+
+class EmbeddingCache:
+    """
+    Cache embedding persisten di SQLite, dengan kunci (nama model, hash teks ternormalisasi).
+    Vektor disimpan sebagai blob float32. Jumlah entri dibatasi max_entries; entri yang
+    paling lama tidak dipakai dihapus lebih dulu. Aman dipakai dari beberapa thread,
+    dan mode WAL memungkinkan beberapa proses berbagi file yang sama.
+    Jumlah baris dilacak di memori (dihitung ulang dari tabel hanya saat batas terlampaui,
+    karena proses lain bisa ikut menulis), dan eviction menyisakan ruang sekitar 5% agar
+    tidak terjadi pada setiap put. last_used dari cache hit ditulis per batch (flush()).
+    """
+
+    def __init__(self, path=EMBEDDING_CACHE_PATH, max_entries=EMBEDDING_CACHE_MAX_ENTRIES,
+                 touch_batch=EMBEDDING_CACHE_TOUCH_BATCH, touch_interval=EMBEDDING_CACHE_TOUCH_INTERVAL_SECONDS):
+        self.path = path
+        self.max_entries = max_entries
+        self.touch_batch = touch_batch
+        self.touch_interval = touch_interval
+        self._lock = threading.Lock()
+        self._pending_touches = {}
+        self._last_touch_flush = time.monotonic()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model_name TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model_name, text_hash)
+            )
+        ''')
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+        self._row_count = self._count_rows()
+
+    @staticmethod
+    def text_hash(text):
+        return hashlib.sha256(_normalize_text_for_key(text).encode("utf-8")).hexdigest()
+
+    def get_many(self, model_name, texts):
+        """Mengembalikan list vektor (atau None untuk yang belum ada) sesuai urutan texts."""
+        hashes = [self.text_hash(text) for text in texts]
+        found = {}
+        now = time.time()
+        with self._lock:
+            unique_hashes = list(dict.fromkeys(hashes))
+            # Batas jumlah parameter SQLite: query per potongan
+            for start in range(0, len(unique_hashes), 500):
+                part = unique_hashes[start:start + 500]
+                placeholders = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model_name = ? AND text_hash IN ({placeholders})",
+                    [model_name, *part]
+                ).fetchall()
+                for text_hash, vector in rows:
+                    found[text_hash] = np.frombuffer(vector, dtype=np.float32).tolist()
+            for text_hash in found:
+                self._pending_touches[(model_name, text_hash)] = now
+            if (len(self._pending_touches) >= self.touch_batch
+                    or time.monotonic() - self._last_touch_flush >= self.touch_interval):
+                self._write_touches()
+                self._conn.commit()
+            results = [found.get(text_hash) for text_hash in hashes]
+            hits = sum(1 for vector in results if vector is not None)
+            self._stats["hits"] += hits
+            self._stats["misses"] += len(results) - hits
+        return results
+
+    def put_many(self, model_name, texts, vectors):
+        now = time.time()
+        rows = [
+            (model_name, self.text_hash(text), np.asarray(vector, dtype=np.float32).tobytes(), now)
+            for text, vector in zip(texts, vectors)
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model_name, text_hash, vector, last_used) VALUES (?, ?, ?, ?)",
+                rows
+            )
+            # Batas atas: baris yang diganti (teks sama) ikut terhitung sampai dihitung ulang
+            self._row_count += len(rows)
+            self._write_touches()
+            self._evict_if_needed()
+            self._conn.commit()
+
+    def flush(self):
+        """Menulis last_used yang masih tertunda dari cache hit."""
+        with self._lock:
+            if self._pending_touches:
+                self._write_touches()
+                self._conn.commit()
+
+    def _write_touches(self):
+        if self._pending_touches:
+            self._conn.executemany(
+                "UPDATE embeddings SET last_used = MAX(last_used, ?) WHERE model_name = ? AND text_hash = ?",
+                [(last_used, model_name, text_hash)
+                 for (model_name, text_hash), last_used in self._pending_touches.items()]
+            )
+            self._pending_touches.clear()
+        self._last_touch_flush = time.monotonic()
+
+    def _count_rows(self):
+        return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def _evict_if_needed(self):
+        if self._row_count <= self.max_entries:
+            return
+        self._row_count = self._count_rows()
+        excess = self._row_count - self.max_entries
+        if excess > 0:
+            excess += self.max_entries // 20
+            deleted = self._conn.execute(
+                "DELETE FROM embeddings WHERE rowid IN (SELECT rowid FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+                (excess,)
+            ).rowcount
+            self._row_count -= deleted
+            self._stats["evictions"] += deleted
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            # Statistik jarang diminta: hitung ulang sekalian menyelaraskan jumlah di memori
+            self._row_count = self._count_rows()
+            stats["entries"] = self._row_count
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Pembungkus Embeddings LangChain yang memakai EmbeddingCache lebih dulu dan
+    hanya memanggil model untuk teks yang belum pernah di-embed.
+    """
+
+    def __init__(self, base_embeddings, cache, model_name):
+        self.base_embeddings = base_embeddings
+        self.cache = cache
+        self.model_name = model_name
+
+    def embed_documents(self, texts):
+        texts = list(texts)
+        vectors = self.cache.get_many(self.model_name, texts)
+        missing_indexes = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing_indexes:
+            missing_texts = [texts[i] for i in missing_indexes]
+            computed = self.base_embeddings.embed_documents(missing_texts)
+            self.cache.put_many(self.model_name, missing_texts, computed)
+            for i, vector in zip(missing_indexes, computed):
+                vectors[i] = list(vector)
+        return vectors
+
+    def embed_query(self, text):
+        vector = self.cache.get_many(self.model_name, [text])[0]
+        if vector is None:
+            vector = self.base_embeddings.embed_query(text)
+            self.cache.put_many(self.model_name, [text], [vector])
+        return list(vector)
+
+
+class CountingEmbeddings(Embeddings):
+    """Pembungkus Embeddings LangChain yang melaporkan setiap panggilan lewat on_call(nama metode)."""
+
+    def __init__(self, base_embeddings, on_call):
+        self.base_embeddings = base_embeddings
+        self.on_call = on_call
+        self.variant = getattr(base_embeddings, "variant", None)
+
+    def embed_query(self, text):
+        self.on_call("embed_query")
+        return self.base_embeddings.embed_query(text)
+
+    def embed_documents(self, texts):
+        self.on_call("embed_documents")
+        return self.base_embeddings.embed_documents(texts)
+
+
+_default_embedding_cache = None
+_default_embedding_cache_lock = threading.Lock()
+
+def get_default_embedding_cache():
+    """EmbeddingCache bersama untuk satu proses (None jika dinonaktifkan lewat EMBEDDING_CACHE_ENABLED)."""
+    global _default_embedding_cache
+    if not EMBEDDING_CACHE_ENABLED:
+        return None
+    with _default_embedding_cache_lock:
+        if _default_embedding_cache is None:
+            _default_embedding_cache = EmbeddingCache()
+            atexit.register(_default_embedding_cache.flush)
+            print(f"Embedding cache dibuka: {EMBEDDING_CACHE_PATH} (maks {EMBEDDING_CACHE_MAX_ENTRIES} entri)")
+    return _default_embedding_cache
+
+
+def wrap_with_embedding_cache(base_embeddings, model_name):
+    cache = get_default_embedding_cache()
+    if cache is None:
+        return base_embeddings
+    return CachedEmbeddings(base_embeddings, cache, model_name)
@@ -1,5 +1,13 @@
 import mysql.connector
+from mysql.connector import pooling
+import atexit
+import json
 import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from contextlib import contextmanager
 from dotenv import load_dotenv
 from datetime import datetime
 # Gunakan metode hash yang lebih portabel jika 'scrypt' bermasalah di lingkungan deploy
@@ -18,213 +26,832 @@ DB_CONFIG = {
     "port": os.getenv("DB_PORT", "3306")
 }
 
+# Konfigurasi connection pool (satu pool per proses, dipakai bersama oleh semua sesi Streamlit)
+DB_POOL_NAME = os.getenv("DB_POOL_NAME", "giziai_pool")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 10))  # detik menunggu koneksi bebas
+
+_db_pool = None
+_db_pool_lock = threading.Lock()
+_pool_stats_lock = threading.Lock()
+_pool_stats = {
+    "checkouts": 0,
+    "wait_time_total": 0.0,
+    "wait_time_max": 0.0,
+    "timeouts": 0,
+    "health_check_failures": 0,
+}
+
+def _get_pool():
+    global _db_pool
+    if _db_pool is None:
+        with _db_pool_lock:
+            if _db_pool is None:
+                _db_pool = pooling.MySQLConnectionPool(
+                    pool_name=DB_POOL_NAME,
+                    pool_size=DB_POOL_SIZE,
+                    pool_reset_session=True,
+                    **DB_CONFIG
+                )
+                print(f"Connection pool MySQL '{DB_POOL_NAME}' dibuat (ukuran: {DB_POOL_SIZE}).")
+    return _db_pool
+
+def _record_checkout(wait_time):
+    with _pool_stats_lock:
+        _pool_stats["checkouts"] += 1
+        _pool_stats["wait_time_total"] += wait_time
+        _pool_stats["wait_time_max"] = max(_pool_stats["wait_time_max"], wait_time)
+
+def get_pool_stats():
+    """Metrik pool: jumlah checkout, waktu tunggu (total/rata-rata/maks), timeout, dan gagal health check."""
+    with _pool_stats_lock:
+        stats = dict(_pool_stats)
+    stats["wait_time_avg"] = stats["wait_time_total"] / stats["checkouts"] if stats["checkouts"] else 0.0
+    stats["pool_size"] = DB_POOL_SIZE
+    return stats
+
 def get_db_connection():
+    """
+    Mengambil koneksi dari pool. Menunggu hingga DB_POOL_TIMEOUT detik jika pool penuh.
+    Koneksi diperiksa (ping) sebelum dikembalikan; conn.close() mengembalikannya ke pool.
+    """
+    start = time.monotonic()
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
+        pool = _get_pool()
+        while True:
+            try:
+                conn = pool.get_connection()
+                break
+            except mysql.connector.errors.PoolError:
+                if time.monotonic() - start >= DB_POOL_TIMEOUT:
+                    with _pool_stats_lock:
+                        _pool_stats["timeouts"] += 1
+                    print(f"Kesalahan koneksi ke MySQL: pool '{DB_POOL_NAME}' penuh selama {DB_POOL_TIMEOUT} detik.")
+                    return None
+                time.sleep(0.01)
+        try:
+            conn.ping(reconnect=True, attempts=2, delay=0)
+        except mysql.connector.Error as err:
+            with _pool_stats_lock:
+                _pool_stats["health_check_failures"] += 1
+            print(f"Health check koneksi pool gagal: {err}")
+            conn.close()
+            return None
+        _record_checkout(time.monotonic() - start)
         return conn
     except mysql.connector.Error as err:
         print(f"Kesalahan koneksi ke MySQL: {err}")
         return None
 
-def create_tables():
+@contextmanager
+def db_connection():
+    """
+    Context manager untuk koneksi dari pool. Menghasilkan None jika koneksi gagal,
+    dan selalu mengembalikan koneksi ke pool saat keluar dari blok.
+    """
     conn = get_db_connection()
-    if not conn:
-        print("Tidak dapat membuat tabel, tidak ada koneksi DB.")
-        return
-    cursor = conn.cursor()
+    try:
+        yield conn
+    finally:
+        if conn:
+            conn.close()
+
+def _ensure_column(cursor, table, column, definition):
+    """Tambahkan kolom ke tabel yang sudah ada jika kolom tersebut belum ada."""
     cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            username VARCHAR(255) UNIQUE NOT NULL,
-            password_hash VARCHAR(255) NOT NULL,
-            role ENUM('admin', 'user') DEFAULT 'user',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
+        SELECT COUNT(*) FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+    ''', (table, column))
+    if cursor.fetchone()[0] == 0:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        print(f"Kolom {column} ditambahkan ke tabel {table}.")
+
+def _ensure_chat_logs_session_index(cursor):
+    """Tambahkan index komposit (session_id, id) pada tabel chat_logs lama yang belum memilikinya."""
     cursor.execute('''
-        CREATE TABLE IF NOT EXISTS knowledge_files (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            filename VARCHAR(255) NOT NULL,
-            filepath VARCHAR(512) NOT NULL,
-            uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            status ENUM('active', 'processing', 'inactive', 'error', 'pending') DEFAULT 'pending' 
-        )
-    ''') # Tambah status 'pending' jika mau
+        SELECT COUNT(*) FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = 'chat_logs'
+          AND index_name = 'idx_chat_logs_session_id_id'
+    ''')
+    if cursor.fetchone()[0] == 0:
+        cursor.execute("CREATE INDEX idx_chat_logs_session_id_id ON chat_logs (session_id, id)")
+        print("Index idx_chat_logs_session_id_id ditambahkan ke tabel chat_logs.")
+
+def _ensure_chat_logs_turn_key_index(cursor):
     cursor.execute('''
-        CREATE TABLE IF NOT EXISTS chat_logs (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            session_id VARCHAR(255) NOT NULL,
-            user_query TEXT,
-            gpt_response TEXT,
-            model_name VARCHAR(255),
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            INDEX(session_id)
-        )
+        SELECT COUNT(*) FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = 'chat_logs'
+          AND index_name = 'idx_chat_logs_turn_key'
     ''')
-    conn.commit()
-    cursor.close()
-    conn.close()
+    if cursor.fetchone()[0] == 0:
+        cursor.execute("CREATE INDEX idx_chat_logs_turn_key ON chat_logs (turn_key)")
+        print("Index idx_chat_logs_turn_key ditambahkan ke tabel chat_logs.")
+
+def create_tables():
+    with db_connection() as conn:
+        if not conn:
+            print("Tidak dapat membuat tabel, tidak ada koneksi DB.")
+            return False
+        cursor = conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                username VARCHAR(255) UNIQUE NOT NULL,
+                password_hash VARCHAR(255) NOT NULL,
+                role ENUM('admin', 'user') DEFAULT 'user',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS knowledge_files (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                filename VARCHAR(255) NOT NULL,
+                filepath VARCHAR(512) NOT NULL,
+                uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                status ENUM('active', 'processing', 'inactive', 'error', 'pending') DEFAULT 'pending',
+                claimed_by VARCHAR(64) NULL,
+                claimed_at TIMESTAMP NULL,
+                progress VARCHAR(255) NULL,
+                content_hash CHAR(64) NULL
+            )
+        ''') # Tambah status 'pending' jika mau
+        # Kolom untuk worker ingestion di latar belakang (tabel lama belum memilikinya)
+        _ensure_column(cursor, 'knowledge_files', 'claimed_by', 'VARCHAR(64) NULL')
+        _ensure_column(cursor, 'knowledge_files', 'claimed_at', 'TIMESTAMP NULL')
+        _ensure_column(cursor, 'knowledge_files', 'progress', 'VARCHAR(255) NULL')
+        _ensure_column(cursor, 'knowledge_files', 'content_hash', 'CHAR(64) NULL')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS chat_logs (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                session_id VARCHAR(255) NOT NULL,
+                user_query TEXT,
+                gpt_response TEXT,
+                model_name VARCHAR(255),
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                turn_key CHAR(32) NULL,
+                INDEX(session_id),
+                INDEX idx_chat_logs_session_id_id (session_id, id),
+                INDEX idx_chat_logs_turn_key (turn_key)
+            )
+        ''')
+        _ensure_chat_logs_session_index(cursor)
+        # Kunci giliran dari klien: menghubungkan trace ke barisnya dan mencegah giliran ganda
+        # saat riwayat digabung dengan antrean write-behind
+        _ensure_column(cursor, 'chat_logs', 'turn_key', 'CHAR(32) NULL')
+        _ensure_chat_logs_turn_key_index(cursor)
+        # Span latensi per giliran (lihat utils_tracing.TurnTrace), satu baris per chat_logs
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS chat_turn_traces (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                chat_log_id INT NOT NULL,
+                session_id VARCHAR(255) NOT NULL,
+                outcome VARCHAR(64),
+                total_ms DOUBLE,
+                spans JSON,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                INDEX(chat_log_id),
+                INDEX(session_id)
+            )
+        ''')
+        conn.commit()
+        cursor.close()
     print("Pengecekan/pembuatan tabel database selesai.")
+    return True
 
 def add_admin_user_if_not_exists():
-    conn = get_db_connection()
-    if not conn: return
-    cursor = conn.cursor()
-    admin_user = os.getenv("ADMIN_USERNAME", "admin")
-    admin_pass = os.getenv("ADMIN_PASSWORD", "admin_password")
-    cursor.execute("SELECT id FROM users WHERE username = %s AND role = 'admin'", (admin_user,))
-    if not cursor.fetchone():
-        if not admin_pass:
-            print("Password admin tidak diset di .env. Tidak dapat membuat admin.")
-        else:
-            # Menggunakan metode hash yang lebih portabel jika scrypt bermasalah
-            hashed_password = generate_password_hash(admin_pass, method='pbkdf2:sha256')
-            try:
-                cursor.execute(
-                    "INSERT INTO users (username, password_hash, role) VALUES (%s, %s, %s)",
-                    (admin_user, hashed_password, 'admin')
-                )
-                conn.commit()
-                print(f"Pengguna admin '{admin_user}' berhasil dibuat dengan metode pbkdf2:sha256.")
-            except mysql.connector.Error as err:
-                print(f"Gagal membuat pengguna admin: {err}")
-                conn.rollback()
-    cursor.close()
-    conn.close()
+    with db_connection() as conn:
+        if not conn: return
+        cursor = conn.cursor()
+        admin_user = os.getenv("ADMIN_USERNAME", "admin")
+        admin_pass = os.getenv("ADMIN_PASSWORD", "admin_password")
+        cursor.execute("SELECT id FROM users WHERE username = %s AND role = 'admin'", (admin_user,))
+        if not cursor.fetchone():
+            if not admin_pass:
+                print("Password admin tidak diset di .env. Tidak dapat membuat admin.")
+            else:
+                # Menggunakan metode hash yang lebih portabel jika scrypt bermasalah
+                hashed_password = generate_password_hash(admin_pass, method='pbkdf2:sha256')
+                try:
+                    cursor.execute(
+                        "INSERT INTO users (username, password_hash, role) VALUES (%s, %s, %s)",
+                        (admin_user, hashed_password, 'admin')
+                    )
+                    conn.commit()
+                    print(f"Pengguna admin '{admin_user}' berhasil dibuat dengan metode pbkdf2:sha256.")
+                except mysql.connector.Error as err:
+                    print(f"Gagal membuat pengguna admin: {err}")
+                    conn.rollback()
+        cursor.close()
 
 def verify_admin(username, password):
-    conn = get_db_connection()
-    if not conn: return False
-    cursor = conn.cursor(dictionary=True)
-    try:
-        cursor.execute("SELECT password_hash, role FROM users WHERE username = %s", (username,))
-        user = cursor.fetchone()
-        if user and user['role'] == 'admin' and check_password_hash(user['password_hash'], password):
-            return True
-    except mysql.connector.Error as err:
-        print(f"Error saat verifikasi admin: {err}")
-    finally:
-        cursor.close()
-        conn.close()
+    ensure_schema() # Akun admin dibuat saat skema disiapkan
+    with db_connection() as conn:
+        if not conn: return False
+        cursor = conn.cursor(dictionary=True)
+        try:
+            cursor.execute("SELECT password_hash, role FROM users WHERE username = %s", (username,))
+            user = cursor.fetchone()
+            if user and user['role'] == 'admin' and check_password_hash(user['password_hash'], password):
+                return True
+        except mysql.connector.Error as err:
+            print(f"Error saat verifikasi admin: {err}")
+        finally:
+            cursor.close()
     return False
 
 def store_file_metadata(filename, filepath, status='processing'): # Default status saat upload
-    conn = get_db_connection()
-    if not conn: return None
-    cursor = conn.cursor()
-    query = "INSERT INTO knowledge_files (filename, filepath, status) VALUES (%s, %s, %s)"
-    try:
-        cursor.execute(query, (filename, filepath, status))
-        conn.commit()
-        file_id = cursor.lastrowid
-        return file_id
-    except mysql.connector.Error as err:
-        print(f"Error menyimpan metadata file: {err}")
-        conn.rollback()
-        return None
-    finally:
-        cursor.close()
-        conn.close()
+    with db_connection() as conn:
+        if not conn: return None
+        cursor = conn.cursor()
+        query = "INSERT INTO knowledge_files (filename, filepath, status) VALUES (%s, %s, %s)"
+        try:
+            cursor.execute(query, (filename, filepath, status))
+            conn.commit()
+            file_id = cursor.lastrowid
+            return file_id
+        except mysql.connector.Error as err:
+            print(f"Error menyimpan metadata file: {err}")
+            conn.rollback()
+            return None
+        finally:
+            cursor.close()
 
 def update_file_status(file_id, status):
-    conn = get_db_connection()
-    if not conn: return
-    cursor = conn.cursor()
-    query = "UPDATE knowledge_files SET status = %s WHERE id = %s"
-    try:
-        cursor.execute(query, (status, file_id))
-        conn.commit()
-        print(f"Status file ID {file_id} diupdate menjadi {status}")
-    except mysql.connector.Error as err:
-        print(f"Error memperbarui status file ID {file_id}: {err}")
-        conn.rollback()
-    finally:
-        cursor.close()
-        conn.close()
+    with db_connection() as conn:
+        if not conn: return
+        cursor = conn.cursor()
+        # Status baru berarti klaim worker (jika ada) selesai
+        query = "UPDATE knowledge_files SET status = %s, claimed_by = NULL, claimed_at = NULL WHERE id = %s"
+        try:
+            cursor.execute(query, (status, file_id))
+            conn.commit()
+            print(f"Status file ID {file_id} diupdate menjadi {status}")
+        except mysql.connector.Error as err:
+            print(f"Error memperbarui status file ID {file_id}: {err}")
+            conn.rollback()
+        finally:
+            cursor.close()
+
+def update_file_progress(file_id, progress):
+    with db_connection() as conn:
+        if not conn: return
+        cursor = conn.cursor()
+        try:
+            cursor.execute("UPDATE knowledge_files SET progress = %s WHERE id = %s", (progress[:255], file_id))
+            conn.commit()
+        except mysql.connector.Error as err:
+            print(f"Error memperbarui progres file ID {file_id}: {err}")
+            conn.rollback()
+        finally:
+            cursor.close()
+
+def update_file_content_hash(file_id, content_hash):
+    with db_connection() as conn:
+        if not conn: return
+        cursor = conn.cursor()
+        try:
+            cursor.execute("UPDATE knowledge_files SET content_hash = %s WHERE id = %s", (content_hash, file_id))
+            conn.commit()
+        except mysql.connector.Error as err:
+            print(f"Error memperbarui hash file ID {file_id}: {err}")
+            conn.rollback()
+        finally:
+            cursor.close()
+
+def get_previous_file_versions(filepath, exclude_file_id):
+    """Versi aktif lain dari file dengan path yang sama (unggahan ulang menimpa file di disk)."""
+    files = []
+    with db_connection() as conn:
+        if not conn: return []
+        cursor = conn.cursor(dictionary=True)
+        try:
+            cursor.execute(
+                "SELECT id, content_hash FROM knowledge_files WHERE filepath = %s AND id != %s AND status = 'active'",
+                (filepath, exclude_file_id)
+            )
+            files = cursor.fetchall()
+        except mysql.connector.Error as err:
+            print(f"Error mengambil versi file sebelumnya: {err}")
+        finally:
+            cursor.close()
+    return files
+
+def claim_files_for_ingestion(worker_id, limit=1, stale_after_seconds=3600):
+    """
+    Mengklaim file berstatus 'pending'/'processing' untuk diproses oleh worker_id.
+    Baris dikunci dengan SELECT ... FOR UPDATE SKIP LOCKED sehingga beberapa worker
+    tidak mengklaim file yang sama. Klaim yang lebih lama dari stale_after_seconds
+    (misalnya worker mati) boleh diambil alih.
+    """
+    files = []
+    with db_connection() as conn:
+        if not conn: return []
+        cursor = conn.cursor(dictionary=True)
+        try:
+            conn.start_transaction()
+            cursor.execute('''
+                SELECT id, filename, filepath FROM knowledge_files
+                WHERE status IN ('pending', 'processing')
+                  AND (claimed_by IS NULL OR claimed_at < NOW() - INTERVAL %s SECOND)
+                ORDER BY id
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            ''', (stale_after_seconds, limit))
+            files = cursor.fetchall()
+            for file_entry in files:
+                cursor.execute(
+                    "UPDATE knowledge_files SET status = 'processing', claimed_by = %s, claimed_at = NOW(), "
+                    "progress = 'Diklaim oleh worker' WHERE id = %s",
+                    (worker_id, file_entry['id'])
+                )
+            conn.commit()
+            if files:
+                print(f"Worker {worker_id} mengklaim {len(files)} file untuk diproses.")
+        except mysql.connector.Error as err:
+            print(f"Error mengklaim file untuk ingestion: {err}")
+            conn.rollback()
+            files = []
+        finally:
+            cursor.close()
+    return files
+
+def get_knowledge_files_overview():
+    """Daftar semua file basis pengetahuan beserta status dan progres ingestion (untuk halaman admin)."""
+    files = []
+    with db_connection() as conn:
+        if not conn: return []
+        cursor = conn.cursor(dictionary=True)
+        try:
+            cursor.execute(
+                "SELECT id, filename, status, progress, uploaded_at FROM knowledge_files ORDER BY id DESC"
+            )
+            files = cursor.fetchall()
+        except mysql.connector.Error as err:
+            print(f"Error mengambil daftar file: {err}")
+        finally:
+            cursor.close()
+    return files
 
 def get_active_knowledge_files():
-    conn = get_db_connection()
-    if not conn: return []
-    cursor = conn.cursor(dictionary=True)
     files = []
-    try:
-        cursor.execute("SELECT filepath FROM knowledge_files WHERE status = 'active'")
-        files = [row['filepath'] for row in cursor.fetchall()]
-    except mysql.connector.Error as err:
-        print(f"Error mengambil file aktif: {err}")
-    finally:
-        cursor.close()
-        conn.close()
+    with db_connection() as conn:
+        if not conn: return []
+        cursor = conn.cursor(dictionary=True)
+        try:
+            cursor.execute("SELECT filepath FROM knowledge_files WHERE status = 'active'")
+            files = [row['filepath'] for row in cursor.fetchall()]
+        except mysql.connector.Error as err:
+            print(f"Error mengambil file aktif: {err}")
+        finally:
+            cursor.close()
     return files
 
 def get_unprocessed_files_for_rag(): # Nama fungsi disesuaikan
     """Mengambil daftar file yang belum diproses (status 'processing')."""
-    conn = get_db_connection()
-    if not conn: return []
-    cursor = conn.cursor(dictionary=True)
     files = []
-    try:
-        cursor.execute("SELECT id, filename, filepath FROM knowledge_files WHERE status = 'processing'")
-        files = cursor.fetchall() # Mengembalikan list of dicts
-        print(f"Ditemukan {len(files)} file dengan status 'processing'.")
-    except mysql.connector.Error as err:
-        print(f"Error mengambil file yang belum diproses: {err}")
-    finally:
-        cursor.close()
-        conn.close()
+    with db_connection() as conn:
+        if not conn: return []
+        cursor = conn.cursor(dictionary=True)
+        try:
+            cursor.execute("SELECT id, filename, filepath FROM knowledge_files WHERE status = 'processing'")
+            files = cursor.fetchall() # Mengembalikan list of dicts
+            print(f"Ditemukan {len(files)} file dengan status 'processing'.")
+        except mysql.connector.Error as err:
+            print(f"Error mengambil file yang belum diproses: {err}")
+        finally:
+            cursor.close()
     return files
 
 
-def insert_chat_log(session_id, user_query, gpt_response, model_name="LlamaCpp_GiziAI_Streamlit"):
-    conn = get_db_connection()
-    if not conn: return
-    cursor = conn.cursor()
-    query = '''
-        INSERT INTO chat_logs (session_id, user_query, gpt_response, model_name)
-        VALUES (%s, %s, %s, %s)
-    '''
-    try:
-        cursor.execute(query, (session_id, user_query, gpt_response, model_name))
-        conn.commit()
-    except mysql.connector.Error as err:
-        print(f"Error menyisipkan log chat: {err}")
-        conn.rollback()
-    finally:
-        cursor.close()
-        conn.close()
+# Cache riwayat chat per sesi (ring buffer) di dalam proses.
+# Jalur RAG hanya membutuhkan beberapa pesan terakhir, jadi setiap sesi menyimpan
+# paling banyak CHAT_HISTORY_CACHE_MESSAGES pesan, dan jumlah sesi dibatasi (LRU).
+CHAT_HISTORY_CACHE_MESSAGES = int(os.getenv("CHAT_HISTORY_CACHE_MESSAGES", 20))
+CHAT_HISTORY_CACHE_SESSIONS = int(os.getenv("CHAT_HISTORY_CACHE_SESSIONS", 1000))
+
+_chat_history_cache = OrderedDict()
+_chat_history_cache_lock = threading.Lock()
+# Generasi per sesi: nilai penghitung global saat giliran terakhir sesi itu ditambahkan.
+# Pembaca DB mencatatnya sebelum membaca dan tidak menyimpan hasilnya ke cache jika berubah,
+# karena giliran itu mungkin belum terlihat oleh bacaannya. Sesi yang dibuang (LRU) memakai
+# generasi terbesar yang pernah dibuang, sehingga perubahannya tetap terdeteksi.
+_chat_history_generations = OrderedDict()
+_chat_history_generation_counter = 0
+_chat_history_generation_floor = 0
+
+def _rows_to_messages(rows):
+    from langchain_core.messages import HumanMessage, AIMessage
+    messages = []
+    for row in rows:
+        if row['user_query']:
+            messages.append(HumanMessage(content=row['user_query']))
+        if row['gpt_response']: # Pastikan gpt_response tidak None atau string kosong jika tidak mau ditambahkan
+            messages.append(AIMessage(content=row['gpt_response']))
+    return messages
 
-def get_chat_history_from_db(session_id):
+def _append_to_chat_history_cache(session_id, user_query, gpt_response):
+    """Tambahkan satu giliran ke cache, hanya jika sesi tersebut sudah di-cache (agar tetap konsisten dengan DB)."""
+    global _chat_history_generation_counter, _chat_history_generation_floor
+    with _chat_history_cache_lock:
+        _chat_history_generation_counter += 1
+        _chat_history_generations[session_id] = _chat_history_generation_counter
+        _chat_history_generations.move_to_end(session_id)
+        while len(_chat_history_generations) > CHAT_HISTORY_CACHE_SESSIONS * 2:
+            _, generation = _chat_history_generations.popitem(last=False)
+            _chat_history_generation_floor = max(_chat_history_generation_floor, generation)
+        buffer = _chat_history_cache.get(session_id)
+        if buffer is None:
+            return
+        buffer.extend(_rows_to_messages([{'user_query': user_query, 'gpt_response': gpt_response}]))
+        _chat_history_cache.move_to_end(session_id)
+
+def get_recent_chat_history(session_id, max_messages):
+    """
+    Mengambil max_messages pesan terakhir sebuah sesi.
+    Dilayani dari ring buffer jika sesi sudah di-cache; jika belum, dibaca dari DB
+    dengan query berjendela lalu disimpan ke cache, kecuali ada giliran baru untuk sesi
+    ini selama pembacaan (hasilnya bisa belum memuat giliran itu).
+    """
+    if max_messages <= 0:
+        return []
+    with _chat_history_cache_lock:
+        buffer = _chat_history_cache.get(session_id)
+        if buffer is not None and max_messages <= buffer.maxlen:
+            _chat_history_cache.move_to_end(session_id)
+            return list(buffer)[-max_messages:]
+        generation = _chat_history_generations.get(session_id, _chat_history_generation_floor)
+
+    cache_size = max(CHAT_HISTORY_CACHE_MESSAGES, max_messages)
+    messages = get_chat_history_from_db(session_id, max_messages=cache_size)
+    with _chat_history_cache_lock:
+        if _chat_history_generations.get(session_id, _chat_history_generation_floor) != generation:
+            return messages[-max_messages:]
+        _chat_history_cache[session_id] = deque(messages, maxlen=cache_size)
+        _chat_history_cache.move_to_end(session_id)
+        while len(_chat_history_cache) > CHAT_HISTORY_CACHE_SESSIONS:
+            _chat_history_cache.popitem(last=False)
+    return messages[-max_messages:]
+
+# Penulisan chat_logs secara write-behind: insert_chat_log hanya memasukkan giliran ke
+# antrean di memori, lalu thread latar belakang menulisnya per batch (executemany) saat
+# antrean mencapai CHAT_LOG_BATCH_SIZE atau setiap CHAT_LOG_FLUSH_INTERVAL_SECONDS.
+# Jika MySQL lambat/mati, antrean yang melebihi CHAT_LOG_MAX_PENDING dipindah ke file
+# spill (dibatasi CHAT_LOG_SPILL_MAX_BYTES) dan ditulis ulang ke DB setelah pulih.
+CHAT_LOG_WRITE_BEHIND_ENABLED = os.getenv("CHAT_LOG_WRITE_BEHIND_ENABLED", "true").lower() == "true"
+CHAT_LOG_BATCH_SIZE = int(os.getenv("CHAT_LOG_BATCH_SIZE", 50))
+CHAT_LOG_FLUSH_INTERVAL_SECONDS = float(os.getenv("CHAT_LOG_FLUSH_INTERVAL_SECONDS", 1.0))
+CHAT_LOG_MAX_PENDING = int(os.getenv("CHAT_LOG_MAX_PENDING", 5000))
+CHAT_LOG_SPILL_PATH = os.getenv("CHAT_LOG_SPILL_PATH", "chat_logs_spill.jsonl")
+CHAT_LOG_SPILL_MAX_BYTES = int(os.getenv("CHAT_LOG_SPILL_MAX_BYTES", 50 * 1024 * 1024))
+CHAT_LOG_RETRY_MAX_SECONDS = float(os.getenv("CHAT_LOG_RETRY_MAX_SECONDS", 30))
+CHAT_LOG_SHUTDOWN_TIMEOUT_SECONDS = float(os.getenv("CHAT_LOG_SHUTDOWN_TIMEOUT_SECONDS", 10))
+_CHAT_LOG_REQUIRED_FIELDS = ("session_id", "user_query", "gpt_response", "model_name", "created_at")
+
+def _write_chat_log_batch(entries):
+    """
+    Menulis beberapa giliran chat (dan trace-nya) dalam satu transaksi. Trace dihubungkan ke
+    barisnya lewat turn_key, karena id auto-increment satu batch tidak dijamin berurutan
+    (innodb_autoinc_lock_mode=2 dengan penulis lain). Mengembalikan True jika berhasil.
+    """
+    for e in entries:
+        # Entri dari file spill versi lama belum memiliki turn_key
+        e.setdefault("turn_key", uuid.uuid4().hex)
+    with db_connection() as conn:
+        if not conn:
+            return False
+        cursor = conn.cursor()
+        try:
+            cursor.executemany(
+                '''
+                INSERT INTO chat_logs (session_id, user_query, gpt_response, model_name, created_at, turn_key)
+                VALUES (%s, %s, %s, %s, %s, %s)
+                ''',
+                [(e["session_id"], e["user_query"], e["gpt_response"], e["model_name"], e["created_at"], e["turn_key"])
+                 for e in entries]
+            )
+            traces = [
+                (e["session_id"], e["trace"]["outcome"], e["trace"]["total_ms"], e["trace"]["spans"], e["turn_key"])
+                for e in entries if e.get("trace") is not None
+            ]
+            if traces:
+                cursor.executemany(
+                    '''
+                    INSERT INTO chat_turn_traces (chat_log_id, session_id, outcome, total_ms, spans)
+                    SELECT id, %s, %s, %s, %s FROM chat_logs WHERE turn_key = %s
+                    ''',
+                    traces
+                )
+            conn.commit()
+            return True
+        except mysql.connector.Error as err:
+            print(f"Error menyisipkan batch log chat ({len(entries)} baris): {err}")
+            conn.rollback()
+            return False
+        finally:
+            cursor.close()
+
+class ChatLogWriter:
+    """
+    Antrean write-behind untuk chat_logs. Satu flush berjalan pada satu waktu
+    (_flush_lock). Pembaca riwayat tidak menunggu flush: read_with_pending mengambil
+    salinan antrean dan file spill di bawah _lock, lalu giliran yang ternyata sudah
+    tertulis ke DB dikenali lewat turn_key sehingga setiap giliran terlihat tepat sekali.
+    """
+
+    def __init__(self, write_batch=_write_chat_log_batch, batch_size=CHAT_LOG_BATCH_SIZE,
+                 flush_interval=CHAT_LOG_FLUSH_INTERVAL_SECONDS, max_pending=CHAT_LOG_MAX_PENDING,
+                 spill_path=CHAT_LOG_SPILL_PATH, spill_max_bytes=CHAT_LOG_SPILL_MAX_BYTES):
+        self.write_batch = write_batch
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.spill_path = spill_path
+        self.spill_max_bytes = spill_max_bytes
+        self._pending = deque()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._stats = {"submitted": 0, "written": 0, "batches": 0, "failed_flushes": 0,
+                       "spilled": 0, "dropped": 0, "last_batch_ms": 0.0}
+
+    def submit(self, entry):
+        with self._lock:
+            self._pending.append(entry)
+            self._stats["submitted"] += 1
+            if len(self._pending) >= self.batch_size:
+                self._wakeup.set()
+        self._ensure_thread()
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop_event.clear()
+                self._thread = threading.Thread(target=self._run, name="chat-log-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        delay = self.flush_interval
+        while not self._stop_event.is_set():
+            self._wakeup.wait(delay)
+            self._wakeup.clear()
+            if self._stop_event.is_set():
+                break
+            try:
+                flushed = self.flush()
+            except Exception as e:
+                # Thread penulis tidak boleh berhenti: antrean akan menumpuk tanpa pernah ditulis
+                print(f"Error tak terduga di penulis log chat: {e}")
+                flushed = False
+            if flushed:
+                delay = self.flush_interval
+            else:
+                # DB bermasalah: coba lagi dengan jeda yang makin panjang
+                delay = min(max(delay, 0.5) * 2, CHAT_LOG_RETRY_MAX_SECONDS)
+
+    def flush(self):
+        """Menulis isi file spill lalu antrean ke DB. Mengembalikan True jika semuanya tertulis."""
+        with self._flush_lock:
+            try:
+                if not self._flush_spill():
+                    self._handle_failed_flush()
+                    return False
+            except Exception as e:
+                print(f"Error saat menulis file spill log chat '{self.spill_path}': {e}")
+                self._handle_failed_flush()
+                return False
+            while True:
+                with self._lock:
+                    batch = [self._pending[i] for i in range(min(self.batch_size, len(self._pending)))]
+                if not batch:
+                    return True
+                started = time.monotonic()
+                try:
+                    written = self.write_batch(batch)
+                except Exception as e:
+                    print(f"Error saat menulis batch log chat ({len(batch)} baris): {e}")
+                    written = False
+                if not written:
+                    self._handle_failed_flush()
+                    return False
+                with self._lock:
+                    for _ in batch:
+                        self._pending.popleft()
+                    self._stats["written"] += len(batch)
+                    self._stats["batches"] += 1
+                    self._stats["last_batch_ms"] = round((time.monotonic() - started) * 1000, 2)
+
+    def _handle_failed_flush(self):
+        # Dipanggil dengan _flush_lock: antrean berlebih (entri tertua) dipindah ke file spill
+        with self._lock:
+            self._stats["failed_flushes"] += 1
+            overflow = [self._pending.popleft() for _ in range(max(0, len(self._pending) - self.max_pending))]
+            if overflow:
+                self._spill(overflow)
+
+    def _spill(self, entries):
+        """Menambahkan entri ke file spill (urutan tetap: isi spill selalu lebih tua dari antrean)."""
+        try:
+            size = os.path.getsize(self.spill_path) if os.path.exists(self.spill_path) else 0
+            with open(self.spill_path, "a", encoding="utf-8") as f:
+                for entry in entries:
+                    line = json.dumps(entry, ensure_ascii=False) + "\n"
+                    if size + len(line) > self.spill_max_bytes:
+                        self._stats["dropped"] += 1
+                        continue
+                    f.write(line)
+                    size += len(line)
+                    self._stats["spilled"] += 1
+        except OSError as e:
+            self._stats["dropped"] += len(entries)
+            print(f"Gagal menulis file spill log chat '{self.spill_path}': {e}")
+            return
+        if self._stats["dropped"]:
+            print(f"WARNING: File spill log chat penuh ({self.spill_max_bytes} bytes); "
+                  f"{self._stats['dropped']} giliran dibuang sejauh ini.")
+
+    def _read_spill(self, bad_lines=None):
+        """
+        Entri di file spill. Baris yang rusak (misalnya terpotong karena proses dihentikan paksa)
+        atau tidak lengkap dilewati; jika bad_lines diberikan, baris itu ditambahkan ke sana.
+        """
+        if not os.path.exists(self.spill_path):
+            return []
+        entries = []
+        with open(self.spill_path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    entry = None
+                if not isinstance(entry, dict) or any(field not in entry for field in _CHAT_LOG_REQUIRED_FIELDS):
+                    if bad_lines is not None:
+                        bad_lines.append(line)
+                    continue
+                entries.append(entry)
+        return entries
+
+    def _flush_spill(self):
+        bad_lines = []
+        entries = self._read_spill(bad_lines)
+        if bad_lines:
+            # Disimpan terpisah untuk diperiksa, karena file spill dihapus setelah ditulis ke DB
+            with open(self.spill_path + ".corrupt", "a", encoding="utf-8") as f:
+                f.writelines(line + "\n" for line in bad_lines)
+            print(f"WARNING: {len(bad_lines)} baris rusak di file spill log chat dilewati "
+                  f"dan dipindah ke {self.spill_path}.corrupt.")
+            if not entries:
+                os.remove(self.spill_path)
+        for start in range(0, len(entries), self.batch_size):
+            if not self.write_batch(entries[start:start + self.batch_size]):
+                # Simpan hanya sisa yang belum tertulis agar tidak tersisip dua kali
+                temp_path = self.spill_path + ".tmp"
+                with open(temp_path, "w", encoding="utf-8") as f:
+                    for entry in entries[start:]:
+                        f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                os.replace(temp_path, self.spill_path)
+                return False
+        if entries:
+            os.remove(self.spill_path)
+            print(f"{len(entries)} log chat dari file spill ditulis ke DB.")
+        return True
+
+    def read_with_pending(self, session_id, read_rows):
+        """
+        Menjalankan read_rows() (baca DB, None jika gagal; baris berisi turn_key) lalu menambahkan
+        giliran sesi ini yang belum tertulis. Salinan antrean dan file spill diambil sebelum
+        membaca DB: giliran yang tertulis sesudahnya muncul di keduanya dan disaring lewat
+        turn_key, giliran yang tertulis sebelumnya pasti terbaca dari DB.
+        """
+        with self._lock:
+            # Entri hanya pindah antrean -> spill di bawah _lock, jadi salinan ini konsisten
+            try:
+                spilled = self._read_spill()
+            except (OSError, ValueError):
+                spilled = []
+            unwritten = [e for e in spilled + list(self._pending) if e["session_id"] == session_id]
+        rows = read_rows()
+        if rows is None:
+            return None
+        written_keys = {row.get("turn_key") for row in rows}
+        return rows + [{"user_query": e["user_query"], "gpt_response": e["gpt_response"]}
+                       for e in unwritten if e.get("turn_key") not in written_keys]
+
+    def shutdown(self, timeout=CHAT_LOG_SHUTDOWN_TIMEOUT_SECONDS):
+        """Flush terakhir saat proses berhenti; sisa yang gagal ditulis disimpan ke file spill."""
+        self._stop_event.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        if not self._pending:
+            return
+        if not self.flush():
+            with self._lock:
+                remaining = list(self._pending)
+                self._pending.clear()
+                self._spill(remaining)
+            print(f"{len(remaining)} log chat belum tertulis disimpan ke {self.spill_path}.")
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["pending"] = len(self._pending)
+        stats["spill_bytes"] = os.path.getsize(self.spill_path) if os.path.exists(self.spill_path) else 0
+        return stats
+
+_chat_log_writer = ChatLogWriter()
+atexit.register(_chat_log_writer.shutdown)
+
+def flush_chat_logs():
+    """Menulis semua log chat yang masih di antrean sekarang. Mengembalikan True jika berhasil."""
+    return _chat_log_writer.flush()
+
+def get_chat_log_writer_stats():
+    """Jumlah giliran di antrean, batch yang ditulis, flush gagal, dan isi file spill."""
+    return _chat_log_writer.get_stats()
+
+def insert_chat_log(session_id, user_query, gpt_response, model_name="LlamaCpp_GiziAI_Streamlit", trace=None):
+    """
+    Menyimpan satu giliran chat. Jika trace diberikan (dict outcome, total_ms, spans JSON
+    dari TurnTrace.to_record), span latensinya disimpan di chat_turn_traces dalam transaksi yang sama.
+    Dengan CHAT_LOG_WRITE_BEHIND_ENABLED, giliran hanya dimasukkan ke antrean dan fungsi
+    ini langsung kembali tanpa menunggu DB.
+    """
+    _append_to_chat_history_cache(session_id, user_query, gpt_response)
+    entry = {
+        "session_id": session_id,
+        "user_query": user_query,
+        "gpt_response": gpt_response,
+        "model_name": model_name,
+        "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "trace": trace,
+        "turn_key": uuid.uuid4().hex,
+    }
+    if CHAT_LOG_WRITE_BEHIND_ENABLED:
+        _chat_log_writer.submit(entry)
+    else:
+        _write_chat_log_batch([entry])
+
+def get_chat_history_from_db(session_id, max_messages=None):
     """
     Mengambil riwayat chat berdasarkan session_id.
     Mengembalikan list of Langchain Message objects (HumanMessage, AIMessage)
     untuk digunakan langsung oleh MessagesPlaceholder.
+    Jika max_messages diberikan, hanya baris terakhir yang dibaca
+    (ORDER BY id DESC LIMIT n memakai index (session_id, id)).
     """
-    conn = get_db_connection()
-    if not conn: return []
-    
-    cursor = conn.cursor(dictionary=True)
-    # Modifikasi: Langsung buat objek Langchain Message untuk kemudahan di RAG
-    langchain_messages = []
-    from langchain_core.messages import HumanMessage, AIMessage
-    try:
-        cursor.execute(
-            'SELECT user_query, gpt_response FROM chat_logs WHERE session_id=%s ORDER BY created_at ASC',
-            (session_id,)
-        )
-        for row in cursor.fetchall():
-            if row['user_query']: 
-                langchain_messages.append(HumanMessage(content=row['user_query']))
-            if row['gpt_response']: # Pastikan gpt_response tidak None atau string kosong jika tidak mau ditambahkan
-                langchain_messages.append(AIMessage(content=row['gpt_response']))
-        print(f"Mengambil {len(langchain_messages)} pesan dari DB untuk session {session_id}")
-    except mysql.connector.Error as err:
-        print(f"Error mengambil riwayat chat dari DB: {err}")
-    finally:
-        cursor.close()
-        conn.close()
+    def read_rows():
+        with db_connection() as conn:
+            if not conn: return None
+            cursor = conn.cursor(dictionary=True)
+            try:
+                if max_messages is None:
+                    cursor.execute(
+                        'SELECT user_query, gpt_response, turn_key FROM chat_logs WHERE session_id=%s ORDER BY id ASC',
+                        (session_id,)
+                    )
+                    return cursor.fetchall()
+                # Satu baris menghasilkan maksimal dua pesan (pertanyaan + jawaban)
+                row_limit = (max_messages + 1) // 2
+                cursor.execute(
+                    'SELECT user_query, gpt_response, turn_key FROM chat_logs WHERE session_id=%s ORDER BY id DESC LIMIT %s',
+                    (session_id, row_limit)
+                )
+                return list(reversed(cursor.fetchall()))
+            except mysql.connector.Error as err:
+                print(f"Error mengambil riwayat chat dari DB: {err}")
+                return None
+            finally:
+                cursor.close()
+
+    # Giliran yang masih di antrean write-behind ikut dikembalikan
+    rows = _chat_log_writer.read_with_pending(session_id, read_rows)
+    if rows is None:
+        return []
+    langchain_messages = _rows_to_messages(rows)
+    if max_messages is not None:
+        langchain_messages = langchain_messages[-max_messages:]
+    print(f"Mengambil {len(langchain_messages)} pesan dari DB untuk session {session_id}")
     return langchain_messages
 
+_schema_ready = False
+_schema_lock = threading.Lock()
 
-if __name__ != "__main__":
-    create_tables()
-    add_admin_user_if_not_exists()
\ No newline at end of file
+def ensure_schema():
+    """
+    Membuat/migrasi tabel dan akun admin sekali per proses (tidak lagi saat modul diimpor,
+    agar import tidak menunggu DB). Dipanggil oleh startup bertahap di utils_rag dan
+    oleh ingest_worker.py. Mengembalikan True jika skema siap.
+    """
+    global _schema_ready
+    with _schema_lock:
+        if not _schema_ready and create_tables():
+            add_admin_user_if_not_exists()
+            _schema_ready = True
+    return _schema_ready
\ No newline at end of file
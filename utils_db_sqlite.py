@@ -0,0 +1,220 @@
+"""
+Pengganti utils_db berbasis SQLite untuk benchmark dan evaluasi offline.
+Menyediakan fungsi dengan nama dan bentuk hasil yang sama seperti utils_db
+(yang dipakai oleh utils_rag dan utils_ingest), tanpa server MySQL.
+Pasang dengan install() sebelum utils_rag/utils_ingest diimpor.
+"""
+import sqlite3
+import sys
+import threading
+import time
+
+_conn = None
+_lock = threading.RLock()
+
+
+def _connect(path=":memory:"):
+    global _conn
+    _conn = sqlite3.connect(path, check_same_thread=False)
+    _conn.row_factory = sqlite3.Row
+    _conn.execute("PRAGMA journal_mode=WAL")
+    create_tables()
+
+
+def install(path=":memory:"):
+    """Mendaftarkan modul ini sebagai utils_db di sys.modules."""
+    _connect(path)
+    sys.modules["utils_db"] = sys.modules[__name__]
+    return sys.modules[__name__]
+
+
+def create_tables():
+    with _lock:
+        _conn.executescript('''
+            CREATE TABLE IF NOT EXISTS knowledge_files (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                filename TEXT NOT NULL,
+                filepath TEXT NOT NULL,
+                uploaded_at REAL,
+                status TEXT DEFAULT 'pending',
+                claimed_by TEXT NULL,
+                claimed_at REAL NULL,
+                progress TEXT NULL,
+                content_hash TEXT NULL
+            );
+            CREATE TABLE IF NOT EXISTS chat_logs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                user_query TEXT,
+                gpt_response TEXT,
+                model_name TEXT,
+                created_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS idx_chat_logs_session_id_id ON chat_logs (session_id, id);
+            CREATE TABLE IF NOT EXISTS chat_turn_traces (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chat_log_id INTEGER NOT NULL,
+                session_id TEXT NOT NULL,
+                outcome TEXT,
+                total_ms REAL,
+                spans TEXT,
+                created_at REAL
+            );
+        ''')
+        _conn.commit()
+
+
+def ensure_schema():
+    return True
+
+
+def get_pool_stats():
+    return {"checkouts": 0, "wait_time_total": 0.0, "wait_time_max": 0.0, "timeouts": 0,
+            "health_check_failures": 0, "wait_time_avg": 0.0, "pool_size": 1}
+
+
+def store_file_metadata(filename, filepath, status='processing'):
+    with _lock:
+        cursor = _conn.execute(
+            "INSERT INTO knowledge_files (filename, filepath, status, uploaded_at) VALUES (?, ?, ?, ?)",
+            (filename, filepath, status, time.time())
+        )
+        _conn.commit()
+        return cursor.lastrowid
+
+
+def update_file_status(file_id, status):
+    with _lock:
+        _conn.execute(
+            "UPDATE knowledge_files SET status = ?, claimed_by = NULL, claimed_at = NULL WHERE id = ?",
+            (status, file_id)
+        )
+        _conn.commit()
+
+
+def update_file_progress(file_id, progress):
+    with _lock:
+        _conn.execute("UPDATE knowledge_files SET progress = ? WHERE id = ?", (progress[:255], file_id))
+        _conn.commit()
+
+
+def update_file_content_hash(file_id, content_hash):
+    with _lock:
+        _conn.execute("UPDATE knowledge_files SET content_hash = ? WHERE id = ?", (content_hash, file_id))
+        _conn.commit()
+
+
+def get_previous_file_versions(filepath, exclude_file_id):
+    with _lock:
+        rows = _conn.execute(
+            "SELECT id, content_hash FROM knowledge_files WHERE filepath = ? AND id != ? AND status = 'active'",
+            (filepath, exclude_file_id)
+        ).fetchall()
+    return [dict(row) for row in rows]
+
+
+def claim_files_for_ingestion(worker_id, limit=1, stale_after_seconds=3600):
+    with _lock:
+        rows = _conn.execute('''
+            SELECT id, filename, filepath FROM knowledge_files
+            WHERE status IN ('pending', 'processing')
+              AND (claimed_by IS NULL OR claimed_at < ?)
+            ORDER BY id
+            LIMIT ?
+        ''', (time.time() - stale_after_seconds, limit)).fetchall()
+        for row in rows:
+            _conn.execute(
+                "UPDATE knowledge_files SET status = 'processing', claimed_by = ?, claimed_at = ?, "
+                "progress = 'Diklaim oleh worker' WHERE id = ?",
+                (worker_id, time.time(), row["id"])
+            )
+        _conn.commit()
+    return [dict(row) for row in rows]
+
+
+def get_knowledge_files_overview():
+    with _lock:
+        rows = _conn.execute(
+            "SELECT id, filename, status, progress, uploaded_at FROM knowledge_files ORDER BY id DESC"
+        ).fetchall()
+    return [dict(row) for row in rows]
+
+
+def get_active_knowledge_files():
+    with _lock:
+        rows = _conn.execute("SELECT filepath FROM knowledge_files WHERE status = 'active'").fetchall()
+    return [row["filepath"] for row in rows]
+
+
+def get_unprocessed_files_for_rag():
+    with _lock:
+        rows = _conn.execute(
+            "SELECT id, filename, filepath FROM knowledge_files WHERE status = 'processing'"
+        ).fetchall()
+    return [dict(row) for row in rows]
+
+
+def _rows_to_messages(rows):
+    from langchain_core.messages import HumanMessage, AIMessage
+    messages = []
+    for row in rows:
+        if row['user_query']:
+            messages.append(HumanMessage(content=row['user_query']))
+        if row['gpt_response']:
+            messages.append(AIMessage(content=row['gpt_response']))
+    return messages
+
+
+def insert_chat_log(session_id, user_query, gpt_response, model_name="LlamaCpp_GiziAI_Streamlit", trace=None):
+    with _lock:
+        cursor = _conn.execute(
+            "INSERT INTO chat_logs (session_id, user_query, gpt_response, model_name, created_at) VALUES (?, ?, ?, ?, ?)",
+            (session_id, user_query, gpt_response, model_name, time.time())
+        )
+        if trace is not None:
+            _conn.execute(
+                "INSERT INTO chat_turn_traces (chat_log_id, session_id, outcome, total_ms, spans, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (cursor.lastrowid, session_id, trace["outcome"], trace["total_ms"], trace["spans"], time.time())
+            )
+        _conn.commit()
+
+
+def flush_chat_logs():
+    # Stand-in menulis log chat secara sinkron, jadi tidak ada antrean
+    return True
+
+
+def get_chat_log_writer_stats():
+    return {"submitted": 0, "written": 0, "batches": 0, "failed_flushes": 0, "spilled": 0,
+            "dropped": 0, "last_batch_ms": 0.0, "pending": 0, "spill_bytes": 0}
+
+
+def get_chat_history_from_db(session_id, max_messages=None):
+    with _lock:
+        if max_messages is None:
+            rows = _conn.execute(
+                "SELECT user_query, gpt_response FROM chat_logs WHERE session_id = ? ORDER BY id ASC",
+                (session_id,)
+            ).fetchall()
+        else:
+            rows = _conn.execute(
+                "SELECT user_query, gpt_response FROM chat_logs WHERE session_id = ? ORDER BY id DESC LIMIT ?",
+                (session_id, (max_messages + 1) // 2)
+            ).fetchall()
+            rows = list(reversed(rows))
+    messages = _rows_to_messages(rows)
+    return messages if max_messages is None else messages[-max_messages:]
+
+
+def get_recent_chat_history(session_id, max_messages):
+    if max_messages <= 0:
+        return []
+    return get_chat_history_from_db(session_id, max_messages=max_messages)
+
+
+def get_turn_traces():
+    """Semua trace giliran yang tersimpan (untuk laporan benchmark)."""
+    with _lock:
+        rows = _conn.execute("SELECT session_id, outcome, total_ms, spans FROM chat_turn_traces ORDER BY id").fetchall()
+    return [dict(row) for row in rows]
@@ -0,0 +1,240 @@
+"""
+Backend model embedding untuk aplikasi dan worker ingestion.
+
+EMBEDDING_BACKEND memilih cara model (default intfloat/multilingual-e5-large) dijalankan:
+  - "sentence-transformers": SentenceTransformerEmbeddings (PyTorch, presisi penuh);
+  - "onnx": model diekspor ke ONNX (lewat optimum) dengan kuantisasi dinamis int8 dan
+            dijalankan ONNX Runtime di CPU. Tokenisasi memakai tokenizer.json (pustaka
+            tokenizers) dan pooling/normalisasi mengikuti konfigurasi SentenceTransformer
+            model yang sama, sehingga vektornya setara (lihat benchmark_embeddings.py).
+Jika model ONNX belum diekspor atau onnxruntime tidak tersedia, backend kembali ke
+sentence-transformers. Ekspor dilakukan sekali dengan export_onnx_embeddings.py (atau
+otomatis saat dimuat jika ONNX_EMBEDDING_AUTO_EXPORT=true).
+"""
+import json
+import os
+
+import numpy as np
+from dotenv import load_dotenv
+from langchain_core.embeddings import Embeddings
+
+load_dotenv(override=True)
+
+# "sentence-transformers" atau "onnx"
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "sentence-transformers").lower()
+MODEL_CACHE_DIR = os.getenv("MODEL_CACHE_DIR", "model/")
+ONNX_EMBEDDING_DIR = os.getenv("ONNX_EMBEDDING_DIR") # Kosong = MODEL_CACHE_DIR/onnx/<nama model>
+ONNX_EMBEDDING_QUANTIZED = os.getenv("ONNX_EMBEDDING_QUANTIZED", "true").lower() == "true"
+ONNX_EMBEDDING_AUTO_EXPORT = os.getenv("ONNX_EMBEDDING_AUTO_EXPORT", "false").lower() == "true"
+# Teks per panggilan session.run; teks diurutkan menurut panjang token agar padding minimal
+ONNX_EMBEDDING_BATCH_SIZE = int(os.getenv("ONNX_EMBEDDING_BATCH_SIZE", 16))
+ONNX_EMBEDDING_THREADS = int(os.getenv("ONNX_EMBEDDING_THREADS", 0)) # 0 = bawaan ONNX Runtime
+
+EMBEDDING_BACKENDS = ("sentence-transformers", "onnx")
+# Kunci konfigurasi modul Pooling sentence-transformers -> mode pooling yang didukung
+_POOLING_CONFIG_KEYS = {"pooling_mode_mean_tokens": "mean", "pooling_mode_cls_token": "cls",
+                        "pooling_mode_max_tokens": "max"}
+ONNX_CONFIG_FILE = "embedding_config.json"
+ONNX_MODEL_FILE = "model.onnx"
+ONNX_QUANTIZED_MODEL_FILE = "model_int8.onnx"
+DEFAULT_MAX_LENGTH = 512
+
+
+def default_onnx_model_dir(model_name):
+    return ONNX_EMBEDDING_DIR or os.path.join(MODEL_CACHE_DIR, "onnx", model_name.replace("/", "__"))
+
+
+def _load_model_json(model_name, filename):
+    """File JSON dari direktori model lokal atau repo Hugging Face (None jika tidak ada)."""
+    if os.path.isdir(model_name):
+        path = os.path.join(model_name, filename)
+        if not os.path.exists(path):
+            return None
+    else:
+        from huggingface_hub import hf_hub_download
+        try:
+            path = hf_hub_download(model_name, filename, token=os.getenv("HF_TOKEN") or None)
+        except Exception:
+            return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def read_sentence_transformers_config(model_name):
+    """
+    Pooling, normalisasi, dan panjang token maksimum yang dipakai SentenceTransformer untuk
+    model ini (modules.json, konfigurasi modul Pooling, sentence_bert_config.json). Tanpa
+    modules.json, SentenceTransformer memakai mean pooling tanpa normalisasi.
+    """
+    config = {"pooling": "mean", "normalize": False, "max_length": None}
+    for module in _load_model_json(model_name, "modules.json") or []:
+        module_type = module.get("type", "")
+        if module_type.endswith("Pooling"):
+            pooling = _load_model_json(model_name, os.path.join(module.get("path", ""), "config.json")) or {}
+            if "pooling_mode" in pooling:
+                # Format sentence-transformers yang lebih baru: satu kunci berisi nama mode
+                enabled = [f"pooling_mode_{pooling['pooling_mode']}_{'token' if pooling['pooling_mode'] == 'cls' else 'tokens'}"]
+            else:
+                enabled = [key for key, value in pooling.items() if key.startswith("pooling_mode_") and value is True]
+            if len(enabled) != 1 or enabled[0] not in _POOLING_CONFIG_KEYS:
+                raise ValueError(f"Pooling {enabled} pada {model_name} tidak didukung backend ONNX.")
+            config["pooling"] = _POOLING_CONFIG_KEYS[enabled[0]]
+        elif module_type.endswith("Normalize"):
+            config["normalize"] = True
+    sentence_config = _load_model_json(model_name, "sentence_bert_config.json") or {}
+    config["max_length"] = sentence_config.get("max_seq_length")
+    return config
+
+
+def export_onnx_model(model_name, output_dir=None, quantize=True):
+    """
+    Mengekspor model ke ONNX (task feature-extraction) beserta tokenizer-nya, lalu membuat
+    versi int8 dengan kuantisasi dinamis ONNX Runtime (bobot int8, aktivasi dikuantisasi saat
+    inferensi). Butuh optimum[onnxruntime] dan PyTorch; hanya perlu dijalankan sekali.
+    """
+    from optimum.exporters.onnx import main_export
+    from transformers import AutoTokenizer
+
+    output_dir = output_dir or default_onnx_model_dir(model_name)
+    config = read_sentence_transformers_config(model_name)
+    print(f"Mengekspor {model_name} ke ONNX di {output_dir}")
+    # library_name="transformers": keluaran last_hidden_state, pooling dilakukan OnnxEmbeddings
+    main_export(model_name, output=output_dir, task="feature-extraction", library_name="transformers",
+                token=os.getenv("HF_TOKEN") or None)
+    tokenizer = AutoTokenizer.from_pretrained(output_dir)
+    if not os.path.exists(os.path.join(output_dir, "tokenizer.json")):
+        raise RuntimeError(f"Tokenizer {model_name} tidak memiliki versi 'fast' (tokenizer.json).")
+    max_length = min(config["max_length"] or DEFAULT_MAX_LENGTH, tokenizer.model_max_length)
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        print("Membuat model ONNX int8 (kuantisasi dinamis)...")
+        quantize_dynamic(
+            os.path.join(output_dir, ONNX_MODEL_FILE),
+            os.path.join(output_dir, ONNX_QUANTIZED_MODEL_FILE),
+            weight_type=QuantType.QInt8,
+        )
+    with open(os.path.join(output_dir, ONNX_CONFIG_FILE), "w", encoding="utf-8") as f:
+        json.dump({
+            "model_name": model_name,
+            "pooling": config["pooling"],
+            "normalize": config["normalize"],
+            "max_length": max_length,
+            "pad_token_id": tokenizer.pad_token_id or 0,
+            "quantized": bool(quantize),
+        }, f, indent=2)
+    return output_dir
+
+
+class OnnxEmbeddings(Embeddings):
+    """Embeddings LangChain di atas sesi ONNX Runtime untuk model hasil export_onnx_model."""
+
+    def __init__(self, model_dir, quantized=ONNX_EMBEDDING_QUANTIZED, batch_size=ONNX_EMBEDDING_BATCH_SIZE,
+                 threads=ONNX_EMBEDDING_THREADS):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        config_path = os.path.join(model_dir, ONNX_CONFIG_FILE)
+        if not os.path.exists(config_path):
+            raise FileNotFoundError(f"Model embedding ONNX belum diekspor ke {model_dir}.")
+        with open(config_path, "r", encoding="utf-8") as f:
+            self.config = json.load(f)
+        if quantized and not self.config.get("quantized"):
+            raise FileNotFoundError(f"Model ONNX int8 tidak ada di {model_dir}; ekspor ulang dengan kuantisasi.")
+        self.model_name = self.config["model_name"]
+        self.variant = "onnx-int8" if quantized else "onnx"
+        self.batch_size = max(1, batch_size)
+        self.pad_token_id = self.config["pad_token_id"]
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.no_padding()
+        self.tokenizer.enable_truncation(max_length=self.config["max_length"])
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads > 0:
+            options.intra_op_num_threads = threads
+        model_file = ONNX_QUANTIZED_MODEL_FILE if quantized else ONNX_MODEL_FILE
+        self.session = ort.InferenceSession(
+            os.path.join(model_dir, model_file), sess_options=options, providers=["CPUExecutionProvider"]
+        )
+        self._input_names = {model_input.name for model_input in self.session.get_inputs()}
+        output_names = [output.name for output in self.session.get_outputs()]
+        self._output_name = "last_hidden_state" if "last_hidden_state" in output_names else output_names[0]
+
+    def _pool(self, hidden, attention_mask):
+        mask = attention_mask[:, :, None].astype(np.float32)
+        if self.config["pooling"] == "cls":
+            vectors = hidden[:, 0]
+        elif self.config["pooling"] == "max":
+            vectors = np.where(mask > 0, hidden, -1e9).max(axis=1)
+        else:
+            vectors = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        if self.config["normalize"]:
+            vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        return vectors
+
+    def _embed_batch(self, encodings):
+        width = max(len(encoding.ids) for encoding in encodings)
+        input_ids = np.full((len(encodings), width), self.pad_token_id, dtype=np.int64)
+        attention_mask = np.zeros((len(encodings), width), dtype=np.int64)
+        for row, encoding in enumerate(encodings):
+            input_ids[row, :len(encoding.ids)] = encoding.ids
+            attention_mask[row, :len(encoding.ids)] = 1
+        feed = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self._input_names:
+            feed["token_type_ids"] = np.zeros_like(input_ids)
+        hidden = self.session.run([self._output_name], feed)[0]
+        return self._pool(hidden, attention_mask)
+
+    def embed_documents(self, texts):
+        texts = list(texts)
+        if not texts:
+            return []
+        encodings = self.tokenizer.encode_batch(texts)
+        order = np.argsort([len(encoding.ids) for encoding in encodings], kind="stable")
+        vectors = [None] * len(texts)
+        for start in range(0, len(order), self.batch_size):
+            rows = order[start:start + self.batch_size]
+            for row, vector in zip(rows, self._embed_batch([encodings[row] for row in rows])):
+                vectors[row] = vector.tolist()
+        return vectors
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+def load_onnx_embeddings(model_name, model_dir=None, quantized=ONNX_EMBEDDING_QUANTIZED,
+                         auto_export=ONNX_EMBEDDING_AUTO_EXPORT):
+    model_dir = model_dir or default_onnx_model_dir(model_name)
+    if auto_export and not os.path.exists(os.path.join(model_dir, ONNX_CONFIG_FILE)):
+        export_onnx_model(model_name, model_dir, quantize=quantized)
+    embeddings = OnnxEmbeddings(model_dir, quantized=quantized)
+    if embeddings.model_name != model_name:
+        raise ValueError(f"Model ONNX di {model_dir} diekspor dari {embeddings.model_name}, bukan {model_name}.")
+    return embeddings
+
+
+def create_embeddings(model_name, backend=EMBEDDING_BACKEND):
+    """
+    Embedding function untuk backend yang dipilih. Backend ONNX yang gagal dimuat (belum
+    diekspor, onnxruntime tidak terpasang) kembali ke SentenceTransformerEmbeddings.
+    """
+    if backend == "onnx":
+        try:
+            embeddings = load_onnx_embeddings(model_name)
+            print(f"Backend embedding: ONNX Runtime ({embeddings.variant}) dari {default_onnx_model_dir(model_name)}")
+            return embeddings
+        except Exception as e:
+            print(f"Backend embedding ONNX tidak dapat dimuat ({e}). Memakai sentence-transformers. "
+                  f"Ekspor model dengan: python export_onnx_embeddings.py")
+    elif backend not in EMBEDDING_BACKENDS:
+        print(f"EMBEDDING_BACKEND '{backend}' tidak dikenal; memakai sentence-transformers.")
+    # Import berat (sentence-transformers/torch) ditunda sampai benar-benar dipakai
+    from langchain_community.embeddings.sentence_transformer import SentenceTransformerEmbeddings
+    return SentenceTransformerEmbeddings(model_name=model_name)
+
+
+def embedding_cache_name(embeddings, model_name):
+    """Nama model untuk EmbeddingCache: vektor backend ONNX disimpan terpisah dari PyTorch."""
+    variant = getattr(embeddings, "variant", None)
+    return f"{model_name}:{variant}" if variant else model_name
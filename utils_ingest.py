@@ -0,0 +1,848 @@
+import hashlib
+import multiprocessing
+import os
+import queue
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+from dotenv import load_dotenv
+
+from utils_retrieval import BM25Index
+
+load_dotenv(override=True)
+
+INGEST_PARSE_WORKERS = int(os.getenv("INGEST_PARSE_WORKERS", max(1, (os.cpu_count() or 2) - 1)))
+INGEST_EMBED_BATCH_SIZE = int(os.getenv("INGEST_EMBED_BATCH_SIZE", 256))
+INGEST_WRITE_BATCH_SIZE = int(os.getenv("INGEST_WRITE_BATCH_SIZE", 1024))
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", 8))
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", 1000))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", 300))
+# Parser streaming: chunk per pesan dari proses parser, ukuran blok "halaman" file .txt,
+# dan jeda minimum antar laporan progres per file (0 = setiap halaman)
+INGEST_STREAM_MESSAGE_CHUNKS = int(os.getenv("INGEST_STREAM_MESSAGE_CHUNKS", 64))
+INGEST_TEXT_BLOCK_CHARS = int(os.getenv("INGEST_TEXT_BLOCK_CHARS", 20000))
+INGEST_PROGRESS_INTERVAL_SECONDS = float(os.getenv("INGEST_PROGRESS_INTERVAL_SECONDS", 0.5))
+# pypdf menyimpan setiap objek yang sudah dibaca (termasuk isi halaman) selama reader hidup;
+# cache itu dikosongkan setiap sekian halaman agar memori parser tidak tumbuh per halaman
+INGEST_PDF_CACHE_CLEAR_PAGES = int(os.getenv("INGEST_PDF_CACHE_CLEAR_PAGES", 50))
+# Proses parser tidak di-fork: pipeline berjalan di thread dan proses induk (Streamlit, worker)
+# memegang lock, thread, dan model yang tidak aman diwariskan lewat fork. "spawn" atau "forkserver"
+INGEST_PARSE_START_METHOD = os.getenv("INGEST_PARSE_START_METHOD", "spawn")
+
+INGEST_WORKER_POLL_SECONDS = float(os.getenv("INGEST_WORKER_POLL_SECONDS", 5))
+INGEST_WORKER_BATCH_FILES = int(os.getenv("INGEST_WORKER_BATCH_FILES", 4))
+INGEST_WORKER_STALE_SECONDS = int(os.getenv("INGEST_WORKER_STALE_SECONDS", 3600))
+
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", "intfloat/multilingual-e5-large")
+CHROMA_PERSIST_DIRECTORY = os.getenv("CHROMA_PERSIST_DIR", "./chroma_db_streamlit_app")
+COLLECTION_NAME = os.getenv("CHROMA_COLLECTION_NAME", "giziai_knowledge_app")
+
+# File penanda versi basis pengetahuan. Disentuh setiap kali ingestion menambah chunk,
+# sehingga proses lain (mis. aplikasi Streamlit) tahu cache jawabannya sudah usang.
+KNOWLEDGE_BASE_VERSION_FILE = os.path.join(CHROMA_PERSIST_DIRECTORY, ".kb_version")
+BM25_INDEX_PATH = os.path.join(CHROMA_PERSIST_DIRECTORY, "bm25_index.json")
+# Chroma PersistentClient tidak mendukung beberapa proses pada direktori yang sama; proses
+# yang membuka koleksi untuk melayani atau menulis memegang kunci ini selama hidupnya
+CHROMA_PROCESS_LOCK_FILE = os.path.join(CHROMA_PERSIST_DIRECTORY, ".process.lock")
+
+_STOP = object()
+
+_chroma_process_lock = None
+_chroma_process_lock_guard = threading.Lock()
+
+
+def acquire_chroma_process_lock():
+    """
+    Mengunci direktori Chroma untuk proses ini (sekali per proses; dilepas otomatis saat
+    proses berhenti). RuntimeError jika proses lain, misalnya aplikasi Streamlit atau
+    ingest_worker.py, sedang memakai direktori yang sama.
+    """
+    global _chroma_process_lock
+    with _chroma_process_lock_guard:
+        if _chroma_process_lock is not None:
+            return
+        try:
+            import fcntl
+        except ImportError:
+            print("WARNING: fcntl tidak tersedia; pemakaian direktori Chroma oleh beberapa proses tidak dicegah.")
+            return
+        os.makedirs(CHROMA_PERSIST_DIRECTORY, exist_ok=True)
+        handle = open(CHROMA_PROCESS_LOCK_FILE, "a+", encoding="utf-8")
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.seek(0)
+            owner = handle.read().strip() or "?"
+            handle.close()
+            raise RuntimeError(
+                f"Direktori Chroma {CHROMA_PERSIST_DIRECTORY} sedang dipakai proses lain (PID {owner}). "
+                "Chroma tidak mendukung beberapa proses; hentikan proses itu terlebih dahulu."
+            )
+        handle.seek(0)
+        handle.truncate()
+        handle.write(str(os.getpid()))
+        handle.flush()
+        _chroma_process_lock = handle
+
+
+def mark_knowledge_base_changed():
+    os.makedirs(CHROMA_PERSIST_DIRECTORY, exist_ok=True)
+    with open(KNOWLEDGE_BASE_VERSION_FILE, "w", encoding="utf-8") as f:
+        f.write(str(time.time()))
+
+
+def compute_file_hash(filepath, block_size=1024 * 1024):
+    """SHA-256 isi file, dibaca per blok agar file besar tidak dimuat sekaligus."""
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def make_chunk_ids(source, texts, seen=None):
+    """
+    ID chunk deterministik dari nama sumber, hash teks chunk, dan urutan kemunculan
+    teks yang sama di dalam file. Chunk yang tidak berubah mendapatkan ID yang sama
+    pada versi file berikutnya meskipun posisinya bergeser.
+    Untuk file yang diproses per halaman, berikan dict seen yang sama di setiap panggilan.
+    """
+    seen = {} if seen is None else seen
+    chunk_ids = []
+    for text in texts:
+        text_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        ordinal = seen.get(text_hash, 0)
+        seen[text_hash] = ordinal + 1
+        chunk_ids.append(hashlib.sha256(f"{source}\x00{text_hash}\x00{ordinal}".encode("utf-8")).hexdigest())
+    return chunk_ids
+
+
+def _restore_chunk_metadatas(collection, original):
+    try:
+        collection.update(ids=original["ids"], metadatas=original["metadatas"])
+    except Exception as e:
+        print(f"Gagal memulihkan metadata {len(original['ids'])} chunk: {e}")
+
+
+def update_chunk_metadatas(collection, chunk_ids, metadatas, original=None):
+    """
+    Memperbarui metadata chunk. Jika update gagal di tengah jalan, metadata lama dipulihkan
+    sebelum exception diteruskan. Mengembalikan metadata lama (untuk dipulihkan pemanggil).
+    """
+    original = original or collection.get(ids=list(chunk_ids), include=["metadatas"])
+    try:
+        collection.update(ids=list(chunk_ids), metadatas=list(metadatas))
+    except Exception:
+        _restore_chunk_metadatas(collection, original)
+        raise
+    return original
+
+
+def relabel_file_chunks(vectorstore, old_file_ids, new_file_id):
+    """Memindahkan chunk milik versi file lama ke file_id baru tanpa embedding ulang."""
+    if not old_file_ids:
+        return 0
+    collection = vectorstore._collection
+    existing = collection.get(where={"file_id": {"$in": [str(i) for i in old_file_ids]}}, include=["metadatas"])
+    if not existing["ids"]:
+        return 0
+    metadatas = [dict(metadata, file_id=str(new_file_id)) for metadata in existing["metadatas"]]
+    update_chunk_metadatas(collection, existing["ids"], metadatas, original=existing)
+    return len(existing["ids"])
+
+
+_lexical_index = None
+_lexical_index_lock = threading.Lock()
+
+def get_lexical_index(collection):
+    """
+    Indeks BM25 bersama untuk satu proses. Dimuat dari BM25_INDEX_PATH, atau dibangun
+    dari isi koleksi Chroma jika file indeks belum ada (koleksi dari versi lama).
+    """
+    global _lexical_index
+    with _lexical_index_lock:
+        if _lexical_index is None:
+            index = BM25Index(path=BM25_INDEX_PATH)
+            if not index.load():
+                index.rebuild_from_collection(collection)
+                index.save()
+            _lexical_index = index
+    return _lexical_index
+
+
+def get_knowledge_base_version():
+    try:
+        return os.stat(KNOWLEDGE_BASE_VERSION_FILE).st_mtime_ns
+    except OSError:
+        return None
+
+
+def get_loader_for_file(filepath):
+    """Memilih loader LangChain berdasarkan ekstensi file (None jika tidak didukung)."""
+    from langchain_community.document_loaders import PyPDFLoader, Docx2txtLoader, TextLoader
+    if filepath.endswith(".pdf"):
+        return PyPDFLoader(filepath)
+    if filepath.endswith(".docx"):
+        return Docx2txtLoader(filepath)
+    if filepath.endswith(".txt"):
+        return TextLoader(filepath, encoding='utf-8')
+    return None
+
+
+def iter_text_file_pages(filepath, block_chars=INGEST_TEXT_BLOCK_CHARS):
+    """File .txt dibaca per blok sekitar block_chars karakter (dipotong di akhir baris) sebagai halaman."""
+    from langchain_core.documents import Document
+    lines, size = [], 0
+    with open(filepath, "r", encoding="utf-8") as f:
+        for line in f:
+            lines.append(line)
+            size += len(line)
+            if size >= block_chars:
+                yield Document(page_content="".join(lines), metadata={"source": filepath})
+                lines, size = [], 0
+    if lines:
+        yield Document(page_content="".join(lines), metadata={"source": filepath})
+
+
+def iter_pdf_pages(filepath, cache_clear_pages=INGEST_PDF_CACHE_CLEAR_PAGES):
+    """
+    Halaman PDF satu per satu dengan teks yang sama seperti PyPDFLoader (mode "page"), sehingga
+    chunk_id tidak berubah. Label halaman dihitung sekali (PyPDFLoader menghitung ulang per
+    halaman) dan cache objek reader dikosongkan setiap cache_clear_pages halaman.
+    """
+    import pypdf
+    from langchain_core.documents import Document
+    with open(filepath, "rb") as f:
+        reader = pypdf.PdfReader(f)
+        total_pages = len(reader.pages)
+        page_labels = reader.page_labels
+        for page_number in range(total_pages):
+            text = reader.pages[page_number].extract_text().strip()
+            yield Document(page_content=text, metadata={
+                "source": filepath, "total_pages": total_pages,
+                "page": page_number, "page_label": page_labels[page_number],
+            })
+            if cache_clear_pages > 0 and (page_number + 1) % cache_clear_pages == 0:
+                reader.resolved_objects.clear()
+
+
+def iter_file_pages(filepath):
+    """
+    Iterator halaman (Document) tanpa memuat seluruh file: PDF per halaman, .txt per blok.
+    DOCX diekstrak docx2txt sebagai satu dokumen. None jika tipe tidak didukung.
+    """
+    if filepath.endswith(".pdf"):
+        return iter_pdf_pages(filepath)
+    if filepath.endswith(".txt"):
+        return iter_text_file_pages(filepath)
+    loader = get_loader_for_file(filepath)
+    return None if loader is None else loader.lazy_load()
+
+
+def get_text_splitter():
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    return RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, length_function=len)
+
+
+# Antrean pesan parser, diwariskan ke setiap proses parser lewat initializer ProcessPoolExecutor
+_parse_output_queue = None
+
+def _init_parse_worker(output_queue):
+    global _parse_output_queue
+    _parse_output_queue = output_queue
+
+
+def stream_parse_file(filepath, file_id, message_chunks=INGEST_STREAM_MESSAGE_CHUNKS):
+    """
+    Tahap 1 (dijalankan di process pool): memuat file per halaman, memecah setiap halaman
+    begitu tersedia, dan mengirim hasilnya ke antrean parser sebagai pesan
+      ("chunks", file_id, [(chunk_id, teks, metadata), ...], halaman selesai, total halaman atau None)
+    diakhiri ("done", file_id, jumlah halaman, detik parse) atau ("error", file_id, pesan).
+    Antrean terbatas membuat parser menunggu jika tahap berikutnya tertinggal, sehingga
+    memori tidak bergantung pada jumlah halaman.
+    """
+    started = time.monotonic()
+    output = _parse_output_queue
+    source = os.path.basename(filepath)
+    pages = iter_file_pages(filepath)
+    if pages is None:
+        output.put(("error", file_id, f"Tipe file {source} tidak didukung."))
+        return
+    splitter = get_text_splitter()
+    seen = {}
+    page_count = 0
+    chunk_count = 0
+    try:
+        for page in pages:
+            page_count += 1
+            splits = splitter.split_documents([page])
+            chunk_ids = make_chunk_ids(source, [split.page_content for split in splits], seen)
+            chunks = []
+            for chunk_id, split in zip(chunk_ids, splits):
+                metadata = dict(split.metadata)
+                metadata["source"] = source
+                metadata["file_id"] = str(file_id)
+                chunks.append((chunk_id, split.page_content, metadata))
+            chunk_count += len(chunks)
+            total_pages = page.metadata.get("total_pages")
+            # Halaman tanpa teks tetap dikirim sebagai pesan kosong untuk progres per halaman
+            for start in range(0, max(len(chunks), 1), message_chunks):
+                output.put(("chunks", file_id, chunks[start:start + message_chunks], page_count, total_pages))
+    except Exception as e:
+        output.put(("error", file_id, f"Error saat memuat {source} (halaman {page_count}): {e}"))
+        return
+    if page_count == 0:
+        output.put(("error", file_id, f"Tidak ada konten yang dapat dimuat dari {source}."))
+    elif chunk_count == 0:
+        output.put(("error", file_id, f"Tidak ada teks yang dapat diekstrak (setelah split) dari {source}"))
+    else:
+        output.put(("done", file_id, page_count, time.monotonic() - started))
+
+
+def format_file_progress(progress):
+    """Teks progres untuk kolom knowledge_files.progress, misalnya 'Halaman 12/800, 40/55 chunk tertulis'."""
+    pages = f"Halaman {progress['pages']}"
+    if progress.get("total_pages"):
+        pages += f"/{progress['total_pages']}"
+    return f"{pages}, {progress['written']}/{progress['queued']} chunk tertulis"
+
+
+class IngestionStats:
+    """Throughput per tahap: halaman/detik (parse), embedding/detik (embed), chunk/detik (write)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at = time.monotonic()
+        self.finished_at = None
+        self.counts = {"files": 0, "pages": 0, "chunks_parsed": 0, "chunks_reused": 0, "chunks_deleted": 0,
+                       "embeddings": 0, "chunks_written": 0, "errors": 0}
+        self.busy_seconds = {"parse": 0.0, "embed": 0.0, "write": 0.0}
+
+    def add(self, stage, seconds, **counts):
+        with self._lock:
+            if stage:
+                self.busy_seconds[stage] += seconds
+            for name, value in counts.items():
+                self.counts[name] += value
+
+    def summary(self):
+        with self._lock:
+            elapsed = (self.finished_at or time.monotonic()) - self.started_at
+            counts = dict(self.counts)
+            busy = dict(self.busy_seconds)
+
+        def rate(value, seconds):
+            return value / seconds if seconds > 0 else 0.0
+
+        return {
+            **counts,
+            "elapsed_seconds": elapsed,
+            "pages_per_second": rate(counts["pages"], elapsed),
+            "chunks_per_second": rate(counts["chunks_written"], elapsed),
+            "embeddings_per_second": rate(counts["embeddings"], busy["embed"]),
+            "stage_busy_seconds": busy,
+        }
+
+
+class IngestionPipeline:
+    """
+    Pipeline ingestion tiga tahap yang dihubungkan dengan antrean terbatas:
+      1. parse + split per halaman di ProcessPoolExecutor (stream_parse_file),
+      2. embedding dalam batch besar (INGEST_EMBED_BATCH_SIZE),
+      3. penulisan bulk ke koleksi Chroma (INGEST_WRITE_BATCH_SIZE).
+    Chunk mengalir per halaman melalui ketiga tahap, jadi memori puncak dibatasi ukuran
+    antrean dan batch, bukan ukuran file.
+    Chunk ber-ID deterministik; chunk yang sudah ada di koleksi (untuk file_id
+    pada 'related_file_ids') tidak di-embed ulang. Chunk lama baru dipindahkan ke file_id baru
+    dan chunk usang baru dihapus setelah semua chunk baru file itu tertulis, sehingga file yang
+    gagal di tengah jalan tidak merusak versi sebelumnya (chunk baru yang sempat tertulis dihapus).
+    Callback on_file_done(file_id, success, message) dipanggil sekali per file
+    setelah semua chunk-nya tertulis (atau gagal); on_file_progress(file_id, progress) dipanggil
+    saat halaman di-parse atau chunk tertulis (paling sering sekali per INGEST_PROGRESS_INTERVAL_SECONDS),
+    dengan progress berisi 'pages', 'total_pages', 'queued', dan 'written'.
+    changed_file_ids berisi file yang chunk-nya ditulis, dihapus, atau dipindahkan dari versi lama.
+    """
+
+    def __init__(self, vectorstore, embedding_function, on_file_done=None, on_progress=None, on_file_progress=None,
+                 lexical_index=None,
+                 parse_workers=INGEST_PARSE_WORKERS, embed_batch_size=INGEST_EMBED_BATCH_SIZE,
+                 write_batch_size=INGEST_WRITE_BATCH_SIZE, queue_size=INGEST_QUEUE_SIZE):
+        self.vectorstore = vectorstore
+        self.embedding_function = embedding_function
+        self.on_file_done = on_file_done
+        self.on_progress = on_progress
+        self.on_file_progress = on_file_progress
+        self.lexical_index = lexical_index
+        self.parse_workers = parse_workers
+        self.embed_batch_size = embed_batch_size
+        self.write_batch_size = write_batch_size
+        self.queue_size = queue_size
+        self._embed_queue = queue.Queue(maxsize=queue_size)
+        self._write_queue = queue.Queue(maxsize=queue_size)
+        self._file_lock = threading.Lock()
+        # file_id -> {"pages", "total_pages", "queued", "written", "parsed", "last_report"}
+        self._file_progress = {}
+        # file_id -> ID chunk lama yang belum muncul lagi di hasil parse (dihapus setelah parse selesai)
+        self._unseen_existing_ids = {}
+        # file_id -> ID chunk milik versi file sebelumnya (dipakai ulang = dipindahkan ke file_id ini)
+        self._previous_version_ids = {}
+        # Perubahan yang ditunda sampai semua chunk baru file tertulis (lihat _commit_file):
+        # file_id -> {chunk_id: metadata baru} untuk chunk yang dipakai ulang, dan ID chunk usang
+        self._pending_relabels = {}
+        self._stale_ids = {}
+        # file_id -> ID chunk baru yang sudah tertulis (dihapus lagi jika file gagal)
+        self._written_ids = {}
+        self._failed_files = set()
+        self.changed_file_ids = set()
+        self.stats = IngestionStats()
+
+    def _finish_file(self, file_id, success, message):
+        if self.on_file_done:
+            self.on_file_done(file_id, success, message)
+
+    def _mark_file_failed(self, file_id, message):
+        with self._file_lock:
+            if file_id in self._failed_files:
+                return
+            self._failed_files.add(file_id)
+            self._file_progress.pop(file_id, None)
+            self._unseen_existing_ids.pop(file_id, None)
+            self._previous_version_ids.pop(file_id, None)
+            self._pending_relabels.pop(file_id, None)
+            self._stale_ids.pop(file_id, None)
+            written_ids = self._written_ids.pop(file_id, [])
+        self._discard_written_chunks(file_id, written_ids)
+        self.stats.add(None, 0, errors=1)
+        self._finish_file(file_id, False, message)
+
+    def _discard_written_chunks(self, file_id, chunk_ids):
+        """Menghapus chunk baru milik file yang gagal; chunk versi sebelumnya tidak tersentuh."""
+        if not chunk_ids:
+            return
+        try:
+            self.vectorstore._collection.delete(ids=list(chunk_ids))
+        except Exception as e:
+            print(f"Gagal menghapus {len(chunk_ids)} chunk dari file ID {file_id} yang gagal: {e}")
+            self.changed_file_ids.add(file_id)
+            return
+        if self.lexical_index is not None:
+            self.lexical_index.remove(chunk_ids)
+
+    def _commit_file(self, file_id, progress):
+        """
+        Semua chunk baru file sudah tertulis: pindahkan chunk yang dipakai ulang ke file_id ini,
+        hapus chunk usang, lalu laporkan file selesai. Jika salah satunya gagal, metadata
+        dipulihkan dan file ditandai gagal sehingga versi sebelumnya tetap utuh.
+        """
+        with self._file_lock:
+            relabels = self._pending_relabels.pop(file_id, {})
+            previous_ids = self._previous_version_ids.pop(file_id, set())
+            stale_ids = self._stale_ids.pop(file_id, [])
+        collection = self.vectorstore._collection
+        original = None
+        try:
+            if relabels:
+                original = update_chunk_metadatas(collection, list(relabels), list(relabels.values()))
+            if stale_ids:
+                collection.delete(ids=stale_ids)
+        except Exception as e:
+            if original is not None:
+                _restore_chunk_metadatas(collection, original)
+            self._mark_file_failed(file_id, f"Error saat memperbarui chunk lama: {e}")
+            return
+        with self._file_lock:
+            self._written_ids.pop(file_id, None)
+        if stale_ids:
+            if self.lexical_index is not None:
+                self.lexical_index.remove(stale_ids)
+            self.stats.add(None, 0, chunks_deleted=len(stale_ids))
+        if stale_ids or progress["written"] or not previous_ids.isdisjoint(relabels):
+            self.changed_file_ids.add(file_id)
+        self._report_file_progress(file_id, progress, force=True)
+        if progress["queued"] == 0:
+            self._finish_file(file_id, True, "Tidak ada chunk baru; isi vector store sudah sesuai.")
+        else:
+            self._finish_file(file_id, True, "Berhasil ditambahkan ke vector store.")
+
+    def _parse_stage(self, files):
+        """Konsumen pesan parser streaming; produsen untuk antrean embedding."""
+        try:
+            context = multiprocessing.get_context(INGEST_PARSE_START_METHOD)
+            parse_queue = context.Queue(maxsize=self.queue_size)
+            with ProcessPoolExecutor(max_workers=self.parse_workers, mp_context=context,
+                                     initializer=_init_parse_worker, initargs=(parse_queue,)) as executor:
+                futures = {executor.submit(stream_parse_file, f["filepath"], f["id"]): f for f in files}
+                active = {f["id"]: f for f in files}
+                while active:
+                    try:
+                        message = parse_queue.get(timeout=0.5)
+                    except queue.Empty:
+                        # stream_parse_file selalu mengirim pesan terakhir; exception di sini berarti
+                        # proses parser mati (misalnya kehabisan memori) sebelum sempat mengirimnya
+                        for future, file_entry in futures.items():
+                            if file_entry["id"] in active and future.done() and future.exception() is not None:
+                                del active[file_entry["id"]]
+                                self._mark_file_failed(
+                                    file_entry["id"], f"Error saat memproses {file_entry['filepath']}: {future.exception()}"
+                                )
+                        continue
+                    kind, file_id = message[0], message[1]
+                    if file_id not in active:
+                        continue
+                    if kind == "chunks":
+                        try:
+                            self._handle_parsed_chunks(active[file_id], *message[2:])
+                        except Exception as e:
+                            del active[file_id]
+                            self._mark_file_failed(file_id, f"Error saat membandingkan chunk lama: {e}")
+                    elif kind == "done":
+                        del active[file_id]
+                        self.stats.add("parse", message[3], files=1, pages=message[2])
+                        self._finish_parsed_file(file_id)
+                    else:
+                        del active[file_id]
+                        self._mark_file_failed(file_id, message[2])
+        finally:
+            self._embed_queue.put(_STOP)
+
+    def _handle_parsed_chunks(self, file_entry, chunks, pages, total_pages):
+        """
+        Menerima chunk dari satu halaman: chunk yang sudah tersimpan untuk file ini (dan versi
+        sebelumnya) dicatat untuk diperbarui metadatanya di _commit_file, chunk baru diteruskan
+        ke tahap embedding.
+        """
+        file_id = file_entry["id"]
+        if file_id in self._failed_files:
+            return
+        collection = self.vectorstore._collection
+        if file_id not in self._unseen_existing_ids:
+            related_file_ids = file_entry.get("related_file_ids", [file_id])
+            existing = collection.get(where={"file_id": {"$in": [str(i) for i in related_file_ids]}}, include=[])
+            self._unseen_existing_ids[file_id] = set(existing["ids"])
+            previous_file_ids = [str(i) for i in related_file_ids if i != file_id]
+            self._previous_version_ids[file_id] = set(
+                collection.get(where={"file_id": {"$in": previous_file_ids}}, include=[])["ids"]
+            ) if previous_file_ids else set()
+            with self._file_lock:
+                self._file_progress[file_id] = {"pages": 0, "total_pages": None, "queued": 0, "written": 0,
+                                                "parsed": False, "last_report": 0.0}
+        unseen = self._unseen_existing_ids[file_id]
+        reused = [(chunk_id, metadata) for chunk_id, _, metadata in chunks if chunk_id in unseen]
+        new_chunks = [chunk for chunk in chunks if chunk[0] not in unseen]
+        if reused:
+            self._pending_relabels.setdefault(file_id, {}).update(reused)
+            unseen.difference_update(chunk_id for chunk_id, _ in reused)
+        self.stats.add(None, 0, chunks_parsed=len(chunks), chunks_reused=len(reused))
+        with self._file_lock:
+            progress = self._file_progress.get(file_id)
+            if progress is None:
+                return
+            progress["pages"] = pages
+            progress["total_pages"] = total_pages
+            progress["queued"] += len(new_chunks)
+        for start in range(0, len(new_chunks), self.embed_batch_size):
+            batch = new_chunks[start:start + self.embed_batch_size]
+            self._embed_queue.put([(file_id, chunk_id, text, metadata) for chunk_id, text, metadata in batch])
+        self._report_file_progress(file_id)
+
+    def _finish_parsed_file(self, file_id):
+        """Semua halaman sudah di-parse: catat chunk usang, lalu commit file jika tidak ada chunk yang tertunda."""
+        with self._file_lock:
+            progress = self._file_progress.get(file_id)
+            if progress is None:
+                return
+            self._stale_ids[file_id] = list(self._unseen_existing_ids.pop(file_id, ()))
+            progress["parsed"] = True
+            done = progress["written"] == progress["queued"]
+            if done:
+                del self._file_progress[file_id]
+        if done:
+            self._commit_file(file_id, progress)
+
+    def _report_file_progress(self, file_id, progress=None, force=False):
+        if not self.on_file_progress:
+            return
+        with self._file_lock:
+            progress = progress or self._file_progress.get(file_id)
+            if progress is None:
+                return
+            now = time.monotonic()
+            if not force and now - progress["last_report"] < INGEST_PROGRESS_INTERVAL_SECONDS:
+                return
+            progress["last_report"] = now
+            snapshot = {key: progress[key] for key in ("pages", "total_pages", "queued", "written")}
+        self.on_file_progress(file_id, snapshot)
+
+    def _embed_stage(self):
+        buffer = []
+        while True:
+            item = self._embed_queue.get()
+            if item is not _STOP:
+                buffer.extend(item)
+            while len(buffer) >= self.embed_batch_size or (item is _STOP and buffer):
+                batch, buffer = buffer[:self.embed_batch_size], buffer[self.embed_batch_size:]
+                self._embed_batch(batch)
+            if item is _STOP:
+                self._write_queue.put(_STOP)
+                return
+
+    def _embed_batch(self, batch):
+        started = time.monotonic()
+        try:
+            embeddings = self.embedding_function.embed_documents([text for _, _, text, _ in batch])
+        except Exception as e:
+            for file_id in {row[0] for row in batch}:
+                self._mark_file_failed(file_id, f"Error saat membuat embedding: {e}")
+            return
+        self.stats.add("embed", time.monotonic() - started, embeddings=len(batch))
+        self._write_queue.put([
+            (file_id, chunk_id, text, metadata, embedding)
+            for (file_id, chunk_id, text, metadata), embedding in zip(batch, embeddings)
+        ])
+
+    def _write_stage(self):
+        buffer = []
+        while True:
+            item = self._write_queue.get()
+            if item is not _STOP:
+                buffer.extend(item)
+            while len(buffer) >= self.write_batch_size or (item is _STOP and buffer):
+                batch, buffer = buffer[:self.write_batch_size], buffer[self.write_batch_size:]
+                self._write_batch(batch)
+            if item is _STOP:
+                return
+
+    def _write_batch(self, batch):
+        with self._file_lock:
+            batch = [row for row in batch if row[0] not in self._failed_files]
+        if not batch:
+            return
+        started = time.monotonic()
+        try:
+            # Embedding sudah dihitung di tahap 2, jadi tulis langsung ke koleksi Chroma
+            self.vectorstore._collection.upsert(
+                ids=[chunk_id for _, chunk_id, _, _, _ in batch],
+                documents=[text for _, _, text, _, _ in batch],
+                metadatas=[metadata for _, _, _, metadata, _ in batch],
+                embeddings=[list(embedding) for _, _, _, _, embedding in batch],
+            )
+        except Exception as e:
+            for file_id in {row[0] for row in batch}:
+                self._mark_file_failed(file_id, f"Error saat menulis ke vector store: {e}")
+            return
+        if self.lexical_index is not None:
+            self.lexical_index.add([row[1] for row in batch], [row[2] for row in batch])
+        self.stats.add("write", time.monotonic() - started, chunks_written=len(batch))
+
+        completed = []
+        progressed = set()
+        orphaned = {}
+        with self._file_lock:
+            for file_id, chunk_id, _, _, _ in batch:
+                progress = self._file_progress.get(file_id)
+                if progress is None:
+                    # File gagal saat batch ini sedang ditulis
+                    orphaned.setdefault(file_id, []).append(chunk_id)
+                    continue
+                self._written_ids.setdefault(file_id, []).append(chunk_id)
+                progress["written"] += 1
+                progressed.add(file_id)
+                if progress["parsed"] and progress["written"] == progress["queued"]:
+                    del self._file_progress[file_id]
+                    completed.append((file_id, progress))
+        for file_id, chunk_ids in orphaned.items():
+            self._discard_written_chunks(file_id, chunk_ids)
+        for file_id in progressed - {file_id for file_id, _ in completed}:
+            self._report_file_progress(file_id)
+        for file_id, progress in completed:
+            self._commit_file(file_id, progress)
+        if self.on_progress:
+            self.on_progress(self.stats.summary())
+
+    def run(self, files):
+        """
+        Memproses daftar file (dict dengan kunci 'id', 'filepath', dan opsional
+        'related_file_ids') dan mengembalikan ringkasan throughput per tahap.
+        """
+        if not files:
+            return self.stats.summary()
+        embed_thread = threading.Thread(target=self._embed_stage, name="ingest-embed", daemon=True)
+        write_thread = threading.Thread(target=self._write_stage, name="ingest-write", daemon=True)
+        embed_thread.start()
+        write_thread.start()
+        try:
+            self._parse_stage(files)
+        finally:
+            embed_thread.join()
+            write_thread.join()
+            self.stats.finished_at = time.monotonic()
+        summary = self.stats.summary()
+        print(f"Ingestion selesai: {summary}")
+        return summary
+
+
+def load_ingestion_components():
+    """
+    Memuat embedding function dan vector store tanpa Streamlit maupun LLM,
+    untuk dipakai oleh worker ingestion di proses terpisah.
+    """
+    from langchain_chroma import Chroma
+    acquire_chroma_process_lock()
+    print(f"Memuat model embedding: {EMBEDDING_MODEL_NAME}")
+    from utils_cache import wrap_with_embedding_cache
+    from utils_embeddings import create_embeddings, embedding_cache_name
+    base_embeddings = create_embeddings(EMBEDDING_MODEL_NAME)
+    embedding_function = wrap_with_embedding_cache(
+        base_embeddings, embedding_cache_name(base_embeddings, EMBEDDING_MODEL_NAME)
+    )
+    vectorstore = Chroma(
+        collection_name=COLLECTION_NAME,
+        persist_directory=CHROMA_PERSIST_DIRECTORY,
+        embedding_function=embedding_function
+    )
+    return vectorstore, embedding_function
+
+
+def ingest_files(vectorstore, embedding_function, files, on_file_done=None, on_file_progress=None):
+    """
+    Ingestion inkremental untuk daftar file (dict 'id', 'filepath').
+    Setiap file di-hash; jika versi aktif sebelumnya (filepath sama) memiliki hash yang
+    sama, chunk lamanya dipakai ulang tanpa parse/embedding. Jika berbeda, hanya chunk
+    yang berubah yang di-embed dan chunk usang dihapus. Versi lama ditandai 'inactive'.
+    Mengembalikan (ringkasan throughput, daftar file_id yang mengubah isi vector store:
+    chunk ditulis, dihapus, atau dipindahkan dari versi lama). File yang berhasil tetapi
+    chunk-nya tidak berubah sama sekali tidak termasuk, jadi pemanggil tidak perlu
+    mengosongkan cache jawaban. Jika ada yang berubah, versi basis pengetahuan ditandai
+    di sini sebelum indeks ringkas dibangun ulang, sehingga snapshot memuat versi terbaru.
+    """
+    import utils_db
+    changed = []
+    previous_versions = {}
+
+    def finish(file_id, success, message):
+        if success:
+            for previous_id in previous_versions.get(file_id, []):
+                utils_db.update_file_status(previous_id, 'inactive')
+        if on_file_done:
+            on_file_done(file_id, success, message)
+
+    files_for_pipeline = []
+    for file_entry in files:
+        file_id = file_entry['id']
+        try:
+            content_hash = compute_file_hash(file_entry['filepath'])
+        except OSError as e:
+            finish(file_id, False, f"Gagal membaca file: {e}")
+            continue
+        utils_db.update_file_content_hash(file_id, content_hash)
+        previous = utils_db.get_previous_file_versions(file_entry['filepath'], file_id)
+        previous_versions[file_id] = [row['id'] for row in previous]
+        if any(row['content_hash'] == content_hash for row in previous):
+            try:
+                relabeled = relabel_file_chunks(vectorstore, previous_versions[file_id], file_id)
+            except Exception as e:
+                # Metadata sudah dipulihkan; versi sebelumnya tetap aktif
+                finish(file_id, False, f"Error saat memindahkan chunk versi sebelumnya: {e}")
+                continue
+            if relabeled:
+                changed.append(file_id)
+            finish(file_id, True, f"Isi file tidak berubah; {relabeled} chunk yang ada dipakai ulang.")
+            continue
+        files_for_pipeline.append({
+            "id": file_id,
+            "filepath": file_entry['filepath'],
+            "related_file_ids": previous_versions[file_id] + [file_id],
+        })
+
+    lexical_index = get_lexical_index(vectorstore._collection)
+    pipeline = IngestionPipeline(vectorstore, embedding_function, on_file_done=finish,
+                                 on_file_progress=on_file_progress, lexical_index=lexical_index)
+    summary = pipeline.run(files_for_pipeline)
+    if files_for_pipeline:
+        lexical_index.save()
+    changed.extend(f["id"] for f in files_for_pipeline if f["id"] in pipeline.changed_file_ids)
+    if changed:
+        mark_knowledge_base_changed()
+        # Backend pencarian "compact" membaca snapshot, jadi dibangun ulang dari koleksi yang sudah berubah
+        from utils_vector_index import refresh_compact_index
+        refresh_compact_index(vectorstore._collection)
+    return summary, changed
+
+
+class IngestionWorker:
+    """
+    Worker latar belakang yang mengklaim baris knowledge_files berstatus
+    'pending'/'processing' (dengan row locking di DB) lalu memprosesnya dengan
+    IngestionPipeline. Dijalankan sebagai thread di proses aplikasi (start_thread), atau
+    sebagai proses sendiri (ingest_worker.py) hanya saat aplikasi tidak berjalan.
+    """
+
+    def __init__(self, vectorstore, embedding_function, worker_id=None,
+                 poll_interval=INGEST_WORKER_POLL_SECONDS, batch_files=INGEST_WORKER_BATCH_FILES,
+                 on_knowledge_base_changed=None):
+        self.vectorstore = vectorstore
+        self.embedding_function = embedding_function
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.poll_interval = poll_interval
+        self.batch_files = batch_files
+        self.on_knowledge_base_changed = on_knowledge_base_changed
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def run_once(self):
+        """Mengklaim dan memproses satu batch file. Mengembalikan jumlah file yang diklaim."""
+        import utils_db
+        claimed = utils_db.claim_files_for_ingestion(
+            self.worker_id, limit=self.batch_files, stale_after_seconds=INGEST_WORKER_STALE_SECONDS
+        )
+        files_to_process = []
+        for file_entry in claimed:
+            if os.path.exists(file_entry['filepath']):
+                files_to_process.append(file_entry)
+            else:
+                print(f"File {file_entry['filepath']} (ID: {file_entry['id']}) tidak ditemukan.")
+                utils_db.update_file_progress(file_entry['id'], "File tidak ditemukan di sistem file")
+                utils_db.update_file_status(file_entry['id'], 'error')
+        if not files_to_process:
+            return len(claimed)
+
+        def on_file_done(file_id, success, message):
+            print(f"Ingestion file ID {file_id}: {'berhasil' if success else 'gagal'} - {message}")
+            utils_db.update_file_progress(file_id, message)
+            utils_db.update_file_status(file_id, 'active' if success else 'error')
+
+        def on_file_progress(file_id, progress):
+            utils_db.update_file_progress(file_id, format_file_progress(progress))
+
+        _, changed = ingest_files(
+            self.vectorstore, self.embedding_function, files_to_process,
+            on_file_done=on_file_done, on_file_progress=on_file_progress
+        )
+        if changed and self.on_knowledge_base_changed:
+            self.on_knowledge_base_changed()
+        return len(claimed)
+
+    def run_forever(self):
+        print(f"Worker ingestion {self.worker_id} berjalan (interval polling {self.poll_interval} detik).")
+        while not self._stop_event.is_set():
+            try:
+                claimed_count = self.run_once()
+            except Exception as e:
+                print(f"Error di worker ingestion {self.worker_id}: {e}")
+                claimed_count = 0
+            if claimed_count == 0:
+                self._stop_event.wait(self.poll_interval)
+        print(f"Worker ingestion {self.worker_id} berhenti.")
+
+    def start_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self.run_forever, name="ingest-worker", daemon=True)
+            self._thread.start()
+        return self._thread
+
+    def stop(self):
+        self._stop_event.set()
@@ -0,0 +1,384 @@
+import inspect
+import os
+import queue
+import threading
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+# Cache state llama.cpp untuk prefix prompt (teks sistem statis dan riwayat percakapan).
+# Opt-in: tiap state berukuran sebesar KV cache konteks, sehingga cache RAM bisa memakan memori besar
+LLM_PROMPT_CACHE_ENABLED = os.getenv("LLM_PROMPT_CACHE_ENABLED", "false").lower() == "true"
+LLM_PROMPT_CACHE_TYPE = os.getenv("LLM_PROMPT_CACHE_TYPE", "ram").lower()  # "ram" atau "disk"
+# Anggaran total per model; dibagi rata ke semua replika
+LLM_PROMPT_CACHE_BYTES = int(os.getenv("LLM_PROMPT_CACHE_BYTES", 2 << 30))
+# Cache RAM dibatasi lagi ke fraksi memori yang tersedia saat model dimuat
+LLM_PROMPT_CACHE_MAX_MEMORY_FRACTION = float(os.getenv("LLM_PROMPT_CACHE_MAX_MEMORY_FRACTION", 0.25))
+LLM_PROMPT_CACHE_DIR = os.getenv("LLM_PROMPT_CACHE_DIR", ".llama_prompt_cache")
+# Perkiraan biaya evaluasi prompt per token jika counter performa llama.cpp tidak tersedia
+LLM_PROMPT_EVAL_SECONDS_PER_TOKEN = float(os.getenv("LLM_PROMPT_EVAL_SECONDS_PER_TOKEN", 0.01))
+
+# Penjadwal inferensi untuk instance LlamaCpp bersama
+LLM_REPLICAS = int(os.getenv("LLM_REPLICAS", 1))
+LLM_QUEUE_MAX_SIZE = int(os.getenv("LLM_QUEUE_MAX_SIZE", 8))
+# Batas waktu antre + token pertama (stream) atau seluruh permintaan (run); setelah token
+# pertama, stream hanya dibatasi jeda antar token agar jawaban panjang di CPU tidak terpotong
+LLM_REQUEST_TIMEOUT_SECONDS = float(os.getenv("LLM_REQUEST_TIMEOUT_SECONDS", 180))
+LLM_TOKEN_TIMEOUT_SECONDS = float(os.getenv("LLM_TOKEN_TIMEOUT_SECONDS", 30))
+
+
+class PromptCacheStats:
+    """Jumlah token prompt yang dievaluasi vs dipakai ulang dari KV cache."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.prompt_tokens = 0
+        self.reused_tokens = 0
+
+    def record(self, prompt_tokens, reused_tokens):
+        with self._lock:
+            self.lookups += 1
+            self.prompt_tokens += prompt_tokens
+            self.reused_tokens += reused_tokens
+
+    def summary(self, seconds_per_token=None):
+        seconds_per_token = seconds_per_token or LLM_PROMPT_EVAL_SECONDS_PER_TOKEN
+        with self._lock:
+            return {
+                "lookups": self.lookups,
+                "prompt_tokens": self.prompt_tokens,
+                "reused_tokens": self.reused_tokens,
+                "reuse_ratio": self.reused_tokens / self.prompt_tokens if self.prompt_tokens else 0.0,
+                "prompt_eval_seconds_per_token": seconds_per_token,
+                "estimated_prompt_eval_seconds_saved": self.reused_tokens * seconds_per_token,
+            }
+
+
+def _read_prompt_eval_seconds_per_token(llama):
+    """Membaca waktu evaluasi prompt per token dari counter performa llama.cpp (None jika tidak tersedia)."""
+    try:
+        import llama_cpp
+        perf = llama_cpp.llama_perf_context(llama._ctx.ctx)
+        if perf.n_p_eval > 0:
+            return perf.t_p_eval_ms / 1000.0 / perf.n_p_eval
+    except Exception:
+        pass
+    return None
+
+
+def _make_tracking_cache(llama, stats, cache_type, capacity_bytes, cache_dir):
+    from llama_cpp import Llama, LlamaRAMCache, LlamaDiskCache
+
+    base_class = LlamaDiskCache if cache_type == "disk" else LlamaRAMCache
+
+    class TrackingPromptCache(base_class):
+        """
+        Cache state llama.cpp yang mencatat berapa token prefix prompt dihemat oleh cache ini.
+        llama.cpp hanya memuat state jika prefixnya lebih panjang daripada KV prompt terakhir
+        yang masih ada di konteks; yang dihitung hanya selisih itu, bukan pemakaian ulang
+        KV konteks yang terjadi juga tanpa cache.
+        """
+
+        def __getitem__(self, key):
+            eval_prefix = Llama.longest_token_prefix(llama._input_ids.tolist(), key)
+            try:
+                value = super().__getitem__(key)
+            except KeyError:
+                stats.record(len(key), 0)
+                raise
+            cache_prefix = Llama.longest_token_prefix(value.input_ids.tolist(), key)
+            stats.record(len(key), max(0, cache_prefix - eval_prefix))
+            return value
+
+    if cache_type == "disk":
+        return TrackingPromptCache(cache_dir=cache_dir, capacity_bytes=capacity_bytes)
+    return TrackingPromptCache(capacity_bytes=capacity_bytes)
+
+
+def _available_memory_bytes():
+    """Memori fisik yang tersedia (None jika tidak bisa dibaca di platform ini)."""
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def _prompt_cache_capacity_bytes(cache_type, replicas):
+    """Kapasitas cache per replika: LLM_PROMPT_CACHE_BYTES dibagi replika, RAM dibatasi memori tersedia."""
+    capacity = LLM_PROMPT_CACHE_BYTES // max(1, replicas)
+    if cache_type != "disk":
+        available = _available_memory_bytes()
+        if available is not None:
+            capacity = min(capacity, int(available * LLM_PROMPT_CACHE_MAX_MEMORY_FRACTION) // max(1, replicas))
+    return capacity
+
+
+def enable_prompt_cache(langchain_llm, name="llm", stats=None, replicas=1):
+    """
+    Memasang cache state prefix prompt pada instance LlamaCpp (langchain_llm.client).
+    Prompt yang diawali teks sistem yang sama, atau riwayat percakapan yang sama dalam
+    satu sesi, hanya perlu mengevaluasi token baru. replicas adalah jumlah instance yang
+    berbagi anggaran LLM_PROMPT_CACHE_BYTES. Mengembalikan PromptCacheStats atau None.
+    """
+    if not LLM_PROMPT_CACHE_ENABLED or langchain_llm is None:
+        return None
+    llama = getattr(langchain_llm, "client", None)
+    if llama is None:
+        return None
+    stats = stats or PromptCacheStats()
+    cache_dir = os.path.join(LLM_PROMPT_CACHE_DIR, name)
+    capacity_bytes = _prompt_cache_capacity_bytes(LLM_PROMPT_CACHE_TYPE, replicas)
+    llama.set_cache(_make_tracking_cache(llama, stats, LLM_PROMPT_CACHE_TYPE, capacity_bytes, cache_dir))
+    print(f"Prompt cache ({LLM_PROMPT_CACHE_TYPE}, {capacity_bytes} bytes) aktif untuk {name}.")
+    return stats
+
+
+def get_prompt_cache_summary(langchain_llm, stats):
+    if stats is None:
+        return None
+    llama = getattr(langchain_llm, "client", None)
+    seconds_per_token = _read_prompt_eval_seconds_per_token(llama) if llama is not None else None
+    return stats.summary(seconds_per_token)
+
+
+class ServerBusyError(Exception):
+    """Antrean inferensi penuh; permintaan ditolak tanpa menunggu."""
+
+
+class InferenceTimeoutError(Exception):
+    """Permintaan tidak selesai (termasuk waktu antre) dalam batas waktu, atau stream berhenti mengirim token."""
+
+
+_STREAM_END = object()
+_SHUTDOWN = object()
+
+
+class _InferenceRequest:
+    def __init__(self, fn, streaming, deadline):
+        self.fn = fn
+        self.streaming = streaming
+        self.deadline = deadline
+        self.enqueued_at = time.monotonic()
+        self.cancelled = threading.Event()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.chunks = queue.Queue() if streaming else None
+
+
+class InferenceScheduler:
+    """
+    Penjadwal permintaan untuk model yang dipakai bersama oleh semua sesi Streamlit.
+    Setiap replika model dilayani oleh satu thread worker (llama.cpp tidak aman dipakai
+    bersamaan pada konteks yang sama), permintaan masuk ke antrean FIFO terbatas,
+    antrean penuh langsung menghasilkan ServerBusyError, dan setiap permintaan
+    memiliki batas waktu: request_timeout untuk antre sampai selesai (run) atau sampai
+    token pertama (stream), lalu token_timeout untuk jeda antar token. Permintaan yang
+    melewati batas waktu dibatalkan; worker berhenti pada token berikutnya dan replika dilepas.
+    Metrik: kedalaman antrean, waktu tunggu, waktu eksekusi.
+    """
+
+    def __init__(self, replicas, max_queue_size=LLM_QUEUE_MAX_SIZE, request_timeout=LLM_REQUEST_TIMEOUT_SECONDS,
+                 name="llm", token_timeout=LLM_TOKEN_TIMEOUT_SECONDS):
+        if not replicas:
+            raise ValueError("InferenceScheduler membutuhkan minimal satu replika model.")
+        self.replicas = list(replicas)
+        self.request_timeout = request_timeout
+        self.token_timeout = token_timeout
+        self.name = name
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "submitted": 0, "completed": 0, "failed": 0, "rejected_busy": 0, "timeouts": 0,
+            "wait_time_total": 0.0, "wait_time_max": 0.0, "exec_time_total": 0.0,
+        }
+        self._busy_workers = 0
+        self._closed = False
+        self._workers = []
+        for index, replica in enumerate(self.replicas):
+            worker = threading.Thread(target=self._worker_loop, args=(replica,),
+                                      name=f"{name}-inference-{index}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def _worker_loop(self, replica):
+        while True:
+            request = self._queue.get()
+            if request is _SHUTDOWN:
+                return
+            started = time.monotonic()
+            wait_time = started - request.enqueued_at
+            if request.cancelled.is_set() or started > request.deadline:
+                # Pemanggil sudah menyerah (timeout) saat permintaan masih di antrean
+                self._finish_cancelled(request)
+                continue
+            with self._stats_lock:
+                self._busy_workers += 1
+                self._stats["wait_time_total"] += wait_time
+                self._stats["wait_time_max"] = max(self._stats["wait_time_max"], wait_time)
+            try:
+                if request.streaming:
+                    chunks = request.fn(replica)
+                    try:
+                        for chunk in chunks:
+                            # Pemanggil berhenti membaca (rerun, Stop, tab ditutup): replika langsung dilepas
+                            if request.cancelled.is_set():
+                                break
+                            request.chunks.put(chunk)
+                    finally:
+                        if hasattr(chunks, "close"):
+                            chunks.close()
+                else:
+                    request.result = self._collect(request, request.fn(replica))
+                outcome = "completed"
+            except Exception as e:
+                request.error = e
+                outcome = "failed"
+            finally:
+                if request.streaming:
+                    request.chunks.put(_STREAM_END)
+                request.done.set()
+                with self._stats_lock:
+                    self._busy_workers -= 1
+                    self._stats[outcome] += 1
+                    self._stats["exec_time_total"] += time.monotonic() - started
+
+    @staticmethod
+    def _collect(request, result):
+        """
+        Hasil run: fn boleh mengembalikan generator chunk teks (mis. chain.stream) agar
+        permintaan yang sudah timeout berhenti pada token berikutnya; chunk digabung.
+        """
+        if not inspect.isgenerator(result):
+            return result
+        parts = []
+        try:
+            for part in result:
+                if request.cancelled.is_set():
+                    break
+                parts.append(part)
+        finally:
+            result.close()
+        return "".join(parts)
+
+    @staticmethod
+    def _finish_cancelled(request, error=None):
+        request.cancelled.set()
+        request.error = error
+        if request.streaming:
+            request.chunks.put(_STREAM_END)
+        request.done.set()
+
+    def _enqueue(self, fn, streaming, timeout):
+        if self._closed:
+            raise ServerBusyError(f"Penjadwal inferensi {self.name} sudah dihentikan.")
+        timeout = self.request_timeout if timeout is None else timeout
+        request = _InferenceRequest(fn, streaming, time.monotonic() + timeout)
+        try:
+            self._queue.put_nowait(request)
+        except queue.Full:
+            with self._stats_lock:
+                self._stats["rejected_busy"] += 1
+            raise ServerBusyError(f"Antrean inferensi {self.name} penuh ({self._queue.maxsize} permintaan).")
+        with self._stats_lock:
+            self._stats["submitted"] += 1
+        return request
+
+    def _timeout(self, request):
+        request.cancelled.set()
+        with self._stats_lock:
+            self._stats["timeouts"] += 1
+        return InferenceTimeoutError(f"Permintaan inferensi {self.name} melebihi batas waktu.")
+
+    def run(self, fn, timeout=None):
+        """
+        Menjalankan fn(replika) di worker dan mengembalikan hasilnya. Jika fn mengembalikan
+        generator chunk teks, hasilnya digabung dan generasi berhenti begitu batas waktu lewat.
+        """
+        request = self._enqueue(fn, streaming=False, timeout=timeout)
+        if not request.done.wait(max(0.0, request.deadline - time.monotonic())):
+            raise self._timeout(request)
+        if request.error is not None:
+            raise request.error
+        if request.cancelled.is_set():
+            raise self._timeout(request)
+        return request.result
+
+    def stream(self, fn, timeout=None, token_timeout=None):
+        """
+        Menjalankan fn(replika) yang menghasilkan iterator di worker dan meneruskan chunk-nya.
+        timeout membatasi waktu antre sampai token pertama, token_timeout jeda antar token.
+        """
+        request = self._enqueue(fn, streaming=True, timeout=timeout)
+        token_timeout = self.token_timeout if token_timeout is None else token_timeout
+        first_chunk = True
+        finished = False
+        try:
+            while True:
+                remaining = request.deadline - time.monotonic() if first_chunk else token_timeout
+                try:
+                    chunk = request.chunks.get(timeout=max(0.0, remaining))
+                except queue.Empty:
+                    raise self._timeout(request)
+                if chunk is _STREAM_END:
+                    if request.error is not None:
+                        raise request.error
+                    if request.cancelled.is_set():
+                        raise self._timeout(request)
+                    break
+                first_chunk = False
+                yield chunk
+            finished = True
+        finally:
+            if not finished:
+                # GeneratorExit atau error di sisi pemanggil: worker berhenti pada token berikutnya
+                request.cancelled.set()
+        if request.error is not None:
+            raise request.error
+
+    def _cancel_queued_requests(self):
+        """Mengosongkan antrean; permintaan di dalamnya gagal dengan ServerBusyError. Mengembalikan jumlah _SHUTDOWN yang ikut terambil."""
+        shutdowns = 0
+        while True:
+            try:
+                request = self._queue.get_nowait()
+            except queue.Empty:
+                return shutdowns
+            if request is _SHUTDOWN:
+                shutdowns += 1
+                continue
+            self._finish_cancelled(request, ServerBusyError(f"Penjadwal inferensi {self.name} sudah dihentikan."))
+
+    def close(self):
+        """
+        Menghentikan thread worker setelah permintaan yang sedang berjalan selesai, sehingga
+        referensi ke replika model dilepas dan memorinya bisa dibebaskan. Permintaan yang
+        masih antre dibatalkan. Tidak pernah memblokir pada antrean yang penuh.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        pending = len(self._workers) - self._cancel_queued_requests()
+        while pending > 0:
+            try:
+                self._queue.put_nowait(_SHUTDOWN)
+                pending -= 1
+            except queue.Full:
+                # Permintaan yang masuk tepat sebelum _closed, atau replika lebih banyak dari kapasitas antrean
+                pending += self._cancel_queued_requests()
+                time.sleep(0.01)
+
+    def get_stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+            stats["busy_workers"] = self._busy_workers
+        started = stats["completed"] + stats["failed"]
+        stats["queue_depth"] = self._queue.qsize()
+        stats["queue_capacity"] = self._queue.maxsize
+        stats["replicas"] = len(self.replicas)
+        stats["wait_time_avg"] = stats["wait_time_total"] / started if started else 0.0
+        stats["exec_time_avg"] = stats["exec_time_total"] / started if started else 0.0
+        return stats
@@ -1,43 +1,107 @@
+import atexit
+import gc
 import os
 import re
-import streamlit as st
-from dotenv import load_dotenv
+import sys
+import threading
+import time
+from contextlib import contextmanager
 
-from langchain_community.llms import LlamaCpp
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.output_parsers import StrOutputParser
-from langchain_community.document_loaders import PyPDFLoader, Docx2txtLoader, TextLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.embeddings.sentence_transformer import SentenceTransformerEmbeddings
-from langchain_chroma import Chroma
-from langchain.schema.runnable import RunnablePassthrough, RunnableLambda
-from langchain_core.messages import HumanMessage, AIMessage
-from huggingface_hub import login, hf_hub_download
+from dotenv import load_dotenv
 
 import utils_db
+from utils_cache import CountingEmbeddings, SemanticAnswerCache, wrap_with_embedding_cache
+from utils_embeddings import create_embeddings, embedding_cache_name
+from utils_ingest import (
+    ingest_files, IngestionWorker, get_knowledge_base_version, get_lexical_index,
+    format_file_progress, acquire_chroma_process_lock
+)
+from utils_retrieval import (
+    get_documents_by_ids, reciprocal_rank_fusion, pack_context, load_retriever_config, search_vectorstore,
+    mmr_embedding_cache
+)
+from utils_tracing import (
+    log_debug, trace_span, record_span, start_turn_trace, finish_turn_trace, start_metrics_server,
+    register_json_endpoint
+)
+from utils_startup import StartupTracker, StageSkipped
+from utils_vector_index import is_compact_backend_enabled
+from utils_llm import (
+    enable_prompt_cache, get_prompt_cache_summary, PromptCacheStats,
+    InferenceScheduler, ServerBusyError, LLM_REPLICAS
+)
 
 load_dotenv(override=True)
 
-llm = None
-embedding_function = None
-vectorstore = None
-retriever = None
-contextualize_q_chain = None
-answer_generation_chain = None
-
 MAX_HISTORY_MESSAGES_FOR_CONTEXTUALIZATION = int(os.getenv("MAX_HISTORY_MESSAGES_FOR_CONTEXTUALIZATION", 4))
 MAX_STANDALONE_QUESTION_WORDS = int(os.getenv("MAX_STANDALONE_QUESTION_WORDS", 30))
+# Jalur cepat kontekstualisasi: pertanyaan yang sudah mandiri tidak ditulis ulang oleh LLM
+CONTEXTUALIZE_FAST_PATH_ENABLED = os.getenv("CONTEXTUALIZE_FAST_PATH_ENABLED", "true").lower() == "true"
+CONTEXTUALIZE_MIN_SELF_CONTAINED_WORDS = int(os.getenv("CONTEXTUALIZE_MIN_SELF_CONTAINED_WORDS", 4))
+# Model kecil terpisah (GGUF) untuk menulis ulang pertanyaan; kosong = pakai LLM utama
+CONTEXTUALIZE_LLM_MODEL_PATH = os.getenv("CONTEXTUALIZE_LLM_MODEL_PATH")
+CONTEXTUALIZE_MAX_TOKENS = int(os.getenv("CONTEXTUALIZE_MAX_TOKENS", 64))
+CONTEXTUALIZE_N_CTX = int(os.getenv("CONTEXTUALIZE_N_CTX", 2048))
 MIN_VALID_ANSWER_LENGTH = int(os.getenv("MIN_VALID_ANSWER_LENGTH", 15))
 MIN_CONTEXT_LENGTH_FOR_ANSWER = int(os.getenv("MIN_CONTEXT_LENGTH_FOR_ANSWER", 50))
-MIN_KEYWORD_OVERLAP_FOR_RELEVANCE = int(os.getenv("MIN_KEYWORD_OVERLAP_FOR_RELEVANCE", 1))
+# Retrieval hybrid (BM25 + vektor). Dengan RRF_K=60, chunk yang hanya muncul di satu
+# daftar memiliki skor <= 1/61 (~0.0164), sedangkan chunk di kedua daftar (peringkat <= 20)
+# >= 2/80 = 0.025. Pencarian vektor selalu mengembalikan tetangga terdekat, juga untuk
+# pertanyaan di luar topik, jadi ambang default menuntut dukungan dari kedua ranker.
+HYBRID_BM25_K = int(os.getenv("HYBRID_BM25_K", 10))
+HYBRID_RRF_K = int(os.getenv("HYBRID_RRF_K", 60))
+HYBRID_MIN_FUSED_SCORE = float(os.getenv("HYBRID_MIN_FUSED_SCORE", 0.025))
 
 LLM_MODEL_PATH = os.getenv("LLM_MODEL_PATH")
+LLM_MAX_TOKENS = int(os.getenv("LLM_MAX_TOKENS", 1024))
+LLM_N_CTX = int(os.getenv("LLM_N_CTX", 8192))
+# Anggaran token konteks; 0 = otomatis (LLM_N_CTX - LLM_MAX_TOKENS - prompt - margin)
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 0))
+CONTEXT_TOKEN_MARGIN = int(os.getenv("CONTEXT_TOKEN_MARGIN", 64))
 EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", "intfloat/multilingual-e5-large")
 CHROMA_PERSIST_DIRECTORY = os.getenv("CHROMA_PERSIST_DIR", "./chroma_db_streamlit_app")
 COLLECTION_NAME = os.getenv("CHROMA_COLLECTION_NAME", "giziai_knowledge_app")
 HF_TOKEN = os.getenv("HF_TOKEN")
 KNOWLEDGE_BASE_DIR = os.getenv("UPLOAD_FOLDER", "base_knowledge")
 
+FALLBACK_MESSAGE = "Maaf, saya tidak memiliki informasi yang cukup untuk menjawab pertanyaan ini."
+SERVER_BUSY_MESSAGE = "Maaf, server sedang sibuk melayani banyak permintaan. Silakan coba lagi sebentar lagi."
+
+# Teks instruksi statis harus tetap di awal prompt agar prefix-nya bisa dipakai ulang dari prompt cache
+QA_TEMPLATE_SIMPLE_TEXT = """Kamu adalah asisten ahli di bidang gizi dan kesehatan masyarakat.
+PENTING: KELUARKAN KEMAMPUAN MAKSIMALMU untuk menjawab pertanyaan dengan natural dan terstruktur SESUAI KONTEKS yang diberikan.
+Jika jawabannya tidak ada didalam KONTEKS, HARUS balas dengan: Maaf, saya tidak memiliki informasi yang cukup untuk menjawab pertanyaan ini.
+
+Konteks:
+{context}
+
+Pertanyaan:
+{question}
+
+Jawaban:"""
+
+# Pengaturan retriever; bisa diganti dengan hasil sweep eval_retriever.py --write-config.
+# Dibaca ulang setiap kali engine dibangun (startup atau muat ulang dari halaman admin).
+RETRIEVER_CONFIG_PATH = os.getenv("RETRIEVER_CONFIG_PATH", "retriever_config.json")
+# Interval peringatan selama permintaan masih memakai engine lama; engine baru dilepas
+# setelah permintaan terakhirnya selesai
+RAG_ENGINE_DRAIN_TIMEOUT_SECONDS = float(os.getenv("RAG_ENGINE_DRAIN_TIMEOUT_SECONDS", 300))
+
+# Nonaktif secara default: skor kosinus e5 berkumpul di rentang sempit yang tinggi, sehingga
+# pertanyaan yang hanya berbeda angka, kelompok usia, atau zat gizi bisa melewati 0.95 dan
+# mendapat jawaban pertanyaan lain. Aktifkan setelah ambang dikalibrasi untuk model embedding.
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "false").lower() == "true"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.95))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", 500))
+SEMANTIC_CACHE_TTL_SECONDS = int(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", 86400))
+SEMANTIC_CACHE_PATH = os.getenv("SEMANTIC_CACHE_PATH") # Kosong = cache hanya di memori
+SEMANTIC_CACHE_SAVE_INTERVAL_SECONDS = float(os.getenv("SEMANTIC_CACHE_SAVE_INTERVAL_SECONDS", 30))
+
+# "thread": worker ingestion berjalan di proses Streamlit ini; "off": tidak ada worker latar
+# belakang. Worker di proses terpisah tidak didukung selama aplikasi berjalan (Chroma
+# PersistentClient hanya untuk satu proses); "process" diperlakukan sebagai "off".
+INGEST_WORKER_MODE = os.getenv("INGEST_WORKER_MODE", "thread").lower()
+
 # Pastikan direktori yang diperlukan ada
 # Pindahkan pembuatan direktori model ke dalam load_llm_model jika path model ada
 # if LLM_MODEL_PATH and not os.path.exists(os.path.dirname(LLM_MODEL_PATH)) and os.path.dirname(LLM_MODEL_PATH) != "":
@@ -49,6 +113,149 @@ MODEL_CACHE_DIR_FROM_ENV = os.getenv("MODEL_CACHE_DIR", "model/") # Ambil dari .
 os.makedirs(MODEL_CACHE_DIR_FROM_ENV, exist_ok=True)
 
 
+# Penghitung panggilan embedding dan pencarian vektor per giliran chat.
+# Disimpan per thread karena setiap sesi Streamlit berjalan di thread sendiri.
+_retrieval_call_stats = threading.local()
+
+def reset_retrieval_call_stats():
+    _retrieval_call_stats.counts = {"embed_query": 0, "embed_documents": 0, "vector_search": 0, "lexical_search": 0}
+
+def get_retrieval_call_stats():
+    if not hasattr(_retrieval_call_stats, "counts"):
+        reset_retrieval_call_stats()
+    return dict(_retrieval_call_stats.counts)
+
+def _increment_retrieval_call_stat(name, amount=1):
+    if not hasattr(_retrieval_call_stats, "counts"):
+        reset_retrieval_call_stats()
+    _retrieval_call_stats.counts[name] += amount
+
+
+def embed_question(engine, question):
+    """Embedding pertanyaan mandiri, dihitung sekali per giliran (None jika gagal)."""
+    try:
+        with trace_span("query_embedding"):
+            return engine.embedding_function.embed_query(question)
+    except Exception as e:
+        print(f"Error saat membuat embedding pertanyaan: {e}")
+        return None
+
+def retrieve_documents(engine, query, query_embedding=None):
+    """
+    Satu-satunya jalur pencarian dokumen untuk sebuah giliran chat.
+    Jika embedding pertanyaan sudah ada, pencarian dilakukan langsung dengan vektor
+    tersebut sehingga query tidak di-embed ulang.
+    """
+    _increment_retrieval_call_stat("vector_search")
+    search_kwargs = engine.retriever_search_kwargs
+    with trace_span("vector_search"):
+        if query_embedding is not None:
+            return search_vectorstore(engine.vectorstore, [query_embedding], engine.retriever_search_type, search_kwargs)[0]
+        return engine.retriever.invoke(query)
+
+semantic_answer_cache = SemanticAnswerCache(
+    similarity_threshold=SEMANTIC_CACHE_THRESHOLD,
+    max_entries=SEMANTIC_CACHE_MAX_ENTRIES,
+    ttl_seconds=SEMANTIC_CACHE_TTL_SECONDS,
+    persist_path=SEMANTIC_CACHE_PATH,
+    save_interval=SEMANTIC_CACHE_SAVE_INTERVAL_SECONDS,
+)
+atexit.register(semantic_answer_cache.shutdown)
+
+_semantic_cache_kb_version = get_knowledge_base_version()
+
+def _sync_with_knowledge_base_version(engine):
+    """
+    Jika basis pengetahuan diubah (juga oleh worker di proses lain): kosongkan
+    semantic cache dan muat ulang indeks BM25 dari disk.
+    """
+    global _semantic_cache_kb_version
+    current_version = get_knowledge_base_version()
+    if current_version != _semantic_cache_kb_version:
+        _semantic_cache_kb_version = current_version
+        semantic_answer_cache.clear()
+        if engine.vectorstore is not None:
+            get_lexical_index(engine.vectorstore._collection).reload_if_changed()
+        log_debug("Basis pengetahuan berubah, semantic cache dikosongkan dan indeks BM25 diperiksa ulang.")
+
+def _lookup_cached_answer(question, query_embedding):
+    if not SEMANTIC_CACHE_ENABLED or query_embedding is None:
+        return None
+    cached = semantic_answer_cache.lookup(query_embedding)
+    if cached is None:
+        return None
+    answer, cached_question, score = cached
+    log_debug(f"Semantic cache hit (skor {score:.3f}) untuk '{question}' ~ '{cached_question}'. Statistik: {semantic_answer_cache.get_stats()}")
+    return answer
+
+def _store_cached_answer(question, query_embedding, answer):
+    if not SEMANTIC_CACHE_ENABLED or query_embedding is None or answer == FALLBACK_MESSAGE:
+        return
+    semantic_answer_cache.add(question, query_embedding, answer)
+
+# Kata/frasa yang menandakan pertanyaan merujuk ke percakapan sebelumnya
+FOLLOW_UP_REFERENCE_WORDS = {
+    "itu", "ini", "tersebut", "tadi", "sebelumnya", "diatas", "dia", "mereka", "beliau",
+    "begitu", "demikian", "sana", "situ", "lagi", "lainnya", "lain", "juga", "pula",
+}
+FOLLOW_UP_LEADING_WORDS = {"dan", "lalu", "terus", "kalau", "kalo", "bagaimana dengan", "gimana dengan", "trus", "selain"}
+
+_contextualization_stats = {"no_history": 0, "fast_path": 0, "llm_rewrite": 0, "llm_rewrite_rejected": 0, "llm_error": 0}
+_contextualization_stats_lock = threading.Lock()
+
+def _record_contextualization_path(path):
+    with _contextualization_stats_lock:
+        _contextualization_stats[path] += 1
+
+def get_contextualization_stats():
+    """Berapa kali setiap jalur kontekstualisasi dipakai sejak proses dimulai."""
+    with _contextualization_stats_lock:
+        return dict(_contextualization_stats)
+
+def is_self_contained_question(question):
+    """
+    Heuristik murah: pertanyaan dianggap mandiri jika cukup panjang, tidak diawali
+    kata sambung percakapan, dan tidak berisi kata rujukan (itu, tersebut, -nya, ...).
+    """
+    normalized = re.sub(r'[^\w\s]', ' ', question.lower())
+    words = normalized.split()
+    if len(words) < CONTEXTUALIZE_MIN_SELF_CONTAINED_WORDS:
+        return False
+    if words[0] in FOLLOW_UP_LEADING_WORDS or " ".join(words[:2]) in FOLLOW_UP_LEADING_WORDS:
+        return False
+    for word in words:
+        if word in FOLLOW_UP_REFERENCE_WORDS:
+            return False
+        # Sufiks -nya sering merujuk ke hal yang disebut sebelumnya (mis. "manfaatnya")
+        if len(word) > 5 and word.endswith("nya"):
+            return False
+    return True
+
+def get_prompt_cache_stats(engine=None):
+    """Ringkasan token prompt yang dipakai ulang dan perkiraan waktu evaluasi prompt yang dihemat."""
+    engine = engine or get_rag_engine()
+    if engine is None:
+        return {"llm": None, "contextualize_llm": None}
+    return {
+        "llm": get_prompt_cache_summary(engine.llm, engine.llm_prompt_cache_stats),
+        "contextualize_llm": get_prompt_cache_summary(
+            engine.contextualize_llm, engine.contextualize_llm_prompt_cache_stats
+        ),
+    }
+
+def get_inference_scheduler_stats(engine=None):
+    """Kedalaman antrean, waktu tunggu, dan waktu eksekusi dari penjadwal inferensi."""
+    engine = engine or get_rag_engine()
+    inference_scheduler = engine.inference_scheduler if engine else None
+    contextualize_scheduler = engine.contextualize_scheduler if engine else None
+    return {
+        "llm": inference_scheduler.get_stats() if inference_scheduler else None,
+        "contextualize_llm": (
+            contextualize_scheduler.get_stats()
+            if contextualize_scheduler and contextualize_scheduler is not inference_scheduler else None
+        ),
+    }
+
 def docs2str(docs):
     return "\n\n".join(doc.page_content for doc in docs)
 
@@ -56,252 +263,581 @@ def approximate_token_count(text):
     if not text: return 0
     return len(text) // 4
 
-def get_keywords_from_query(query_text):
-    if not query_text: return set()
-    words = re.sub(r'[^\w\s]', '', query_text.lower()).split()
-    keywords = {word for word in words if len(word) > 2}
-    return keywords
+def count_llm_tokens(text, engine=None):
+    """Jumlah token menurut tokenizer model LLM; perkiraan jika LLM belum dimuat."""
+    if not text: return 0
+    engine = engine or get_rag_engine()
+    llama = getattr(engine.llm if engine else None, "client", None)
+    if llama is None:
+        return approximate_token_count(text)
+    try:
+        return len(llama.tokenize(text.encode("utf-8"), add_bos=False))
+    except Exception:
+        return approximate_token_count(text)
+
+def get_context_token_budget(question, engine=None):
+    """Token yang tersedia untuk konteks setelah ruang jawaban (LLM_MAX_TOKENS) dan sisa prompt."""
+    if CONTEXT_TOKEN_BUDGET > 0:
+        return CONTEXT_TOKEN_BUDGET
+    # "Human: " ditambahkan saat ChatPromptTemplate dirender untuk LLM teks
+    prompt_without_context = "Human: " + QA_TEMPLATE_SIMPLE_TEXT.format(context="", question=question)
+    prompt_tokens = count_llm_tokens(prompt_without_context, engine)
+    return max(0, LLM_N_CTX - LLM_MAX_TOKENS - prompt_tokens - CONTEXT_TOKEN_MARGIN)
 
-@st.cache_resource(show_spinner="Menginisialisasi komponen inti RAG...")
-def initialize_rag_components():
-    global llm, embedding_function, vectorstore, retriever, contextualize_q_chain, answer_generation_chain
+def _create_main_llm():
+    from langchain_community.llms import LlamaCpp
+    return LlamaCpp(
+        model_path=LLM_MODEL_PATH,
+        n_gpu_layers=int(os.getenv("LLM_N_GPU_LAYERS", -1)), temperature=float(os.getenv("LLM_TEMPERATURE", 0.5)),
+        top_p=float(os.getenv("LLM_TOP_P", 0.95)), repeat_penalty=float(os.getenv("LLM_REPEAT_PENALTY", 1.2)),
+        stop=["Question:", "\n\n", "Human:"], max_tokens=LLM_MAX_TOKENS,
+        n_ctx=LLM_N_CTX, n_batch=int(os.getenv("LLM_N_BATCH", 512)),
+        verbose=False
+    )
 
-    st.write("Memulai inisialisasi komponen RAG...")
-    all_components_initialized = True
+def _create_contextualize_llm():
+    from langchain_community.llms import LlamaCpp
+    return LlamaCpp(
+        model_path=CONTEXTUALIZE_LLM_MODEL_PATH,
+        n_gpu_layers=int(os.getenv("LLM_N_GPU_LAYERS", -1)), temperature=0.0,
+        stop=["\n", "Human:"], max_tokens=CONTEXTUALIZE_MAX_TOKENS,
+        n_ctx=CONTEXTUALIZE_N_CTX, n_batch=int(os.getenv("LLM_N_BATCH", 512)),
+        verbose=False
+    )
 
-    # Login ke Hugging Face jika token ada (DIPINDAHKAN KE SINI)
-    if HF_TOKEN:
-        st.info("Mencoba login ke Hugging Face Hub dengan token yang disediakan...")
-        try:
-            login(token=HF_TOKEN)
-            st.success("Login ke Hugging Face Hub berhasil (jika token valid).")
-        except Exception as e:
-            st.warning(f"Gagal login ke Hugging Face Hub: {e}. Proses akan dilanjutkan.")
+def _create_base_embeddings():
+    # Backend (sentence-transformers atau ONNX int8) dipilih lewat EMBEDDING_BACKEND, lihat utils_embeddings
+    return CountingEmbeddings(create_embeddings(EMBEDDING_MODEL_NAME), _increment_retrieval_call_stat)
 
-    # 1. Inisialisasi LLM
-    if llm is None:
-        # Pastikan direktori untuk model LLM ada jika pathnya adalah path file
-        if LLM_MODEL_PATH and os.path.dirname(LLM_MODEL_PATH) and not os.path.exists(os.path.dirname(LLM_MODEL_PATH)):
-            os.makedirs(os.path.dirname(LLM_MODEL_PATH), exist_ok=True)
-            
-        if not LLM_MODEL_PATH:
-            st.error("Error: Path model LLM (LLM_MODEL_PATH) tidak dikonfigurasi di .env.")
-            all_components_initialized = False
-        elif not os.path.exists(LLM_MODEL_PATH):
-            # Logika unduh model jika LLM_MODEL_PATH tidak ada dan MODEL_REPO_ID didefinisikan
-            # Ini adalah contoh, sesuaikan dengan kebutuhan Anda jika ingin unduh otomatis
-            model_repo_id = os.getenv("MODEL_REPO_ID")
-            model_filename = os.getenv("MODEL_FILENAME")
-            model_cache_dir = os.getenv("MODEL_CACHE_DIR", "model/") # default ke "model/"
-
-            if model_repo_id and model_filename:
-                st.write(f"Model {model_filename} tidak ditemukan di {LLM_MODEL_PATH}. Mencoba mengunduh dari {model_repo_id} ke {model_cache_dir}...")
-                os.makedirs(model_cache_dir, exist_ok=True)
-                try:
-                    downloaded_model_path = hf_hub_download(
-                        repo_id=model_repo_id,
-                        filename=model_filename,
-                        cache_dir=model_cache_dir,
-                        local_dir=model_cache_dir, # Mencoba menyimpan langsung di sini
-                        local_dir_use_symlinks=False
-                    )
-                    # hf_hub_download mengembalikan path absolut ke file yang diunduh
-                    # Kita perlu memastikan LLM_MODEL_PATH sekarang menunjuk ke sana jika berhasil
-                    # Namun, untuk konsistensi, pengguna harus mengatur LLM_MODEL_PATH ke path yang benar setelah unduh.
-                    # Untuk sekarang, kita anggap jika LLM_MODEL_PATH tidak ada, itu error.
-                    # Atau, kita bisa update LLM_MODEL_PATH di sini jika unduhan berhasil, tapi itu jadi stateful.
-                    # Untuk kesederhanaan: jika LLM_MODEL_PATH tidak ada, maka error.
-                    st.error(f"Model LLM tidak ditemukan di path: '{LLM_MODEL_PATH}'. Harap unduh model secara manual atau pastikan MODEL_REPO_ID & MODEL_FILENAME di .env benar untuk unduhan otomatis (fitur unduh belum sepenuhnya diimplementasikan di sini).")
-                    all_components_initialized = False
-
-                except Exception as e:
-                    st.error(f"Error saat mencoba mengunduh model: {e}")
-                    all_components_initialized = False
-            else:
-                st.error(f"Error: File model LLM tidak ditemukan di path: '{LLM_MODEL_PATH}' dan konfigurasi untuk unduh otomatis (MODEL_REPO_ID, MODEL_FILENAME) tidak ada.")
-                all_components_initialized = False
-        
-        if all_components_initialized and os.path.exists(LLM_MODEL_PATH): # Hanya lanjut jika path valid
-            try:
-                st.write(f"Memuat LLM dari: {LLM_MODEL_PATH}")
-                llm = LlamaCpp(
-                    model_path=LLM_MODEL_PATH,
-                    n_gpu_layers=int(os.getenv("LLM_N_GPU_LAYERS", -1)), temperature=float(os.getenv("LLM_TEMPERATURE", 0.5)),
-                    top_p=float(os.getenv("LLM_TOP_P", 0.95)), repeat_penalty=float(os.getenv("LLM_REPEAT_PENALTY", 1.2)),
-                    stop=["Question:", "\n\n", "Human:"], max_tokens=int(os.getenv("LLM_MAX_TOKENS", 1024)),
-                    n_ctx=int(os.getenv("LLM_N_CTX", 8192)), n_batch=int(os.getenv("LLM_N_BATCH", 512)),
-                    verbose=False
-                )
-                st.success("LLM berhasil dimuat.")
-            except Exception as e:
-                st.error(f"Error saat memuat LLM LlamaCpp: {e}")
-                llm = None
-                all_components_initialized = False
-    else:
-        st.info("LLM sudah terinisialisasi sebelumnya.")
+# --- Engine RAG ---
+# Semua komponen yang dipakai bersama oleh sesi-sesi dalam satu proses (model, vector store,
+# chains, penjadwal) dikumpulkan dalam satu RagEngine. Setiap giliran chat mengambil
+# referensi ke engine aktif sekali di awal dan memakainya sampai selesai, sehingga
+# memuat ulang sistem cukup membangun engine baru lalu menukarnya secara atomik.
+class RagEngine:
+    """Komponen RAG untuk satu generasi engine."""
 
-    # 2. Inisialisasi Embedding Function
-    if embedding_function is None:
-        try:
-            st.write(f"Memuat model embedding: {EMBEDDING_MODEL_NAME}")
-            embedding_function = SentenceTransformerEmbeddings(model_name=EMBEDDING_MODEL_NAME)
-            st.success(f"Embedding function '{EMBEDDING_MODEL_NAME}' berhasil dimuat.")
-        except Exception as e:
-            st.error(f"Error saat memuat embedding function '{EMBEDDING_MODEL_NAME}': {e}")
-            embedding_function = None
-            all_components_initialized = False
-    else:
-        st.info("Embedding function sudah terinisialisasi sebelumnya.")
+    # Referensi yang dilepas oleh close() agar memori model bisa dibebaskan
+    _RELEASED_ON_CLOSE = (
+        "llm", "llm_replicas", "contextualize_llm", "embedding_function", "vectorstore", "retriever",
+        "contextualize_q_chain", "answer_generation_chain", "inference_scheduler", "contextualize_scheduler",
+    )
 
-    # 3. Inisialisasi Vector Store dan Retriever
-    if vectorstore is None and embedding_function:
-        try:
-            st.write(f"Menginisialisasi vector store dari: {CHROMA_PERSIST_DIRECTORY}")
-            vectorstore = Chroma(
-                collection_name=COLLECTION_NAME,
-                persist_directory=CHROMA_PERSIST_DIRECTORY,
-                embedding_function=embedding_function
-            )
-            retriever = vectorstore.as_retriever(
-                search_type="mmr",
-                search_kwargs={'k': 5, 'fetch_k': 10, 'lambda_mult': 0.7}
-            )
-            st.success(f"Vector store dan retriever berhasil diinisialisasi.")
-            process_pending_documents_streamlit()
-        except Exception as e:
-            st.error(f"Error saat menginisialisasi ChromaDB/Retriever: {e}")
-            vectorstore = None
-            retriever = None
-            all_components_initialized = False
-    elif embedding_function is None and vectorstore is None:
-        st.warning("Vector store/Retriever tidak dapat diinisialisasi karena embedding function gagal dimuat.")
-        all_components_initialized = False
-    elif vectorstore is not None and retriever is None and embedding_function : # Jika vectorstore ada tapi retriever belum
-        try:
-            retriever = vectorstore.as_retriever(
-                search_type="mmr",
-                search_kwargs={'k': 5, 'fetch_k': 10, 'lambda_mult': 0.7}
+    def __init__(self):
+        self.generation = None
+        self.llm = None
+        # Replika LLM utama (llm = replika pertama) dan penjadwal yang membagi permintaan ke replika
+        self.llm_replicas = []
+        self.contextualize_llm = None
+        self.llm_prompt_cache_stats = None
+        self.contextualize_llm_prompt_cache_stats = None
+        self.embedding_function = None
+        self.vectorstore = None
+        self.retriever = None
+        self.retriever_search_type = None
+        self.retriever_search_kwargs = None
+        self.contextualize_q_chain = None
+        self.answer_generation_chain = None
+        self.inference_scheduler = None
+        self.contextualize_scheduler = None
+        # Engine yang memakai model milik engine lain tidak boleh menghentikan penjadwalnya
+        self.owns_models = True
+        self.models_shared_from = None
+        self._active_requests = 0
+        self._closed = False
+        self._idle = threading.Condition()
+
+    def share_models_from(self, other):
+        """Memakai ulang model, embedding, chains, dan penjadwal dari engine lain (tanpa memuat ulang)."""
+        for attribute in (
+            "llm", "llm_replicas", "contextualize_llm", "llm_prompt_cache_stats",
+            "contextualize_llm_prompt_cache_stats", "embedding_function", "contextualize_q_chain",
+            "answer_generation_chain", "inference_scheduler", "contextualize_scheduler",
+        ):
+            setattr(self, attribute, getattr(other, attribute))
+        self.owns_models = False
+        self.models_shared_from = other
+
+    def is_ready(self):
+        return bool(self.llm and self.contextualize_q_chain and self.answer_generation_chain
+                    and self.retriever and self.inference_scheduler)
+
+    def acquire(self):
+        """Menandai satu permintaan yang memakai engine ini; False jika engine sudah dilepas."""
+        with self._idle:
+            if self._closed:
+                return False
+            self._active_requests += 1
+            return True
+
+    def release(self):
+        with self._idle:
+            self._active_requests -= 1
+            if self._active_requests == 0:
+                self._idle.notify_all()
+
+    def wait_idle(self, timeout=None):
+        with self._idle:
+            return self._idle.wait_for(lambda: self._active_requests == 0, timeout)
+
+    def close(self):
+        """
+        Menunggu sampai tidak ada permintaan yang memakai engine ini, lalu menghentikan
+        penjadwal miliknya dan melepas referensi komponen. Permintaan baru tidak bisa lagi
+        memakai engine ini (acquire mengembalikan False), jadi tidak ada yang membaca
+        komponen yang sudah dilepas.
+        """
+        with self._idle:
+            self._idle.wait_for(lambda: self._active_requests == 0)
+            self._closed = True
+        if self.owns_models:
+            for scheduler in {self.inference_scheduler, self.contextualize_scheduler} - {None}:
+                scheduler.close()
+        for attribute in self._RELEASED_ON_CLOSE:
+            setattr(self, attribute, [] if attribute == "llm_replicas" else None)
+
+
+class _RagEngineSlot:
+    """Tempat engine aktif, startup yang sedang berjalan, dan engine yang sedang dibangun."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.engine = None
+        self.generation = 0
+        self.tracker = None
+        # Engine startup yang belum lengkap; dipakai ulang saat startup dicoba lagi
+        self.pending_engine = None
+
+    def swap(self, engine):
+        """Menjadikan engine aktif dan mengembalikan engine sebelumnya."""
+        with self.lock:
+            previous = self.engine
+            self.generation += 1
+            engine.generation = self.generation
+            if previous is not None and engine.models_shared_from is previous:
+                # Kepemilikan model berpindah ke engine baru
+                engine.owns_models, previous.owns_models = True, False
+            engine.models_shared_from = None
+            self.engine = engine
+            if self.pending_engine is engine:
+                self.pending_engine = None
+        return previous
+
+
+def _create_engine_slot():
+    # Satu slot per proses, dipakai bersama oleh semua sesi Streamlit
+    return _RagEngineSlot()
+
+_cached_engine_slot = None
+_headless_engine_slot = None
+_engine_slot_lock = threading.Lock()
+
+def _get_engine_slot():
+    """
+    Di aplikasi Streamlit slot di-cache dengan st.cache_resource. Mode batch/CLI
+    (batch_qa.py, benchmark_rag.py) tidak mengimpor Streamlit, jadi slot disimpan di modul.
+    """
+    global _cached_engine_slot, _headless_engine_slot
+    streamlit = sys.modules.get("streamlit")
+    if streamlit is not None:
+        if _cached_engine_slot is None:
+            _cached_engine_slot = streamlit.cache_resource(show_spinner=False)(_create_engine_slot)
+        return _cached_engine_slot()
+    with _engine_slot_lock:
+        if _headless_engine_slot is None:
+            _headless_engine_slot = _create_engine_slot()
+        return _headless_engine_slot
+
+def _show_error(message):
+    """Menulis error ke log, dan ke halaman jika dipanggil dari aplikasi Streamlit."""
+    print(message)
+    streamlit = sys.modules.get("streamlit")
+    if streamlit is not None:
+        streamlit.error(message)
+
+def get_rag_engine():
+    """Engine aktif (None jika startup belum selesai)."""
+    return _get_engine_slot().engine
+
+@contextmanager
+def _serving_engine(engine=None, require_ready=True):
+    """
+    Engine (default: engine aktif) yang ditandai sedang dipakai selama blok berjalan, sehingga
+    tidak dilepas di tengah jalan; None jika belum ada atau (require_ready) belum siap.
+    Jika engine ternyata sudah dilepas (ditukar tepat sebelum acquire), engine aktif diambil.
+    """
+    engine = engine or get_rag_engine()
+    while engine is not None and not engine.acquire():
+        engine = get_rag_engine()
+    if engine is None:
+        yield None
+        return
+    try:
+        yield engine if engine.is_ready() or not require_ready else None
+    finally:
+        engine.release()
+
+def _retire_engine(engine):
+    """
+    Melepas engine lama di latar belakang setelah permintaan yang masih memakainya
+    selesai, sehingga memori model lama tidak tertahan lebih lama dari perlu.
+    """
+    def retire():
+        waited = 0.0
+        while not engine.wait_idle(RAG_ENGINE_DRAIN_TIMEOUT_SECONDS):
+            waited += RAG_ENGINE_DRAIN_TIMEOUT_SECONDS
+            print(f"WARNING: Engine RAG generasi {engine.generation} masih dipakai setelah "
+                  f"{waited:.0f} detik; dilepas setelah permintaan terakhir selesai.")
+        generation = engine.generation
+        engine.close()
+        gc.collect()
+        print(f"Engine RAG generasi {generation} dilepas.")
+
+    threading.Thread(target=retire, name=f"rag-engine-retire-{engine.generation}", daemon=True).start()
+
+# --- Startup bertahap ---
+# Setiap komponen dimuat di thread sendiri (lihat utils_startup.StartupTracker) sehingga
+# LLM, model embedding, dan skema DB disiapkan paralel dan halaman bisa langsung tampil.
+# Tahap berjalan di luar thread skrip Streamlit, jadi hanya memakai print, bukan st.*.
+def _stage_database():
+    if not utils_db.ensure_schema():
+        raise RuntimeError("Skema database tidak dapat disiapkan (koneksi DB gagal).")
+
+def _stage_hf_login(engine):
+    if not HF_TOKEN:
+        return StageSkipped("HF_TOKEN tidak diset")
+    if engine.embedding_function is not None:
+        return StageSkipped("Model embedding sudah dimuat")
+    from huggingface_hub import login
+    login(token=HF_TOKEN)
+    return "Login ke Hugging Face Hub berhasil."
+
+def _stage_llm(engine):
+    if engine.llm is not None:
+        return "LLM sudah terinisialisasi sebelumnya."
+    if not LLM_MODEL_PATH:
+        raise RuntimeError("Path model LLM (LLM_MODEL_PATH) tidak dikonfigurasi di .env.")
+    if not os.path.exists(LLM_MODEL_PATH):
+        if os.getenv("MODEL_REPO_ID") and os.getenv("MODEL_FILENAME"):
+            raise RuntimeError(
+                f"Model LLM tidak ditemukan di path: '{LLM_MODEL_PATH}'. Harap unduh model secara manual "
+                "(unduhan otomatis dari MODEL_REPO_ID/MODEL_FILENAME belum diimplementasikan)."
             )
-            st.info("Retriever berhasil dibuat dari vectorstore yang sudah ada.")
-            process_pending_documents_streamlit() # Proses juga jika retriever baru dibuat
-        except Exception as e:
-            st.error(f"Error membuat retriever dari vectorstore yang ada: {e}")
-            retriever = None
-            all_components_initialized = False
-    elif vectorstore is not None and retriever is not None:
-         st.info("Vector store dan retriever sudah terinisialisasi sebelumnya.")
-         if embedding_function: # Hanya proses jika embedding ada
-            process_pending_documents_streamlit()
-
-
-    # 4. Setup Chains
-    if llm and retriever and (contextualize_q_chain is None or answer_generation_chain is None) :
-        st.write("Membuat Langchain chains...")
-        contextualize_q_system_prompt = (
-            "Diberikan riwayat percakapan dan pertanyaan pengguna terbaru "
-            "yang mungkin merujuk pada konteks dalam riwayat percakapan, "
-            "formulasikan pertanyaan mandiri yang dapat dipahami "
-            "tanpa riwayat percakapan. JANGAN menjawab pertanyaan, "
-            "cukup formulasikan ulang jika diperlukan dan kembalikan apa adanya."
+        raise RuntimeError(f"File model LLM tidak ditemukan di path: '{LLM_MODEL_PATH}'.")
+    print(f"Memuat LLM dari: {LLM_MODEL_PATH} ({max(1, LLM_REPLICAS)} replika)")
+    # Satu konteks llama.cpp hanya melayani satu permintaan pada satu waktu;
+    # LLM_REPLICAS > 1 memuat beberapa instance agar sesi bisa dilayani paralel
+    replicas = [_create_main_llm() for _ in range(max(1, LLM_REPLICAS))]
+    # Prefix prompt statis dan riwayat sesi dipakai ulang dari KV cache llama.cpp
+    engine.llm_prompt_cache_stats = PromptCacheStats()
+    for index, replica in enumerate(replicas):
+        enable_prompt_cache(replica, f"llm{index}" if index else "llm", stats=engine.llm_prompt_cache_stats,
+                            replicas=len(replicas))
+    engine.llm_replicas = replicas
+    engine.llm = replicas[0]
+    return f"{len(replicas)} replika LLM dimuat."
+
+def _stage_contextualize_llm(engine):
+    if not CONTEXTUALIZE_LLM_MODEL_PATH:
+        return StageSkipped("LLM utama dipakai untuk kontekstualisasi")
+    if engine.contextualize_llm is not None:
+        return "LLM kontekstualisasi sudah terinisialisasi sebelumnya."
+    if not os.path.exists(CONTEXTUALIZE_LLM_MODEL_PATH):
+        raise RuntimeError(f"LLM kontekstualisasi tidak ditemukan di '{CONTEXTUALIZE_LLM_MODEL_PATH}'. LLM utama akan dipakai.")
+    print(f"Memuat LLM kontekstualisasi dari: {CONTEXTUALIZE_LLM_MODEL_PATH}")
+    model = _create_contextualize_llm()
+    engine.contextualize_llm_prompt_cache_stats = enable_prompt_cache(model, "contextualize_llm")
+    engine.contextualize_llm = model
+    return "LLM kontekstualisasi dimuat."
+
+def _stage_embeddings(engine):
+    if engine.embedding_function is not None:
+        return "Embedding function sudah terinisialisasi sebelumnya."
+    print(f"Memuat model embedding: {EMBEDDING_MODEL_NAME}")
+    # Embedding yang pernah dihitung diambil dari cache persisten (lihat utils_cache.EmbeddingCache)
+    base_embeddings = _create_base_embeddings()
+    engine.embedding_function = wrap_with_embedding_cache(
+        base_embeddings, embedding_cache_name(base_embeddings, EMBEDDING_MODEL_NAME)
+    )
+    return f"Embedding function '{EMBEDDING_MODEL_NAME}' dimuat."
+
+def _stage_vectorstore(engine):
+    if engine.embedding_function is None:
+        raise RuntimeError("Embedding function gagal dimuat.")
+    if engine.vectorstore is None:
+        from langchain_chroma import Chroma
+        # Gagal jika ingest_worker.py (atau instance aplikasi lain) sedang memakai direktori ini
+        acquire_chroma_process_lock()
+        print(f"Menginisialisasi vector store dari: {CHROMA_PERSIST_DIRECTORY}")
+        vectorstore = Chroma(
+            collection_name=COLLECTION_NAME,
+            persist_directory=CHROMA_PERSIST_DIRECTORY,
+            embedding_function=engine.embedding_function
         )
-        contextualize_q_prompt = ChatPromptTemplate.from_messages([
-            ("system", contextualize_q_system_prompt),
-            MessagesPlaceholder(variable_name="chat_history"),
-            ("human", "{input}")
-        ])
-        contextualize_q_chain = contextualize_q_prompt | llm | StrOutputParser()
-        st.info("Contextualization chain berhasil dibuat.")
-
-        qa_template_simple_text = """Kamu adalah asisten ahli di bidang gizi dan kesehatan masyarakat.
-PENTING: KELUARKAN KEMAMPUAN MAKSIMALMU untuk menjawab pertanyaan dengan natural dan terstruktur SESUAI KONTEKS yang diberikan.
-Jika jawabannya tidak ada didalam KONTEKS, HARUS balas dengan: Maaf, saya tidak memiliki informasi yang cukup untuk menjawab pertanyaan ini.
+        if is_compact_backend_enabled():
+            # Pencarian dilayani indeks memory-mapped; Chroma tetap dipakai untuk penulisan.
+            # Snapshot usang dibangun ulang di latar belakang agar muat ulang engine tidak menunggu
+            from utils_vector_index import CompactVectorStore, ensure_compact_index
+            vectorstore = CompactVectorStore(vectorstore, ensure_compact_index(vectorstore._collection, background=True))
+        engine.vectorstore = vectorstore
+    if engine.retriever is None:
+        engine.retriever_search_type, engine.retriever_search_kwargs = load_retriever_config(RETRIEVER_CONFIG_PATH)
+        engine.retriever = engine.vectorstore.as_retriever(
+            search_type=engine.retriever_search_type,
+            search_kwargs=engine.retriever_search_kwargs
+        )
+    lexical_index = get_lexical_index(engine.vectorstore._collection)
+    lexical_index.reload_if_changed()
+    backend = f"indeks ringkas {len(engine.vectorstore.index)} chunk" if is_compact_backend_enabled() else "Chroma"
+    return (f"Vector store ({backend}) dan retriever ({engine.retriever_search_type}, "
+            f"{engine.retriever_search_kwargs}) siap; indeks BM25 {len(lexical_index)} chunk.")
 
-Konteks:
-{context}
+def _stage_chains(engine):
+    if engine.llm is None or engine.retriever is None:
+        raise RuntimeError("Chains tidak dapat dibuat karena LLM atau Retriever tidak terinisialisasi.")
+    if engine.contextualize_q_chain is not None and engine.answer_generation_chain is not None:
+        return "Langchain chains sudah terinisialisasi sebelumnya."
+    from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+    from langchain_core.output_parsers import StrOutputParser
 
-Pertanyaan:
-{question}
+    contextualize_q_system_prompt = (
+        "Diberikan riwayat percakapan dan pertanyaan pengguna terbaru "
+        "yang mungkin merujuk pada konteks dalam riwayat percakapan, "
+        "formulasikan pertanyaan mandiri yang dapat dipahami "
+        "tanpa riwayat percakapan. JANGAN menjawab pertanyaan, "
+        "cukup formulasikan ulang jika diperlukan dan kembalikan apa adanya."
+    )
+    contextualize_q_prompt = ChatPromptTemplate.from_messages([
+        ("system", contextualize_q_system_prompt),
+        MessagesPlaceholder(variable_name="chat_history"),
+        ("human", "{input}")
+    ])
+    simple_qa_prompt_template = ChatPromptTemplate.from_template(QA_TEMPLATE_SIMPLE_TEXT)
 
-Jawaban:"""
-        simple_qa_prompt_template = ChatPromptTemplate.from_template(qa_template_simple_text)
+    # Penulisan ulang hanya butuh satu kalimat: pakai model kecil jika ada,
+    # atau LLM utama dengan max_tokens yang ketat.
+    # Konteks jawaban diberikan langsung oleh pemanggil (hasil retrieval yang sama dengan
+    # pengecekan relevansi), sehingga retriever tidak dijalankan dua kali.
+    # Setiap replika punya chain sendiri; penjadwal memberikan replika yang sedang bebas.
+    replica_chains = [
+        {
+            "llm": replica,
+            "contextualize_q_chain": (
+                contextualize_q_prompt
+                | (engine.contextualize_llm or replica.bind(max_tokens=CONTEXTUALIZE_MAX_TOKENS))
+                | StrOutputParser()
+            ),
+            "answer_generation_chain": simple_qa_prompt_template | replica | StrOutputParser(),
+        }
+        for replica in engine.llm_replicas
+    ]
+    scheduler = InferenceScheduler(replica_chains, name="llm")
+    if engine.contextualize_llm is not None:
+        # Model kontekstualisasi terpisah punya antrean sendiri agar tidak menunggu jawaban panjang
+        engine.contextualize_scheduler = InferenceScheduler([replica_chains[0]], name="contextualize_llm")
+    else:
+        engine.contextualize_scheduler = scheduler
+    engine.inference_scheduler = scheduler
+    engine.contextualize_q_chain = replica_chains[0]["contextualize_q_chain"]
+    engine.answer_generation_chain = replica_chains[0]["answer_generation_chain"]
+    return f"Chains dan penjadwal inferensi siap ({len(replica_chains)} replika)."
+
+def _stage_activate(engine):
+    """Menukar engine aktif dengan engine yang baru selesai dibangun (atomik)."""
+    slot = _get_engine_slot()
+    if not engine.is_ready():
+        if slot.engine is not None:
+            # Muat ulang gagal: engine lama tetap melayani, engine baru dibuang
+            engine.close()
+        raise RuntimeError("Komponen engine belum lengkap; engine aktif tidak diganti.")
+    previous = slot.swap(engine)
+    if previous is None:
+        return f"Engine generasi {engine.generation} aktif."
+    # Basis pengetahuan atau konfigurasi retriever bisa berubah: jawaban tersimpan bisa usang
+    semantic_answer_cache.clear()
+    _retire_engine(previous)
+    return f"Engine generasi {engine.generation} aktif, menggantikan generasi {previous.generation}."
+
+def _stage_ingestion_worker(engine):
+    if engine.generation is None:
+        raise RuntimeError("Engine belum aktif untuk worker ingestion.")
+    return ensure_ingestion_worker(engine)
+
+def _run_engine_stages(engine, background_services=True):
+    tracker = StartupTracker()
+    if background_services:
+        tracker.run_stage("database", _stage_database)
+    tracker.run_stage("hf_login", lambda: _stage_hf_login(engine))
+    tracker.run_stage("llm", lambda: _stage_llm(engine))
+    tracker.run_stage("contextualize_llm", lambda: _stage_contextualize_llm(engine))
+    tracker.run_stage("embeddings", lambda: _stage_embeddings(engine), depends_on=("hf_login",))
+    tracker.run_stage("vectorstore", lambda: _stage_vectorstore(engine), depends_on=("embeddings",))
+    tracker.run_stage("chains", lambda: _stage_chains(engine), depends_on=("llm", "contextualize_llm", "vectorstore"))
+    tracker.run_stage("activate", lambda: _stage_activate(engine), depends_on=("chains",))
+    if background_services:
+        # Dokumen pending diproses di latar belakang setelah engine aktif
+        tracker.run_stage("ingestion_worker", lambda: _stage_ingestion_worker(engine), depends_on=("database", "activate"))
+    return tracker
+
+def start_rag_startup(background_services=True):
+    """
+    Memulai startup bertahap sekali per proses dan langsung kembali (tidak menunggu).
+    Jika startup sebelumnya sudah selesai tetapi engine belum aktif, tahap-tahap
+    dijalankan ulang (komponen yang sudah termuat tidak dimuat lagi).
+    Tanpa background_services (mode batch), skema DB, worker ingestion, dan
+    endpoint metrik tidak disiapkan.
+    """
+    slot = _get_engine_slot()
+    with slot.lock:
+        if slot.tracker is not None and (not slot.tracker.is_finished() or slot.engine is not None):
+            return slot.tracker
+        if background_services:
+            start_metrics_server()
+        if slot.pending_engine is None:
+            slot.pending_engine = RagEngine()
+        slot.tracker = _run_engine_stages(slot.pending_engine, background_services)
+        return slot.tracker
+
+def reload_rag_engine(reload_models=False):
+    """
+    Membangun engine baru di latar belakang lalu menukarnya dengan engine aktif.
+    Permintaan yang sedang berjalan tetap memakai engine lama sampai selesai.
+    Tanpa reload_models, LLM, embedding, dan penjadwal dipakai ulang sehingga hanya
+    vector store, retriever, konfigurasi retriever, dan indeks BM25 yang dibangun ulang
+    (tanpa memori tambahan). Dengan reload_models, model dimuat ulang dan memori
+    sempat dua kali lipat sampai engine lama dilepas.
+    """
+    slot = _get_engine_slot()
+    with slot.lock:
+        if slot.engine is None or (slot.tracker is not None and not slot.tracker.is_finished()):
+            # Belum ada engine aktif atau startup/muat ulang lain masih berjalan
+            tracker = slot.tracker
+        else:
+            engine = RagEngine()
+            if not reload_models:
+                engine.share_models_from(slot.engine)
+            slot.tracker = tracker = _run_engine_stages(engine)
+    return tracker or start_rag_startup()
 
-        answer_generation_chain = (
-            RunnablePassthrough.assign(context=(lambda x: x["question"]) | retriever | RunnableLambda(docs2str))
-            | simple_qa_prompt_template
-            | llm
-            | StrOutputParser()
+def get_rag_readiness():
+    """Status siap per komponen untuk UI dan probe readiness."""
+    slot = _get_engine_slot()
+    tracker = slot.tracker
+    if tracker is None:
+        return {"ready": False, "started": False, "components": {}}
+    return {
+        "ready": _rag_components_ready(),
+        "started": True,
+        "finished": tracker.is_finished(),
+        "engine_generation": slot.generation,
+        "elapsed_seconds": round(time.monotonic() - tracker.started_at, 2),
+        "components": tracker.status(),
+    }
+
+def is_rag_ready():
+    return _rag_components_ready()
+
+# Probe readiness (mis. Kubernetes) di server metrik: 200 jika siap menjawab, 503 jika belum
+register_json_endpoint("/ready", lambda: (200 if is_rag_ready() else 503, get_rag_readiness()))
+
+def initialize_rag_components(timeout=None, background_services=True):
+    """
+    Memulai startup (jika belum) dan menunggu sampai semua tahap selesai.
+    Mengembalikan True jika komponen chat siap.
+    """
+    tracker = start_rag_startup(background_services)
+    tracker.wait(timeout=timeout)
+    ready = _rag_components_ready()
+    if not ready:
+        failed = {name: c["error"] for name, c in tracker.status().items() if c["state"] == "failed"}
+        print(f"Beberapa komponen RAG gagal diinisialisasi: {failed}")
+    return ready
+
+_ingestion_worker = None
+
+def ensure_ingestion_worker(engine=None):
+    """
+    Memastikan dokumen pending diproses di luar jalur request.
+    Pada mode "thread", worker latar belakang dijalankan sekali per proses dan
+    memakai komponen dari engine aktif. Mode lain tidak menjalankan worker; ingest_worker.py
+    tidak bisa dipakai bersamaan karena direktori Chroma dikunci oleh aplikasi.
+    """
+    global _ingestion_worker
+    if INGEST_WORKER_MODE != "thread":
+        if INGEST_WORKER_MODE == "process":
+            print("WARNING: INGEST_WORKER_MODE=process tidak didukung selama aplikasi berjalan "
+                  "(Chroma hanya untuk satu proses); worker ingestion latar belakang tidak dijalankan.")
+        return StageSkipped("Worker ingestion latar belakang dinonaktifkan (INGEST_WORKER_MODE).")
+    engine = engine or get_rag_engine()
+    if engine is None:
+        raise RuntimeError("Engine RAG belum aktif untuk worker ingestion.")
+    if _ingestion_worker is None:
+        _ingestion_worker = IngestionWorker(
+            engine.vectorstore, engine.embedding_function, on_knowledge_base_changed=semantic_answer_cache.clear
         )
-        st.info("Answer generation chain (RAG sederhana) berhasil dibuat.")
-    elif not llm or not retriever:
-        st.warning("Chains tidak dapat dibuat karena LLM atau Retriever tidak terinisialisasi.")
-        all_components_initialized = False
-    elif contextualize_q_chain and answer_generation_chain:
-        st.info("Langchain chains sudah terinisialisasi sebelumnya.")
-
-    if all_components_initialized and llm and retriever and contextualize_q_chain and answer_generation_chain:
-        st.success("Semua komponen RAG berhasil diinisialisasi.")
     else:
-        st.error("Beberapa komponen RAG gagal diinisialisasi sepenuhnya. Periksa log di atas.")
-        all_components_initialized = False # Pastikan false jika ada yg gagal
-    
-    return all_components_initialized
+        # Setelah engine ditukar, batch berikutnya memakai komponen engine baru
+        _ingestion_worker.vectorstore = engine.vectorstore
+        _ingestion_worker.embedding_function = engine.embedding_function
+    _ingestion_worker.start_thread()
+    return "Worker ingestion latar belakang aktif; dokumen pending akan diproses otomatis."
+
+def _run_ingestion(files, engine=None):
+    """
+    Menjalankan ingestion inkremental untuk daftar file (dict 'id', 'filepath').
+    Status file di DB diperbarui per file dan progres per halaman ditulis ke kolom progress;
+    mengembalikan (hasil per file_id, ringkasan throughput).
+    """
+    results = {}
+
+    def on_file_done(file_id, success, message):
+        results[file_id] = (success, message)
+        print(f"Ingestion file ID {file_id}: {'berhasil' if success else 'gagal'} - {message}")
+        utils_db.update_file_status(file_id, 'active' if success else 'error')
+
+    def on_file_progress(file_id, progress):
+        message = format_file_progress(progress)
+        log_debug(f"Ingestion file ID {file_id}: {message}")
+        utils_db.update_file_progress(file_id, message)
+
+    with _serving_engine(engine, require_ready=False) as engine:
+        if engine is None or engine.vectorstore is None or engine.embedding_function is None:
+            raise RuntimeError("Vectorstore atau embedding function belum siap untuk ingestion.")
+        summary, changed = ingest_files(engine.vectorstore, engine.embedding_function, files,
+                                        on_file_done=on_file_done, on_file_progress=on_file_progress)
+    if changed:
+        # Basis pengetahuan berubah (ditandai oleh ingest_files): jawaban yang tersimpan bisa jadi sudah usang
+        semantic_answer_cache.clear()
+    return results, summary
 
 def process_document_to_vectorstore_streamlit(filepath, file_id):
-    global vectorstore, embedding_function
-    if not vectorstore or not embedding_function:
+    import streamlit as st
+    engine = get_rag_engine()
+    if engine is None or not engine.vectorstore or not engine.embedding_function:
         st.error("Error: Vectorstore atau embedding function belum terinisialisasi untuk memproses dokumen.")
         print("Error: Vectorstore atau embedding function belum terinisialisasi untuk memproses dokumen.")
         return False
+    st.info(f"Memproses file: {os.path.basename(filepath)} (ID DB: {file_id})")
+    print(f"Memproses file: {filepath} (ID: {file_id})")
     try:
-        st.info(f"Memproses file: {os.path.basename(filepath)} (ID DB: {file_id})")
-        print(f"Memproses file: {filepath} (ID: {file_id})")
-        
-        if filepath.endswith(".pdf"):
-            loader = PyPDFLoader(filepath)
-        elif filepath.endswith(".docx"):
-            loader = Docx2txtLoader(filepath)
-        elif filepath.endswith(".txt"):
-            loader = TextLoader(filepath, encoding='utf-8')
-        else:
-            st.warning(f"Tipe file {os.path.basename(filepath)} tidak didukung.")
-            print(f"Tipe file tidak didukung: {filepath}")
-            utils_db.update_file_status(file_id, 'error')
-            return False
-            
-        documents = loader.load()
-        if not documents:
-            st.warning(f"Tidak ada konten yang dapat dimuat dari {os.path.basename(filepath)}.")
-            print(f"Tidak ada konten yang dapat dimuat dari {filepath}")
-            utils_db.update_file_status(file_id, 'error')
-            return False
-
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=300, length_function=len)
-        splits = text_splitter.split_documents(documents)
-
-        if not splits:
-            st.warning(f"Tidak ada teks yang dapat diekstrak (setelah split) dari {os.path.basename(filepath)}")
-            print(f"Tidak ada teks yang dapat diekstrak dari {filepath}")
-            utils_db.update_file_status(file_id, 'error')
-            return False
-        
-        for split in splits:
-            split.metadata["source"] = os.path.basename(filepath)
-            split.metadata["file_id"] = str(file_id)
-
-        vectorstore.add_documents(splits)
-        st.success(f"Berhasil memproses dan menambahkan {len(splits)} chunk dari {os.path.basename(filepath)} ke vector store.")
-        print(f"Berhasil memproses dan menambahkan {len(splits)} chunk dari {filepath} ke vector store.")
-        utils_db.update_file_status(file_id, 'active')
-        return True
+        results, summary = _run_ingestion([{"id": file_id, "filepath": filepath}], engine)
     except Exception as e:
         st.error(f"Error saat memproses dokumen {os.path.basename(filepath)}: {e}")
         print(f"Error saat memproses dokumen {filepath}: {e}")
         utils_db.update_file_status(file_id, 'error')
         return False
 
+    success, message = results.get(file_id, (False, "Tidak ada hasil ingestion."))
+    if success:
+        st.success(f"Berhasil memproses dan menambahkan {summary['chunks_written']} chunk dari {os.path.basename(filepath)} ke vector store.")
+    else:
+        st.warning(message)
+    return success
+
 def process_pending_documents_streamlit():
-    global vectorstore, embedding_function
-    if not vectorstore or not embedding_function:
+    import streamlit as st
+    engine = get_rag_engine()
+    if engine is None or not engine.vectorstore or not engine.embedding_function:
         st.warning("Vectorstore atau embedding function belum siap untuk memproses dokumen pending.")
         print("Vectorstore atau embedding function belum siap untuk memproses dokumen pending.")
         return
@@ -315,20 +851,32 @@ def process_pending_documents_streamlit():
         print("Tidak ada dokumen baru untuk diproses.")
         return
 
-    processed_count = 0
+    files_to_process = []
     for db_file_entry in unprocessed_files:
         filepath = db_file_entry['filepath']
         file_id = db_file_entry['id']
         filename = db_file_entry['filename']
 
         if os.path.exists(filepath):
-            st.write(f"Memulai pemrosesan untuk file: {filename} (ID DB: {file_id})")
-            if process_document_to_vectorstore_streamlit(filepath, file_id):
-                processed_count +=1
+            st.write(f"Menjadwalkan pemrosesan untuk file: {filename} (ID DB: {file_id})")
+            files_to_process.append({"id": file_id, "filepath": filepath})
         else:
             st.error(f"File {filename} (path: {filepath}, ID DB: {file_id}) tidak ditemukan di sistem file.")
             print(f"File {filepath} (ID: {file_id}) tidak ditemukan.")
             utils_db.update_file_status(file_id, 'error')
+
+    processed_count = 0
+    if files_to_process:
+        results, summary = _run_ingestion(files_to_process, engine)
+        processed_count = sum(1 for success, _ in results.values() if success)
+        for file_id, (success, message) in results.items():
+            if not success:
+                st.error(f"Gagal memproses file ID DB {file_id}: {message}")
+        st.write(
+            f"Throughput ingestion: {summary['pages_per_second']:.1f} halaman/detik, "
+            f"{summary['chunks_per_second']:.1f} chunk/detik, "
+            f"{summary['embeddings_per_second']:.1f} embedding/detik."
+        )
     
     if processed_count > 0:
         st.success(f"Selesai memproses {processed_count} dokumen yang tertunda.")
@@ -336,33 +884,49 @@ def process_pending_documents_streamlit():
         st.info("Tidak ada dokumen yang berhasil diproses pada sesi ini (mungkin sudah diproses atau ada error).")
     print("Selesai memproses dokumen yang tertunda.")
 
-def get_rag_response_streamlit(session_uuid: str, user_input: str):
-    global llm, contextualize_q_chain, answer_generation_chain, retriever
+def _rag_components_ready():
+    engine = get_rag_engine()
+    return engine is not None and engine.is_ready()
 
-    if not llm or not contextualize_q_chain or not answer_generation_chain or not retriever:
-        error_msg = "Sistem RAG belum siap sepenuhnya."
-        st.error(error_msg)
-        print(f"ERROR: {error_msg}")
-        utils_db.insert_chat_log(session_uuid, user_input, error_msg, "N/A - RAG System Error")
-        return error_msg
+def _get_model_name_for_log():
+    return os.path.basename(LLM_MODEL_PATH) if LLM_MODEL_PATH else "LlamaCpp_Unknown"
 
-    chat_history_for_contextualization = utils_db.get_chat_history_from_db(session_uuid)
-    
-    if len(chat_history_for_contextualization) > MAX_HISTORY_MESSAGES_FOR_CONTEXTUALIZATION:
-        start_index = len(chat_history_for_contextualization) - MAX_HISTORY_MESSAGES_FOR_CONTEXTUALIZATION
-        chat_history_for_contextualization = chat_history_for_contextualization[start_index:]
+def _contextualize_question(engine, session_uuid, user_input, chat_history=None):
+    """
+    Mengubah input pengguna menjadi pertanyaan mandiri berdasarkan riwayat chat.
+    Riwayat dibaca dari DB, kecuali diberikan pemanggil (mode batch menyimpannya di memori).
+    """
+    if CONTEXTUALIZE_FAST_PATH_ENABLED and is_self_contained_question(user_input):
+        _record_contextualization_path("fast_path")
+        log_debug(f"Pertanyaan sudah mandiri, kontekstualisasi dilewati: '{user_input}'. Statistik: {get_contextualization_stats()}")
+        return user_input
+
+    if chat_history is not None:
+        chat_history_for_contextualization = chat_history[-MAX_HISTORY_MESSAGES_FOR_CONTEXTUALIZATION:]
+    else:
+        # Hanya pesan terakhir yang dibutuhkan; dilayani dari cache riwayat per sesi jika ada
+        with trace_span("history_fetch") as span_tokens:
+            chat_history_for_contextualization = utils_db.get_recent_chat_history(
+                session_uuid, MAX_HISTORY_MESSAGES_FOR_CONTEXTUALIZATION
+            )
+            span_tokens["messages"] = len(chat_history_for_contextualization)
     
     generated_standalone_question = user_input
     if chat_history_for_contextualization:
         try:
             # st.write(f"DEBUG (Streamlit): Input ke kontekstualisasi - History: {len(chat_history_for_contextualization)} pesan, Input: '{user_input}'")
-            print(f"DEBUG: Input ke contextualize_q_chain - History: {len(chat_history_for_contextualization)} pesan, Input: '{user_input}'")
-            raw_reformulated_question = contextualize_q_chain.invoke({
-                "chat_history": chat_history_for_contextualization,
-                "input": user_input
-            })
+            log_debug(f"Input ke contextualize_q_chain - History: {len(chat_history_for_contextualization)} pesan, Input: '{user_input}'")
+            with trace_span("contextualization") as span_tokens:
+                # stream (bukan invoke): jika batas waktu lewat, generasi berhenti dan replika dilepas
+                raw_reformulated_question = engine.contextualize_scheduler.run(
+                    lambda replica: replica["contextualize_q_chain"].stream({
+                        "chat_history": chat_history_for_contextualization,
+                        "input": user_input
+                    })
+                )
+                span_tokens["completion"] = count_llm_tokens(raw_reformulated_question, engine)
             # st.write(f"DEBUG (Streamlit): Output mentah dari kontekstualisasi: '{raw_reformulated_question}'")
-            print(f"DEBUG: Output mentah dari contextualize_q_chain: '{raw_reformulated_question}'")
+            log_debug(f"Output mentah dari contextualize_q_chain: '{raw_reformulated_question}'")
 
             cleaned_question = raw_reformulated_question.strip()
             prefixes_to_remove = ["ai:", "jawaban:", "output anda:", "output saya:", "pertanyaan:"]
@@ -378,87 +942,339 @@ def get_rag_response_streamlit(session_uuid: str, user_input: str):
 
             if is_likely_answer and cleaned_question.lower() != user_input.lower() :
                 # st.write(f"DEBUG (Streamlit): Output kontekstualisasi ('{cleaned_question}') tampak seperti jawaban/terlalu panjang. Menggunakan input asli.")
-                print(f"DEBUG: Output kontekstualisasi ('{cleaned_question}') tampak seperti jawaban/terlalu panjang. Menggunakan input asli.")
+                log_debug(f"Output kontekstualisasi ('{cleaned_question}') tampak seperti jawaban/terlalu panjang. Menggunakan input asli.")
+                _record_contextualization_path("llm_rewrite_rejected")
                 generated_standalone_question = user_input
             else:
+                _record_contextualization_path("llm_rewrite")
                 generated_standalone_question = cleaned_question
             # st.write(f"DEBUG (Streamlit): Pertanyaan asli: '{user_input}', Pertanyaan standalone: '{generated_standalone_question}'")
-            print(f"DEBUG: Pertanyaan asli: '{user_input}', Pertanyaan standalone (setelah pembersihan): '{generated_standalone_question}'")
+            log_debug(f"Pertanyaan asli: '{user_input}', Pertanyaan standalone (setelah pembersihan): '{generated_standalone_question}'")
+        except ServerBusyError:
+            raise
         except Exception as e:
-            st.error(f"Error saat kontekstualisasi pertanyaan: {e}. Menggunakan input asli.")
-            print(f"Error saat kontekstualisasi pertanyaan: {e}. Menggunakan input asli.")
+            _show_error(f"Error saat kontekstualisasi pertanyaan: {e}. Menggunakan input asli.")
+            _record_contextualization_path("llm_error")
             generated_standalone_question = user_input
     else:
         # st.write(f"DEBUG (Streamlit): Tidak ada histori, pertanyaan digunakan langsung: '{generated_standalone_question}'")
-        print(f"DEBUG: Tidak ada histori, pertanyaan digunakan langsung: '{generated_standalone_question}'")
+        log_debug(f"Tidak ada histori, pertanyaan digunakan langsung: '{generated_standalone_question}'")
+        _record_contextualization_path("no_history")
 
-    standalone_question_for_rag = generated_standalone_question
+    return generated_standalone_question
 
+def _hybrid_retrieve(engine, standalone_question_for_rag, query_embedding=None, vector_docs=None):
+    """
+    Pencarian hybrid: BM25 atas chunk store digabung dengan retriever Chroma
+    lewat reciprocal-rank fusion. Mengembalikan (list (Document, skor fusi), jumlah hit BM25).
+    Pencarian vektor selalu dijalankan, juga jika BM25 tidak menemukan satu pun istilah
+    pertanyaan; relevansi diputuskan oleh ambang skor fusi.
+    vector_docs diisi jika pencarian vektor sudah dilakukan sekaligus (mode batch).
+    """
+    lexical_index = get_lexical_index(engine.vectorstore._collection)
+    _increment_retrieval_call_stat("lexical_search")
+    with trace_span("lexical_search"):
+        lexical_hits = lexical_index.search(standalone_question_for_rag, k=HYBRID_BM25_K)
+        lexical_docs = get_documents_by_ids(engine.vectorstore._collection, [chunk_id for chunk_id, _ in lexical_hits])
+    if vector_docs is None:
+        vector_docs = retrieve_documents(engine, standalone_question_for_rag, query_embedding)
+    fused = reciprocal_rank_fusion([vector_docs, lexical_docs], rrf_k=HYBRID_RRF_K)
+    return fused[:engine.retriever_search_kwargs['k']], len(lexical_hits)
+
+def _retrieve_context_for_question(engine, standalone_question_for_rag, query_embedding=None, vector_docs=None):
+    """
+    Mengambil konteks sekali dan menilai relevansinya dari skor fusi hybrid.
+    Konteks dianggap relevan jika skor fusi chunk teratas >= HYBRID_MIN_FUSED_SCORE, yaitu
+    jika chunk itu ditemukan pencarian vektor maupun BM25. Pertanyaan di luar topik (tidak
+    ada istilah yang cocok) ditolak walaupun pencarian vektor selalu memberi hasil.
+    Chunk dipadatkan dengan pack_context (overlap dibuang, dibatasi anggaran token).
+    Mengembalikan (konteks, relevan).
+    """
     retrieved_docs_str = ""
     is_context_relevant_for_question = False
     try:
-        docs = retriever.invoke(standalone_question_for_rag)
-        retrieved_docs_str = docs2str(docs).strip()
-        # st.write(f"DEBUG (Streamlit): Konteks diambil (Panjang: {len(retrieved_docs_str)} chars):\n---\n{retrieved_docs_str[:100]}...\n---")
-        print(f"DEBUG: Konteks yang diambil (Panjang: {len(retrieved_docs_str)}):\n---\n{retrieved_docs_str[:200]}...\n---")
-
-        if retrieved_docs_str and len(retrieved_docs_str) >= MIN_CONTEXT_LENGTH_FOR_ANSWER:
-            question_keywords = get_keywords_from_query(standalone_question_for_rag)
-            context_sample_for_keywords = retrieved_docs_str[:1000].lower()
-            common_keyword_count = 0
-            if question_keywords:
-                for q_keyword in question_keywords:
-                    if q_keyword in context_sample_for_keywords:
-                        common_keyword_count += 1
-            if common_keyword_count >= MIN_KEYWORD_OVERLAP_FOR_RELEVANCE:
+        fused_results, lexical_hit_count = _hybrid_retrieve(
+            engine, standalone_question_for_rag, query_embedding, vector_docs
+        )
+        retrieved_docs = [doc for doc, _ in fused_results]
+        with trace_span("context_packing") as span_tokens:
+            token_budget = get_context_token_budget(standalone_question_for_rag, engine)
+            retrieved_docs_str, context_tokens, passage_count = pack_context(
+                retrieved_docs, token_budget, lambda text: count_llm_tokens(text, engine)
+            )
+            retrieved_docs_str = retrieved_docs_str.strip()
+            span_tokens["context"] = context_tokens
+        log_debug(f"Konteks dipadatkan: {len(retrieved_docs)} chunk -> {passage_count} passage, "
+              f"{context_tokens}/{token_budget} token (tanpa pemadatan: ~{approximate_token_count(docs2str(retrieved_docs))} token)")
+        top_fused_score = fused_results[0][1] if fused_results else 0.0
+        log_debug(f"Konteks yang diambil (Panjang: {len(retrieved_docs_str)}):\n---\n{retrieved_docs_str[:200]}...\n---")
+
+        with trace_span("relevance_gate"):
+            if (retrieved_docs_str and len(retrieved_docs_str) >= MIN_CONTEXT_LENGTH_FOR_ANSWER
+                    and top_fused_score >= HYBRID_MIN_FUSED_SCORE):
                 is_context_relevant_for_question = True
-        # st.write(f"DEBUG (Streamlit): Apakah konteks relevan? {is_context_relevant_for_question}. Overlap kata kunci: {common_keyword_count if 'common_keyword_count' in locals() else 'N/A'}")
-        print(f"DEBUG: Apakah konteks relevan untuk pertanyaan ('{standalone_question_for_rag}')? {is_context_relevant_for_question}. Overlap kata kunci: {common_keyword_count if 'common_keyword_count' in locals() else 'N/A'}")
+        log_debug(f"Apakah konteks relevan untuk pertanyaan ('{standalone_question_for_rag}')? {is_context_relevant_for_question}. Hit BM25: {lexical_hit_count}, skor fusi teratas: {top_fused_score:.4f}")
     except Exception as e:
-        st.error(f"DEBUG: Error saat mengambil dokumen: {e}")
-        print(f"DEBUG: Error saat mengambil dokumen: {e}")
+        _show_error(f"Error saat mengambil dokumen: {e}")
         retrieved_docs_str = ""
 
-    fallback_message = "Maaf, saya tidak memiliki informasi yang cukup untuk menjawab pertanyaan ini."
-    bot_answer = fallback_message
+    return retrieved_docs_str, is_context_relevant_for_question
+
+def _postprocess_answer(bot_answer_raw):
+    """Validasi output LLM: jawaban kosong/terlalu pendek diganti pesan fallback."""
+    bot_answer_stripped = bot_answer_raw.strip()
+    if not bot_answer_stripped or len(bot_answer_stripped) < MIN_VALID_ANSWER_LENGTH:
+        if FALLBACK_MESSAGE.lower() not in bot_answer_stripped.lower():
+            log_debug(f"Post-Proc: Output LLM ('{bot_answer_stripped}') kosong/pendek. Fallback.")
+            return FALLBACK_MESSAGE
+    return bot_answer_stripped
+
+def _should_use_fallback(retrieved_docs_str, is_context_relevant_for_question):
+    if not is_context_relevant_for_question and retrieved_docs_str:
+        log_debug("Konteks diambil tapi dianggap tidak relevan. Menggunakan fallback.")
+        return True
+    if not retrieved_docs_str:
+        log_debug("Tidak ada konteks yang diambil. Menggunakan fallback.")
+        return True
+    log_debug("Konteks relevan, melanjutkan ke LLM untuk jawaban.")
+    return False
 
+def _generate_answer_stream(engine, retrieved_docs_str, standalone_question_for_rag):
+    """
+    Menjalankan answer_generation_chain lewat penjadwal inferensi dan meneruskan chunk-nya.
+    Span prompt_eval = sampai chunk pertama (termasuk antre), generation = sisanya.
+    """
+    prompt_tokens = count_llm_tokens(
+        QA_TEMPLATE_SIMPLE_TEXT.format(context=retrieved_docs_str, question=standalone_question_for_rag), engine
+    )
+    started = time.monotonic()
+    first_chunk_at = None
+    completion_chunks = []
     try:
-        if not is_context_relevant_for_question and retrieved_docs_str:
-            # st.write("DEBUG (Streamlit): Konteks diambil tapi dianggap tidak relevan. Menggunakan fallback.")
-            print("DEBUG: Konteks diambil tapi dianggap tidak relevan. Menggunakan fallback.")
-            bot_answer = fallback_message
-        elif not retrieved_docs_str:
-            # st.write("DEBUG (Streamlit): Tidak ada konteks yang diambil. Menggunakan fallback.")
-            print("DEBUG: Tidak ada konteks yang diambil. Menggunakan fallback.")
-            bot_answer = fallback_message
-        else:
-            # st.write("DEBUG (Streamlit): Konteks relevan, melanjutkan ke LLM untuk jawaban.")
-            print("DEBUG: Konteks relevan, melanjutkan ke LLM untuk jawaban.")
-            bot_answer_raw = answer_generation_chain.invoke({
+        for chunk in engine.inference_scheduler.stream(
+            lambda replica: replica["answer_generation_chain"].stream({
+                "context": retrieved_docs_str,
                 "question": standalone_question_for_rag,
             })
-            # st.write(f"DEBUG (Streamlit): Output mentah dari LLM: '{bot_answer_raw}'")
-            print(f"DEBUG: Output mentah dari answer_generation_chain: '{bot_answer_raw}'")
-            bot_answer_stripped = bot_answer_raw.strip()
-
-            if not bot_answer_stripped or len(bot_answer_stripped) < MIN_VALID_ANSWER_LENGTH:
-                if fallback_message.lower() not in bot_answer_stripped.lower():
-                    # st.write(f"DEBUG (Streamlit) Post-Proc: Output LLM ('{bot_answer_stripped}') kosong/pendek. Fallback.")
-                    print(f"DEBUG Post-Proc: Output LLM ('{bot_answer_stripped}') kosong/pendek. Fallback.")
-                    bot_answer = fallback_message
-                else:
-                    bot_answer = bot_answer_stripped
-            else:
-                bot_answer = bot_answer_stripped
+        ):
+            if first_chunk_at is None:
+                first_chunk_at = time.monotonic()
+                record_span("prompt_eval", first_chunk_at - started, {"prompt": prompt_tokens})
+            completion_chunks.append(chunk)
+            yield chunk
+    finally:
+        if first_chunk_at is None:
+            record_span("prompt_eval", time.monotonic() - started, {"prompt": prompt_tokens})
+            first_chunk_at = time.monotonic()
+        record_span("generation", time.monotonic() - first_chunk_at,
+                    {"completion": count_llm_tokens("".join(completion_chunks), engine)})
+
+def _log_turn(session_uuid, user_input, answer, model_name, outcome):
+    """Menutup trace giliran lalu menyimpan log chat beserta span-nya."""
+    trace = finish_turn_trace(outcome)
+    with trace_span("db_log_write"):
+        utils_db.insert_chat_log(session_uuid, user_input, answer, model_name,
+                                 trace=trace.to_record() if trace else None)
+
+def _reject_busy(engine, error):
+    # Antrean penuh: tolak cepat tanpa mencatat jawaban ke riwayat
+    print(f"WARNING: {error} Statistik penjadwal: {get_inference_scheduler_stats(engine)}")
+    finish_turn_trace("busy")
+    return SERVER_BUSY_MESSAGE
+
+def get_rag_response_streamlit(session_uuid: str, user_input: str):
+    # Engine diambil sekali: jika sistem dimuat ulang di tengah giliran, giliran ini tetap memakai engine lama
+    with _serving_engine() as engine:
+        if engine is None:
+            error_msg = "Sistem RAG belum siap sepenuhnya."
+            _show_error(error_msg)
+            utils_db.insert_chat_log(session_uuid, user_input, error_msg, "N/A - RAG System Error")
+            return error_msg
+        return _get_rag_response(engine, session_uuid, user_input)
+
+def _get_rag_response(engine, session_uuid, user_input):
+    reset_retrieval_call_stats()
+    start_turn_trace(session_uuid)
+    _sync_with_knowledge_base_version(engine)
+    try:
+        standalone_question_for_rag = _contextualize_question(engine, session_uuid, user_input)
+    except ServerBusyError as e:
+        return _reject_busy(engine, e)
+    query_embedding = embed_question(engine, standalone_question_for_rag)
+
+    cached_answer = _lookup_cached_answer(standalone_question_for_rag, query_embedding)
+    if cached_answer is not None:
+        _log_turn(session_uuid, user_input, cached_answer, _get_model_name_for_log(), "cache_hit")
+        return cached_answer
+
+    retrieved_docs_str, is_context_relevant_for_question = _retrieve_context_for_question(
+        engine, standalone_question_for_rag, query_embedding
+    )
+
+    bot_answer = FALLBACK_MESSAGE
+    outcome = "fallback"
+    try:
+        if not _should_use_fallback(retrieved_docs_str, is_context_relevant_for_question):
+            bot_answer_raw = "".join(_generate_answer_stream(engine, retrieved_docs_str, standalone_question_for_rag))
+            log_debug(f"Output mentah dari answer_generation_chain: '{bot_answer_raw}'")
+            bot_answer = _postprocess_answer(bot_answer_raw)
+            _store_cached_answer(standalone_question_for_rag, query_embedding, bot_answer)
+            outcome = "answered"
+    except ServerBusyError as e:
+        return _reject_busy(engine, e)
     except Exception as e:
-        st.error(f"Error saat menjalankan answer generation chain: {e}")
-        print(f"Error saat menjalankan answer generation chain: {e}")
-        bot_answer = fallback_message
-        utils_db.insert_chat_log(session_uuid, user_input, f"Error: {str(e)} | Fallback: {bot_answer}",
-                                 os.path.basename(LLM_MODEL_PATH) if LLM_MODEL_PATH else "LlamaCpp_Unknown")
+        _show_error(f"Error saat menjalankan answer generation chain: {e}")
+        bot_answer = FALLBACK_MESSAGE
+        _log_turn(session_uuid, user_input, f"Error: {str(e)} | Fallback: {bot_answer}",
+                  _get_model_name_for_log(), "error")
         return bot_answer
 
-    model_name_for_log = os.path.basename(LLM_MODEL_PATH) if LLM_MODEL_PATH else "LlamaCpp_Unknown"
-    utils_db.insert_chat_log(session_uuid, user_input, bot_answer, model_name_for_log)
+    log_debug(f"Statistik retrieval giliran ini: {get_retrieval_call_stats()}")
+    log_debug(f"Statistik cache embedding MMR: {mmr_embedding_cache.get_stats()}")
+    log_debug(f"Statistik prompt cache: {get_prompt_cache_stats(engine)}")
+    log_debug(f"Statistik penjadwal inferensi: {get_inference_scheduler_stats(engine)}")
+    _log_turn(session_uuid, user_input, bot_answer, _get_model_name_for_log(), outcome)
     
-    return bot_answer
\ No newline at end of file
+    return bot_answer
+
+def stream_rag_response_streamlit(session_uuid: str, user_input: str):
+    """
+    Varian streaming dari get_rag_response_streamlit untuk st.write_stream.
+    Token dari LLM di-yield begitu tersedia. Token awal ditahan sampai panjangnya
+    mencapai MIN_VALID_ANSWER_LENGTH agar jawaban yang terlalu pendek tetap bisa
+    diganti pesan fallback. Post-processing dan insert_chat_log dijalankan
+    setelah stream selesai.
+    """
+    with _serving_engine() as engine:
+        if engine is None:
+            error_msg = "Sistem RAG belum siap sepenuhnya."
+            print(f"ERROR: {error_msg}")
+            utils_db.insert_chat_log(session_uuid, user_input, error_msg, "N/A - RAG System Error")
+            yield error_msg
+            return
+        yield from _stream_rag_response(engine, session_uuid, user_input)
+
+def _stream_rag_response(engine, session_uuid, user_input):
+    reset_retrieval_call_stats()
+    start_turn_trace(session_uuid)
+    _sync_with_knowledge_base_version(engine)
+    try:
+        standalone_question_for_rag = _contextualize_question(engine, session_uuid, user_input)
+    except ServerBusyError as e:
+        yield _reject_busy(engine, e)
+        return
+    query_embedding = embed_question(engine, standalone_question_for_rag)
+
+    cached_answer = _lookup_cached_answer(standalone_question_for_rag, query_embedding)
+    if cached_answer is not None:
+        _log_turn(session_uuid, user_input, cached_answer, _get_model_name_for_log(), "cache_hit")
+        yield cached_answer
+        return
+
+    retrieved_docs_str, is_context_relevant_for_question = _retrieve_context_for_question(
+        engine, standalone_question_for_rag, query_embedding
+    )
+
+    if _should_use_fallback(retrieved_docs_str, is_context_relevant_for_question):
+        _log_turn(session_uuid, user_input, FALLBACK_MESSAGE, _get_model_name_for_log(), "fallback")
+        yield FALLBACK_MESSAGE
+        return
+
+    streamed_chunks = []
+    pending_prefix = ""
+    prefix_released = False
+    try:
+        for chunk in _generate_answer_stream(engine, retrieved_docs_str, standalone_question_for_rag):
+            streamed_chunks.append(chunk)
+            if prefix_released:
+                yield chunk
+                continue
+            pending_prefix += chunk
+            if len(pending_prefix.strip()) >= MIN_VALID_ANSWER_LENGTH:
+                prefix_released = True
+                yield pending_prefix.lstrip()
+    except ServerBusyError as e:
+        yield _reject_busy(engine, e)
+        return
+    except Exception as e:
+        print(f"Error saat streaming answer generation chain: {e}")
+        _log_turn(session_uuid, user_input, f"Error: {str(e)} | Fallback: {FALLBACK_MESSAGE}",
+                  _get_model_name_for_log(), "error")
+        if not prefix_released:
+            yield FALLBACK_MESSAGE
+        return
+
+    bot_answer_raw = "".join(streamed_chunks)
+    log_debug(f"Output mentah dari answer_generation_chain (stream): '{bot_answer_raw}'")
+    bot_answer = _postprocess_answer(bot_answer_raw)
+    _store_cached_answer(standalone_question_for_rag, query_embedding, bot_answer)
+    if not prefix_released:
+        # Stream selesai sebelum prefix dilepas: tampilkan hasil post-processing.
+        yield bot_answer
+
+    log_debug(f"Statistik retrieval giliran ini: {get_retrieval_call_stats()}")
+    log_debug(f"Statistik cache embedding MMR: {mmr_embedding_cache.get_stats()}")
+    log_debug(f"Statistik prompt cache: {get_prompt_cache_stats(engine)}")
+    log_debug(f"Statistik penjadwal inferensi: {get_inference_scheduler_stats(engine)}")
+    _log_turn(session_uuid, user_input, bot_answer, _get_model_name_for_log(), "answered")
+
+# --- Mode batch (lihat batch_qa.py) ---
+# Langkah yang sama dengan get_rag_response_streamlit, tetapi pertanyaan dari satu batch
+# di-embed dalam satu panggilan dan dicari dalam satu query ke koleksi Chroma (atau indeks ringkas).
+def embed_questions(engine, questions):
+    """Embedding banyak pertanyaan sekaligus (None jika gagal; pemanggil kembali ke jalur per pertanyaan)."""
+    if not questions:
+        return []
+    try:
+        with trace_span("query_embedding") as span_tokens:
+            span_tokens["questions"] = len(questions)
+            return engine.embedding_function.embed_documents(list(questions))
+    except Exception as e:
+        print(f"Error saat membuat embedding batch pertanyaan: {e}")
+        return None
+
+def retrieve_contexts_bulk(engine, questions, query_embeddings=None):
+    """
+    Mengambil konteks untuk banyak pertanyaan: pencarian vektor dalam satu query, lalu
+    fusi BM25, pemadatan, dan gerbang relevansi per pertanyaan. Mengembalikan list (konteks, relevan).
+    """
+    vector_results = [None] * len(questions)
+    if query_embeddings is not None:
+        _increment_retrieval_call_stat("vector_search")
+        try:
+            with trace_span("vector_search") as span_tokens:
+                span_tokens["questions"] = len(questions)
+                vector_results = search_vectorstore(
+                    engine.vectorstore, query_embeddings, engine.retriever_search_type, engine.retriever_search_kwargs
+                )
+        except Exception as e:
+            print(f"Error saat pencarian vektor batch, kembali ke pencarian per pertanyaan: {e}")
+    return [
+        _retrieve_context_for_question(
+            engine, question, query_embeddings[index] if query_embeddings is not None else None,
+            vector_docs=vector_results[index]
+        )
+        for index, question in enumerate(questions)
+    ]
+
+def answer_from_context(engine, standalone_question, retrieved_docs_str, is_context_relevant):
+    """
+    Menghasilkan jawaban akhir untuk konteks yang sudah diambil.
+    Mengembalikan (jawaban, outcome, waktu dalam ms: prompt_eval termasuk antre, generation).
+    """
+    if _should_use_fallback(retrieved_docs_str, is_context_relevant):
+        return FALLBACK_MESSAGE, "fallback", {}
+    started = time.monotonic()
+    first_chunk_at = None
+    chunks = []
+    for chunk in _generate_answer_stream(engine, retrieved_docs_str, standalone_question):
+        if first_chunk_at is None:
+            first_chunk_at = time.monotonic()
+        chunks.append(chunk)
+    finished = time.monotonic()
+    first_chunk_at = first_chunk_at or finished
+    timings = {
+        "prompt_eval_ms": round((first_chunk_at - started) * 1000, 2),
+        "generation_ms": round((finished - first_chunk_at) * 1000, 2),
+    }
+    return _postprocess_answer("".join(chunks)), "answered", timings
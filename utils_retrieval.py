@@ -0,0 +1,491 @@
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter, OrderedDict, defaultdict
+
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+# Jumlah baris cache embedding ternormalisasi untuk kandidat MMR (1024 dimensi = 4 KB/baris); 0 = nonaktif
+MMR_EMBEDDING_CACHE_ROWS = int(os.getenv("MMR_EMBEDDING_CACHE_ROWS", 8192))
+
+DEFAULT_RETRIEVER_SEARCH_TYPE = "mmr"
+DEFAULT_RETRIEVER_SEARCH_KWARGS = {'k': 5, 'fetch_k': 10, 'lambda_mult': 0.7}
+RETRIEVER_SEARCH_TYPES = ("mmr", "similarity")
+
+# Kata umum Bahasa Indonesia yang tidak membantu pencarian leksikal
+INDONESIAN_STOPWORDS = {
+    "yang", "dan", "di", "ke", "dari", "untuk", "dengan", "pada", "adalah", "ini", "itu",
+    "apa", "apakah", "bagaimana", "berapa", "mengapa", "kenapa", "dalam", "atau", "juga",
+    "akan", "tidak", "ada", "saya", "anda", "kami", "kita", "bisa", "dapat", "serta", "oleh",
+    "sebagai", "karena", "jika", "agar", "harus", "lebih", "sangat", "seperti", "tentang",
+    "the", "and", "of", "to", "in", "is",
+}
+
+
+def tokenize(text):
+    if not text:
+        return []
+    return [
+        token for token in re.findall(r"\w+", text.lower())
+        if len(token) > 1 and token not in INDONESIAN_STOPWORDS
+    ]
+
+
+class BM25Index:
+    """
+    Indeks BM25 inkremental atas chunk di vector store, dengan kunci ID chunk.
+    Hanya menyimpan posting list dan panjang dokumen; teks chunk tetap diambil
+    dari Chroma. Disimpan sebagai JSON dan dimuat ulang jika file berubah
+    (misalnya ditulis oleh worker ingestion di proses lain).
+    """
+
+    def __init__(self, path=None, k1=1.5, b=0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        self._postings = defaultdict(dict)  # term -> {chunk_id: tf}
+        self._doc_terms = {}  # chunk_id -> {term: tf}
+        self._doc_lengths = {}  # chunk_id -> jumlah token
+        self._total_length = 0
+        self._loaded_mtime = None
+
+    def __len__(self):
+        return len(self._doc_terms)
+
+    def add(self, chunk_ids, texts):
+        with self._lock:
+            for chunk_id, text in zip(chunk_ids, texts):
+                self._remove_one(chunk_id)
+                term_counts = Counter(tokenize(text))
+                self._index_one(chunk_id, dict(term_counts))
+
+    def _index_one(self, chunk_id, term_counts):
+        self._doc_terms[chunk_id] = term_counts
+        doc_length = sum(term_counts.values())
+        self._doc_lengths[chunk_id] = doc_length
+        self._total_length += doc_length
+        for term, tf in term_counts.items():
+            self._postings[term][chunk_id] = tf
+
+    def remove(self, chunk_ids):
+        with self._lock:
+            for chunk_id in chunk_ids:
+                self._remove_one(chunk_id)
+
+    def _remove_one(self, chunk_id):
+        term_counts = self._doc_terms.pop(chunk_id, None)
+        if term_counts is None:
+            return
+        self._total_length -= self._doc_lengths.pop(chunk_id)
+        for term in term_counts:
+            posting = self._postings.get(term)
+            if posting is not None:
+                posting.pop(chunk_id, None)
+                if not posting:
+                    del self._postings[term]
+
+    def search(self, query, k=10):
+        """Mengembalikan list (chunk_id, skor BM25) terurut menurun."""
+        query_terms = set(tokenize(query))
+        with self._lock:
+            doc_count = len(self._doc_terms)
+            if not query_terms or doc_count == 0:
+                return []
+            avg_length = self._total_length / doc_count
+            scores = defaultdict(float)
+            for term in query_terms:
+                posting = self._postings.get(term)
+                if not posting:
+                    continue
+                idf = math.log(1 + (doc_count - len(posting) + 0.5) / (len(posting) + 0.5))
+                for chunk_id, tf in posting.items():
+                    doc_length = self._doc_lengths[chunk_id]
+                    norm = tf + self.k1 * (1 - self.b + self.b * doc_length / avg_length)
+                    scores[chunk_id] += idf * tf * (self.k1 + 1) / norm
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            data = {"doc_terms": self._doc_terms}
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+            self._loaded_mtime = os.stat(self.path).st_mtime_ns
+
+    def load(self):
+        """Memuat indeks dari file. Mengembalikan False jika file belum ada."""
+        if not self.path or not os.path.exists(self.path):
+            return False
+        with open(self.path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        with self._lock:
+            self._postings = defaultdict(dict)
+            self._doc_terms = {}
+            self._doc_lengths = {}
+            self._total_length = 0
+            for chunk_id, term_counts in data["doc_terms"].items():
+                self._index_one(chunk_id, term_counts)
+            self._loaded_mtime = os.stat(self.path).st_mtime_ns
+        return True
+
+    def reload_if_changed(self):
+        if not self.path:
+            return False
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return False
+        if mtime == self._loaded_mtime:
+            return False
+        return self.load()
+
+    def rebuild_from_collection(self, collection, page_size=5000):
+        """Membangun ulang indeks dari seluruh isi koleksi Chroma (untuk koleksi lama)."""
+        offset = 0
+        while True:
+            page = collection.get(include=["documents"], limit=page_size, offset=offset)
+            if not page["ids"]:
+                break
+            self.add(page["ids"], page["documents"])
+            offset += len(page["ids"])
+        print(f"Indeks BM25 dibangun dari koleksi: {len(self)} chunk.")
+
+
+def get_documents_by_ids(collection, chunk_ids):
+    """Mengambil Document LangChain dari koleksi Chroma, dengan urutan mengikuti chunk_ids."""
+    from langchain_core.documents import Document
+    if not chunk_ids:
+        return []
+    result = collection.get(ids=list(chunk_ids), include=["documents", "metadatas"])
+    by_id = {
+        chunk_id: Document(page_content=text, metadata=metadata or {}, id=chunk_id)
+        for chunk_id, text, metadata in zip(result["ids"], result["documents"], result["metadatas"])
+    }
+    return [by_id[chunk_id] for chunk_id in chunk_ids if chunk_id in by_id]
+
+
+def normalize_rows(matrix):
+    """Salinan float32 kontigu dengan setiap baris dinormalisasi ke panjang 1 (baris nol tetap nol)."""
+    import numpy as np
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+_MMR_TIE_TOLERANCE = 1e-5
+
+
+def maximal_marginal_relevance(query_embedding, candidate_embeddings, k=4, lambda_mult=0.5, normalized=False):
+    """
+    MMR tervektorisasi dengan hasil yang sama seperti maximal_marginal_relevance LangChain
+    (indeks kandidat terpilih, sesuai urutan pemilihan). Kemiripan kosinus dihitung dengan
+    perkalian matriks atas kandidat yang sudah dinormalisasi, dan kemiripan maksimum ke
+    kandidat terpilih diperbarui inkremental (satu matvec per langkah), jadi biayanya
+    O(k x fetch_k x dim) tanpa loop Python per kandidat.
+    """
+    import numpy as np
+    candidates = np.ascontiguousarray(candidate_embeddings, dtype=np.float32)
+    if candidates.ndim != 2 or not len(candidates):
+        return []
+    k = min(k, len(candidates))
+    if k <= 0:
+        return []
+    if not normalized:
+        candidates = normalize_rows(candidates)
+    query = np.asarray(query_embedding, dtype=np.float32).ravel()
+    query = query / max(float(np.linalg.norm(query)), 1e-12)
+    query_similarity = candidates @ query
+    max_selected_similarity = np.full(len(candidates), -np.inf, dtype=np.float32)
+    selected = []
+    # Kandidat pertama dipilih murni dari kemiripan ke query
+    scores = query_similarity.copy()
+    for _ in range(k):
+        # Skor seri dipecah ke indeks terkecil seperti LangChain; perkalian matriks float32 bisa
+        # memberi hasil yang beda di bit terakhir untuk baris yang identik, jadi seri memakai toleransi
+        index = int(np.flatnonzero(scores >= scores.max() - _MMR_TIE_TOLERANCE)[0])
+        selected.append(index)
+        np.maximum(max_selected_similarity, candidates @ candidates[index], out=max_selected_similarity)
+        scores = lambda_mult * query_similarity - (1 - lambda_mult) * max_selected_similarity
+        scores[selected] = -np.inf
+    return selected
+
+
+class NormalizedEmbeddingCache:
+    """
+    Cache LRU embedding chunk yang sudah dinormalisasi, disimpan dalam satu matriks float32
+    kontigu dengan kunci ID chunk. Kandidat MMR diambil dari sini alih-alih dari Chroma pada
+    setiap query. ID chunk diturunkan dari isi chunk (utils_ingest.make_chunk_ids), jadi
+    embedding untuk satu ID tidak berubah; chunk yang sudah dihapus akhirnya tersingkir oleh LRU.
+    """
+
+    def __init__(self, max_rows=MMR_EMBEDDING_CACHE_ROWS):
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        self._matrix = None
+        self._slots = OrderedDict()  # chunk_id -> baris di _matrix
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get_matrix(self, collection, chunk_ids):
+        """
+        Mengembalikan (daftar ID unik yang ditemukan, matriks ternormalisasi dengan urutan yang sama).
+        ID yang belum ada di cache diambil dari koleksi dalam satu panggilan get.
+        """
+        import numpy as np
+        unique_ids = list(dict.fromkeys(chunk_ids))
+        vectors = {}
+        with self._lock:
+            cached_ids = [chunk_id for chunk_id in unique_ids if chunk_id in self._slots]
+            if cached_ids:
+                rows = self._matrix[[self._slots[chunk_id] for chunk_id in cached_ids]]
+                for chunk_id, row in zip(cached_ids, rows):
+                    self._slots.move_to_end(chunk_id)
+                    vectors[chunk_id] = row
+            self._stats["hits"] += len(cached_ids)
+            self._stats["misses"] += len(unique_ids) - len(cached_ids)
+        missing = [chunk_id for chunk_id in unique_ids if chunk_id not in vectors]
+        if missing:
+            result = collection.get(ids=missing, include=["embeddings"])
+            if len(result["ids"]):
+                fetched = normalize_rows(result["embeddings"])
+                with self._lock:
+                    for chunk_id, row in zip(result["ids"], fetched):
+                        vectors[chunk_id] = row
+                        self._store(chunk_id, row)
+        found_ids = [chunk_id for chunk_id in unique_ids if chunk_id in vectors]
+        if not found_ids:
+            return [], np.empty((0, 0), dtype=np.float32)
+        return found_ids, np.stack([vectors[chunk_id] for chunk_id in found_ids])
+
+    def _store(self, chunk_id, row):
+        import numpy as np
+        if self.max_rows <= 0:
+            return
+        if self._matrix is None or self._matrix.shape[1] != len(row):
+            # Dimensi berubah (model embedding lain): mulai dari cache kosong
+            self._matrix = np.zeros((self.max_rows, len(row)), dtype=np.float32)
+            self._slots.clear()
+        if chunk_id in self._slots:
+            slot = self._slots[chunk_id]
+            self._slots.move_to_end(chunk_id)
+        elif len(self._slots) >= self.max_rows:
+            _, slot = self._slots.popitem(last=False)
+            self._slots[chunk_id] = slot
+            self._stats["evictions"] += 1
+        else:
+            slot = len(self._slots)
+            self._slots[chunk_id] = slot
+        self._matrix[slot] = row
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self._stats, rows=len(self._slots), max_rows=self.max_rows)
+
+
+mmr_embedding_cache = NormalizedEmbeddingCache()
+
+
+def _documents_from_query_result(result, index):
+    from langchain_core.documents import Document
+    return [
+        Document(page_content=text, metadata=metadata or {}, id=chunk_id)
+        for chunk_id, text, metadata in zip(result["ids"][index], result["documents"][index], result["metadatas"][index])
+    ]
+
+
+def search_collection_by_vectors(collection, query_embeddings, search_type, search_kwargs):
+    """
+    Pencarian vektor untuk banyak pertanyaan dalam satu query ke koleksi Chroma.
+    Hasilnya sama dengan similarity_search_by_vector / max_marginal_relevance_search_by_vector
+    per pertanyaan: list berisi list Document untuk setiap embedding.
+    Untuk MMR, query hanya mengambil ID fetch_k kandidat; embedding kandidat diambil dari
+    mmr_embedding_cache dan teks/metadata hanya dibaca untuk k chunk yang terpilih, sehingga
+    fetch_k besar (100+) tidak menambah banyak latensi.
+    """
+    import numpy as np
+    if not len(query_embeddings):
+        return []
+    k = search_kwargs['k']
+    embeddings = np.asarray(query_embeddings, dtype=np.float32)
+    if search_type != "mmr":
+        result = collection.query(query_embeddings=embeddings, n_results=k, include=["documents", "metadatas"])
+        return [_documents_from_query_result(result, index)[:k] for index in range(len(embeddings))]
+
+    result = collection.query(query_embeddings=embeddings, n_results=search_kwargs.get('fetch_k', 20), include=[])
+    candidate_ids = result["ids"]
+    found_ids, matrix = mmr_embedding_cache.get_matrix(
+        collection, [chunk_id for ids in candidate_ids for chunk_id in ids]
+    )
+    position = {chunk_id: row for row, chunk_id in enumerate(found_ids)}
+    selected_ids = []
+    for query_embedding, ids in zip(query_embeddings, candidate_ids):
+        ids = [chunk_id for chunk_id in ids if chunk_id in position]
+        if not ids:
+            selected_ids.append([])
+            continue
+        selected = maximal_marginal_relevance(
+            query_embedding, matrix[[position[chunk_id] for chunk_id in ids]],
+            k=k, lambda_mult=search_kwargs.get('lambda_mult', 0.5), normalized=True
+        )
+        # Urutan peringkat kandidat, sama seperti max_marginal_relevance_search_by_vector di langchain_chroma
+        selected_ids.append([ids[i] for i in sorted(selected)])
+    docs_by_id = {
+        doc.id: doc
+        for doc in get_documents_by_ids(collection, list(dict.fromkeys(i for ids in selected_ids for i in ids)))
+    }
+    return [[docs_by_id[chunk_id] for chunk_id in ids if chunk_id in docs_by_id] for ids in selected_ids]
+
+
+def search_vectorstore(vectorstore, query_embeddings, search_type, search_kwargs):
+    """
+    Pencarian vektor lewat backend aktif: indeks ringkas (utils_vector_index.CompactVectorStore)
+    jika vector store menyediakan search_by_vectors, selain itu langsung ke koleksi Chroma.
+    """
+    search_by_vectors = getattr(vectorstore, "search_by_vectors", None)
+    if search_by_vectors is not None:
+        return search_by_vectors(query_embeddings, search_type, search_kwargs)
+    return search_collection_by_vectors(vectorstore._collection, query_embeddings, search_type, search_kwargs)
+
+
+def _fusion_key(doc):
+    return hashlib.sha256(doc.page_content.encode("utf-8")).hexdigest()
+
+
+def reciprocal_rank_fusion(ranked_doc_lists, rrf_k=60):
+    """
+    Reciprocal-rank fusion: skor dokumen = jumlah 1 / (rrf_k + peringkat) di setiap daftar.
+    Dokumen dengan teks identik digabung. Mengembalikan list (Document, skor) terurut menurun.
+    """
+    scores = defaultdict(float)
+    docs_by_key = {}
+    for docs in ranked_doc_lists:
+        for rank, doc in enumerate(docs, start=1):
+            key = _fusion_key(doc)
+            docs_by_key.setdefault(key, doc)
+            scores[key] += 1.0 / (rrf_k + rank)
+    ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    return [(docs_by_key[key], score) for key, score in ranked]
+
+
+def _overlap_length(left, right, min_overlap):
+    """Panjang sufiks terpanjang dari left yang sama dengan prefiks right (0 jika < min_overlap)."""
+    max_length = min(len(left), len(right))
+    for length in range(max_length, min_overlap - 1, -1):
+        if left.endswith(right[:length]):
+            return length
+    return 0
+
+
+def merge_overlapping_chunks(docs, min_overlap=20):
+    """
+    Menggabungkan chunk bertetangga dari sumber yang sama: teks overlap (chunk_overlap
+    splitter) hanya disimpan sekali, dan chunk yang seluruhnya termuat di chunk lain dibuang.
+    Mengembalikan list passage (sumber, teks) sesuai urutan peringkat kemunculan pertama.
+    """
+    passages = []  # [source, text]
+    for doc in docs:
+        source = (doc.metadata or {}).get("source")
+        text = doc.page_content.strip()
+        if not text:
+            continue
+        merged = False
+        for passage in passages:
+            if passage[0] != source:
+                continue
+            if text in passage[1]:
+                merged = True
+                break
+            if passage[1] in text:
+                passage[1] = text
+                merged = True
+                break
+            overlap = _overlap_length(passage[1], text, min_overlap)
+            if overlap:
+                passage[1] = passage[1] + text[overlap:]
+                merged = True
+                break
+            overlap = _overlap_length(text, passage[1], min_overlap)
+            if overlap:
+                passage[1] = text + passage[1][overlap:]
+                merged = True
+                break
+        if not merged:
+            passages.append([source, text])
+    return [(source, text) for source, text in passages]
+
+
+def pack_context(docs, token_budget, count_tokens, min_overlap=20):
+    """
+    Menyusun string konteks dari dokumen terurut peringkat: overlap antar chunk
+    dihapus, lalu passage dimasukkan sampai token_budget (dihitung dengan count_tokens)
+    habis. Passage yang tidak muat dipotong ke sisa anggaran.
+    Mengembalikan (konteks, jumlah token, jumlah passage).
+    """
+    separator = "\n\n"
+    separator_tokens = count_tokens(separator)
+    packed = []
+    used_tokens = 0
+    for _, text in merge_overlapping_chunks(docs, min_overlap):
+        extra = separator_tokens if packed else 0
+        remaining = token_budget - used_tokens - extra
+        if remaining <= 0:
+            break
+        text_tokens = count_tokens(text)
+        if text_tokens > remaining:
+            # Potong berdasarkan proporsi karakter, lalu sesuaikan dengan hitungan token asli
+            cut = int(len(text) * remaining / text_tokens)
+            while cut > 0 and count_tokens(text[:cut]) > remaining:
+                cut = int(cut * 0.9)
+            if cut <= 0:
+                break
+            text = text[:cut].rstrip()
+            text_tokens = count_tokens(text)
+        packed.append(text)
+        used_tokens += text_tokens + extra
+    return separator.join(packed), used_tokens, len(packed)
+
+
+def load_retriever_config(path):
+    """
+    Memuat pengaturan retriever dari file JSON {"search_type": ..., "search_kwargs": {...}}
+    (misalnya hasil eval_retriever.py --write-config). Tanpa file, dipakai nilai default.
+    Mengembalikan (search_type, search_kwargs).
+    """
+    search_type = DEFAULT_RETRIEVER_SEARCH_TYPE
+    search_kwargs = dict(DEFAULT_RETRIEVER_SEARCH_KWARGS)
+    if not path or not os.path.exists(path):
+        return search_type, search_kwargs
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Gagal membaca konfigurasi retriever {path}: {e}. Memakai default.")
+        return search_type, search_kwargs
+    if data.get("search_type") not in RETRIEVER_SEARCH_TYPES:
+        print(f"search_type '{data.get('search_type')}' di {path} tidak dikenal. Memakai default.")
+        return search_type, search_kwargs
+    search_type = data["search_type"]
+    search_kwargs.update(data.get("search_kwargs") or {})
+    if search_type == "similarity":
+        # fetch_k/lambda_mult hanya berlaku untuk MMR
+        search_kwargs = {'k': search_kwargs['k']}
+    print(f"Konfigurasi retriever dimuat dari {path}: {search_type} {search_kwargs}")
+    return search_type, search_kwargs
+
+
+def save_retriever_config(path, search_type, search_kwargs, metrics=None):
+    data = {"search_type": search_type, "search_kwargs": search_kwargs}
+    if metrics:
+        data["metrics"] = metrics
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
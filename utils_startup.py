@@ -0,0 +1,76 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class StartupTracker:
+    """
+    Menjalankan tahap-tahap startup di thread terpisah dan mencatat status per komponen
+    (pending, loading, ready, failed, skipped) beserta durasi dan pesan error.
+    Sebuah tahap dapat menunggu tahap lain selesai lewat depends_on; fungsi tahap
+    sendiri yang memeriksa apakah prasyaratnya berhasil (dan raise jika tidak).
+    Fungsi tahap boleh mengembalikan string keterangan, atau StageSkipped untuk
+    komponen opsional yang tidak dikonfigurasi.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._components = OrderedDict()
+        self._done_events = {}
+        self.started_at = time.monotonic()
+
+    def run_stage(self, name, fn, depends_on=()):
+        with self._lock:
+            self._components[name] = {"state": "pending", "detail": None, "error": None, "seconds": None}
+            self._done_events[name] = threading.Event()
+        thread = threading.Thread(target=self._run, args=(name, fn, tuple(depends_on)),
+                                  name=f"startup-{name}", daemon=True)
+        thread.start()
+
+    def _run(self, name, fn, depends_on):
+        for dependency in depends_on:
+            self._done_events[dependency].wait()
+        self._update(name, state="loading")
+        started = time.monotonic()
+        try:
+            result = fn()
+            if isinstance(result, StageSkipped):
+                self._update(name, state="skipped", detail=str(result))
+            else:
+                self._update(name, state="ready", detail=result)
+        except Exception as e:
+            print(f"Startup: tahap '{name}' gagal: {e}")
+            self._update(name, state="failed", error=str(e))
+        finally:
+            self._update(name, seconds=round(time.monotonic() - started, 2))
+            self._done_events[name].set()
+        print(f"Startup: tahap '{name}' {self._components[name]['state']} "
+              f"({self._components[name]['seconds']} detik).")
+
+    def _update(self, name, **fields):
+        with self._lock:
+            self._components[name].update(fields)
+
+    def wait(self, names=None, timeout=None):
+        """Menunggu tahap tertentu (default: semua) selesai. Mengembalikan False jika timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for name in names or list(self._done_events):
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if not self._done_events[name].wait(remaining):
+                return False
+        return True
+
+    def is_finished(self):
+        return all(event.is_set() for event in self._done_events.values())
+
+    def is_ready(self, names):
+        with self._lock:
+            return all(self._components.get(name, {}).get("state") == "ready" for name in names)
+
+    def status(self):
+        with self._lock:
+            return {name: dict(component) for name, component in self._components.items()}
+
+
+class StageSkipped(str):
+    """Hasil tahap untuk komponen opsional yang sengaja tidak dimuat."""
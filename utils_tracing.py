@@ -0,0 +1,223 @@
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+# Level log untuk pesan diagnostik di jalur chat: DEBUG, INFO, WARNING, ERROR
+RAG_LOG_LEVEL = os.getenv("RAG_LOG_LEVEL", "INFO").upper()
+# Port endpoint metrik Prometheus (/metrics); 0 = nonaktif
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+METRICS_HOST = os.getenv("METRICS_HOST", "0.0.0.0")
+# Batas histogram durasi span (detik)
+SPAN_DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+_LOG_LEVELS = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "ERROR": 40}
+
+
+def is_debug_enabled():
+    return _LOG_LEVELS.get(RAG_LOG_LEVEL, 20) <= _LOG_LEVELS["DEBUG"]
+
+
+def log_debug(message):
+    """Print pesan diagnostik hanya jika RAG_LOG_LEVEL=DEBUG."""
+    if is_debug_enabled():
+        print(f"DEBUG: {message}")
+
+
+class MetricsRegistry:
+    """Histogram durasi span dan counter token/giliran, diekspor dalam format teks Prometheus."""
+
+    def __init__(self, buckets=SPAN_DURATION_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._span_buckets = defaultdict(lambda: [0] * len(self.buckets))
+        self._span_sum = defaultdict(float)
+        self._span_count = defaultdict(int)
+        self._span_tokens = defaultdict(int)  # (span, jenis) -> jumlah
+        self._turns = defaultdict(int)  # outcome -> jumlah
+        self._turn_seconds_sum = 0.0
+
+    def observe_span(self, name, seconds, tokens=None):
+        with self._lock:
+            counts = self._span_buckets[name]
+            for index, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    counts[index] += 1
+            self._span_sum[name] += seconds
+            self._span_count[name] += 1
+            for kind, value in (tokens or {}).items():
+                self._span_tokens[(name, kind)] += value
+
+    def observe_turn(self, outcome, seconds):
+        with self._lock:
+            self._turns[outcome] += 1
+            self._turn_seconds_sum += seconds
+
+    def render(self):
+        lines = [
+            "# HELP rag_span_duration_seconds Durasi span per giliran chat.",
+            "# TYPE rag_span_duration_seconds histogram",
+        ]
+        with self._lock:
+            for name in sorted(self._span_count):
+                for bound, count in zip(self.buckets, self._span_buckets[name]):
+                    lines.append(f'rag_span_duration_seconds_bucket{{span="{name}",le="{bound}"}} {count}')
+                lines.append(f'rag_span_duration_seconds_bucket{{span="{name}",le="+Inf"}} {self._span_count[name]}')
+                lines.append(f'rag_span_duration_seconds_sum{{span="{name}"}} {self._span_sum[name]:.6f}')
+                lines.append(f'rag_span_duration_seconds_count{{span="{name}"}} {self._span_count[name]}')
+            lines.append("# HELP rag_span_tokens_total Token yang diproses per span.")
+            lines.append("# TYPE rag_span_tokens_total counter")
+            for (name, kind), value in sorted(self._span_tokens.items()):
+                lines.append(f'rag_span_tokens_total{{span="{name}",kind="{kind}"}} {value}')
+            lines.append("# HELP rag_turns_total Giliran chat per hasil.")
+            lines.append("# TYPE rag_turns_total counter")
+            for outcome, value in sorted(self._turns.items()):
+                lines.append(f'rag_turns_total{{outcome="{outcome}"}} {value}')
+            lines.append("# HELP rag_turn_duration_seconds_sum Total durasi giliran chat.")
+            lines.append("# TYPE rag_turn_duration_seconds_sum counter")
+            lines.append(f"rag_turn_duration_seconds_sum {self._turn_seconds_sum:.6f}")
+        return "\n".join(lines) + "\n"
+
+
+metrics_registry = MetricsRegistry()
+
+
+class TurnTrace:
+    """Kumpulan span (nama, durasi, token) untuk satu giliran chat."""
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.started = time.monotonic()
+        self.spans = []
+        self.outcome = None
+
+    def add_span(self, name, seconds, tokens=None):
+        span = {"name": name, "duration_ms": round(seconds * 1000, 2)}
+        if tokens:
+            span["tokens"] = dict(tokens)
+        self.spans.append(span)
+        metrics_registry.observe_span(name, seconds, tokens)
+
+    def total_ms(self):
+        return round((time.monotonic() - self.started) * 1000, 2)
+
+    def to_record(self):
+        """Data untuk disimpan bersama chat_logs (lihat utils_db.insert_chat_log)."""
+        return {"outcome": self.outcome, "total_ms": self.total_ms(), "spans": json.dumps(self.spans)}
+
+    def summary(self):
+        return ", ".join(f"{span['name']}={span['duration_ms']}ms" for span in self.spans)
+
+
+_trace_state = threading.local()
+
+
+def start_turn_trace(session_id):
+    trace = TurnTrace(session_id)
+    _trace_state.trace = trace
+    return trace
+
+
+def get_current_trace():
+    return getattr(_trace_state, "trace", None)
+
+
+def finish_turn_trace(outcome):
+    """Menutup trace giliran aktif dan mencatat metrik giliran. Mengembalikan trace atau None."""
+    trace = get_current_trace()
+    if trace is None:
+        return None
+    _trace_state.trace = None
+    trace.outcome = outcome
+    metrics_registry.observe_turn(outcome, time.monotonic() - trace.started)
+    log_debug(f"Trace giliran ({outcome}, {trace.total_ms()}ms): {trace.summary()}")
+    return trace
+
+
+@contextmanager
+def trace_span(name):
+    """
+    Mengukur satu span di trace giliran aktif (tanpa trace aktif, durasi tetap masuk metrik).
+    Blok dapat mengisi dict yang di-yield dengan jumlah token, misalnya {"prompt": 120}.
+    """
+    tokens = {}
+    started = time.monotonic()
+    try:
+        yield tokens
+    finally:
+        elapsed = time.monotonic() - started
+        trace = get_current_trace()
+        if trace is not None:
+            trace.add_span(name, elapsed, tokens)
+        else:
+            metrics_registry.observe_span(name, elapsed, tokens)
+
+
+def record_span(name, seconds, tokens=None):
+    """Mencatat span yang durasinya diukur sendiri oleh pemanggil (misalnya per chunk stream)."""
+    trace = get_current_trace()
+    if trace is not None:
+        trace.add_span(name, seconds, tokens)
+    else:
+        metrics_registry.observe_span(name, seconds, tokens)
+
+
+# Endpoint JSON tambahan di server metrik, misalnya /ready untuk probe readiness
+_json_endpoints = {}
+
+
+def register_json_endpoint(path, handler):
+    """handler() mengembalikan (kode status HTTP, objek yang bisa di-JSON-kan)."""
+    _json_endpoints[path] = handler
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        if path in _json_endpoints:
+            status, payload = _json_endpoints[path]()
+            self._send(status, "application/json", json.dumps(payload, default=str).encode("utf-8"))
+            return
+        if path != "/metrics":
+            self.send_response(404)
+            self.end_headers()
+            return
+        self._send(200, "text/plain; version=0.0.4; charset=utf-8", metrics_registry.render().encode("utf-8"))
+
+    def _send(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_metrics_server = None
+_metrics_server_lock = threading.Lock()
+
+
+def start_metrics_server(port=METRICS_PORT, host=METRICS_HOST):
+    """Menjalankan endpoint /metrics di thread latar belakang (sekali per proses)."""
+    global _metrics_server
+    if not port:
+        return None
+    with _metrics_server_lock:
+        if _metrics_server is None:
+            try:
+                _metrics_server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            except OSError as e:
+                print(f"Gagal menjalankan endpoint metrik di {host}:{port}: {e}")
+                return None
+            threading.Thread(target=_metrics_server.serve_forever, name="metrics-server", daemon=True).start()
+            print(f"Endpoint metrik Prometheus aktif di http://{host}:{port}/metrics")
+    return _metrics_server
@@ -0,0 +1,478 @@
+"""
+Indeks vektor ringkas dan memory-mapped sebagai backend pencarian alternatif untuk Chroma.
+
+Dengan VECTOR_STORE_BACKEND=compact, koleksi Chroma tetap menjadi tempat tulis
+(ingestion, relabel, BM25, get per ID), tetapi pencarian vektor dilayani dari snapshot:
+  - vectors.npy  : embedding float16 atau int8 (dengan skala per baris di scales.npy),
+                   dibuka dengan np.load(mmap_mode="r") sehingga beberapa proses berbagi
+                   halaman yang sama di page cache alih-alih masing-masing menyimpan salinan;
+  - norms.npy    : norma L2 tiap baris (float32) untuk jarak l2/cosine;
+  - chunks.sqlite: tabel samping (baris -> chunk_id, teks, metadata JSON), dibaca hanya
+                   untuk baris hasil pencarian.
+Pencarian memakai perkalian matriks NumPy per blok baris (exact, bukan HNSW).
+Snapshot dibangun ulang dari koleksi setelah ingestion ke direktori versi baru, lalu
+file CURRENT diganti secara atomik; proses lain memuat versi baru pada pencarian berikutnya.
+Setiap snapshot dicap dengan versi basis pengetahuan (utils_ingest.get_knowledge_base_version)
+saat ekspor dimulai, sehingga perubahan yang tidak mengubah jumlah baris (relabel, chunk
+diganti) tetap terdeteksi. Membangun ulang adalah O(jumlah chunk): seluruh koleksi diekspor.
+"""
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+import numpy as np
+from dotenv import load_dotenv
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+from utils_ingest import get_knowledge_base_version
+from utils_retrieval import maximal_marginal_relevance
+
+load_dotenv(override=True)
+
+CHROMA_PERSIST_DIRECTORY = os.getenv("CHROMA_PERSIST_DIR", "./chroma_db_streamlit_app")
+# "chroma" = pencarian lewat indeks HNSW Chroma; "compact" = snapshot memory-mapped di modul ini
+VECTOR_STORE_BACKEND = os.getenv("VECTOR_STORE_BACKEND", "chroma").lower()
+COMPACT_INDEX_DIR = os.getenv("COMPACT_INDEX_DIR", os.path.join(CHROMA_PERSIST_DIRECTORY, "compact_index"))
+COMPACT_INDEX_DTYPE = os.getenv("COMPACT_INDEX_DTYPE", "float16").lower()
+# Jumlah baris yang di-dekuantisasi ke float32 sekaligus saat pencarian (membatasi memori sementara)
+COMPACT_INDEX_BLOCK_ROWS = int(os.getenv("COMPACT_INDEX_BLOCK_ROWS", 4096))
+COMPACT_INDEX_EXPORT_PAGE_SIZE = int(os.getenv("COMPACT_INDEX_EXPORT_PAGE_SIZE", 2000))
+
+COMPACT_INDEX_DTYPES = ("float16", "int8")
+DISTANCE_SPACES = ("l2", "cosine", "ip")
+_CURRENT_FILE = "CURRENT"
+# Versi lama yang dipertahankan agar proses yang masih membukanya tidak terganggu
+_KEEP_VERSIONS = 2
+
+
+def quantize_vectors(vectors, dtype):
+    """Mengembalikan (matriks terkuantisasi, skala per baris atau None)."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if dtype == "float16":
+        return vectors.astype(np.float16), None
+    if dtype != "int8":
+        raise ValueError(f"dtype indeks '{dtype}' tidak dikenal; pilih salah satu dari {COMPACT_INDEX_DTYPES}.")
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    quantized = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return quantized, scales.astype(np.float32)
+
+
+def dequantize_vectors(quantized, scales=None):
+    vectors = np.array(quantized, dtype=np.float32)
+    if scales is not None:
+        vectors *= np.asarray(scales, dtype=np.float32)[:, None]
+    return vectors
+
+
+def collection_distance_space(collection):
+    """Fungsi jarak koleksi Chroma (l2, cosine, ip); default Chroma adalah l2."""
+    space = (collection.metadata or {}).get("hnsw:space")
+    if not space:
+        try:
+            space = (collection.configuration or {}).get("hnsw", {}).get("space")
+        except Exception:
+            space = None
+    space = str(space or "l2").lower()
+    return space if space in DISTANCE_SPACES else "l2"
+
+
+def compute_distances(dots, query_norms, row_norms, space):
+    """Jarak dengan definisi yang sama seperti Chroma dari hasil perkalian titik (query x baris)."""
+    if space == "cosine":
+        denominator = np.maximum(query_norms[:, None] * row_norms[None, :], 1e-12)
+        return 1.0 - dots / denominator
+    if space == "ip":
+        return 1.0 - dots
+    return query_norms[:, None] ** 2 - 2.0 * dots + row_norms[None, :] ** 2
+
+
+class _IndexSnapshot:
+    """Satu versi indeks yang sudah dibuka: matriks memory-mapped dan tabel samping read-only."""
+
+    def __init__(self, path):
+        with open(os.path.join(path, "manifest.json"), "r", encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        self.path = path
+        self.count = self.manifest["count"]
+        self.dim = self.manifest["dim"]
+        self.dtype = self.manifest["dtype"]
+        self.space = self.manifest["space"]
+        self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        self.norms = np.load(os.path.join(path, "norms.npy"), mmap_mode="r")
+        scales_path = os.path.join(path, "scales.npy")
+        self.scales = np.load(scales_path, mmap_mode="r") if os.path.exists(scales_path) else None
+        # immutable=1: file tidak pernah diubah setelah dibangun, jadi SQLite tidak perlu lock
+        self._db = sqlite3.connect(f"file:{os.path.join(path, 'chunks.sqlite')}?mode=ro&immutable=1",
+                                   uri=True, check_same_thread=False)
+        self._db_lock = threading.Lock()
+
+    def search(self, query_embeddings, k):
+        """
+        Pencarian exact untuk banyak query sekaligus.
+        Mengembalikan (baris, jarak): array (jumlah query, k) terurut dari jarak terkecil.
+        """
+        k = min(k, self.count)
+        if k <= 0:
+            return (np.empty((len(query_embeddings), 0), dtype=np.int64),
+                    np.empty((len(query_embeddings), 0), dtype=np.float32))
+        queries = np.asarray(query_embeddings, dtype=np.float32).reshape(-1, self.dim)
+        query_norms = np.linalg.norm(queries, axis=1)
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+        best_distances = np.empty((len(queries), 0), dtype=np.float32)
+        # Satu buffer float32 dipakai ulang untuk semua blok agar tidak ada alokasi per blok
+        block_buffer = None
+        for start in range(0, self.count, COMPACT_INDEX_BLOCK_ROWS):
+            end = min(start + COMPACT_INDEX_BLOCK_ROWS, self.count)
+            if len(queries) == 1 and self.dtype == "int8":
+                # Satu query: einsum langsung atas int8 lebih cepat daripada konversi blok ke float32
+                dots = np.einsum("ij,j->i", self.vectors[start:end], queries[0])[None, :]
+            else:
+                if block_buffer is None:
+                    block_buffer = np.empty((min(COMPACT_INDEX_BLOCK_ROWS, self.count), self.dim), dtype=np.float32)
+                block = block_buffer[:end - start]
+                np.copyto(block, self.vectors[start:end])
+                dots = queries @ block.T
+            if self.scales is not None:
+                dots *= self.scales[start:end][None, :]
+            distances = compute_distances(dots, query_norms, self.norms[start:end], self.space)
+            rows = np.broadcast_to(np.arange(start, end), distances.shape)
+            best_rows = np.concatenate([best_rows, rows], axis=1)
+            best_distances = np.concatenate([best_distances, distances.astype(np.float32)], axis=1)
+            if best_rows.shape[1] > k:
+                keep = np.argpartition(best_distances, k - 1, axis=1)[:, :k]
+                best_rows = np.take_along_axis(best_rows, keep, axis=1)
+                best_distances = np.take_along_axis(best_distances, keep, axis=1)
+        order = np.argsort(best_distances, axis=1)
+        return np.take_along_axis(best_rows, order, axis=1), np.take_along_axis(best_distances, order, axis=1)
+
+    def get_vectors(self, rows):
+        """Embedding float32 (hasil dekuantisasi) untuk baris tertentu."""
+        rows = np.asarray(rows, dtype=np.int64)
+        scales = self.scales[rows] if self.scales is not None else None
+        return dequantize_vectors(self.vectors[rows], scales)
+
+    def get_normalized_vectors(self, rows):
+        """Seperti get_vectors, tetapi dinormalisasi dengan norma yang sudah tersimpan (untuk MMR)."""
+        rows = np.asarray(rows, dtype=np.int64)
+        return self.get_vectors(rows) / np.maximum(self.norms[rows], 1e-12)[:, None]
+
+    def get_documents(self, rows):
+        """Document LangChain untuk baris tertentu, dengan urutan mengikuti rows."""
+        rows = [int(row) for row in rows]
+        if not rows:
+            return []
+        placeholders = ",".join("?" * len(rows))
+        with self._db_lock:
+            result = self._db.execute(
+                f"SELECT row, chunk_id, document, metadata FROM chunks WHERE row IN ({placeholders})", rows
+            ).fetchall()
+        by_row = {
+            row: Document(page_content=document or "", metadata=json.loads(metadata) if metadata else {}, id=chunk_id)
+            for row, chunk_id, document, metadata in result
+        }
+        return [by_row[row] for row in rows if row in by_row]
+
+    def close(self):
+        with self._db_lock:
+            self._db.close()
+
+
+class CompactVectorIndex:
+    """
+    Indeks ringkas di satu direktori berversi. Seperti BM25Index, dimuat ulang bila file
+    CURRENT berubah (misalnya dibangun ulang oleh worker ingestion di proses lain).
+    """
+
+    def __init__(self, directory=COMPACT_INDEX_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._loaded_mtime = None
+        # Satu pembangunan ulang pada satu waktu: yang menunggu mengekspor koleksi terbaru
+        self._build_lock = threading.Lock()
+        self._background_build = None
+
+    def __len__(self):
+        snapshot = self._snapshot
+        return snapshot.count if snapshot is not None else 0
+
+    @property
+    def current_path(self):
+        return os.path.join(self.directory, _CURRENT_FILE)
+
+    def snapshot(self):
+        return self._snapshot
+
+    def load(self):
+        """Membuka versi yang ditunjuk CURRENT. Mengembalikan False jika indeks belum ada."""
+        try:
+            mtime = os.stat(self.current_path).st_mtime_ns
+            with open(self.current_path, "r", encoding="utf-8") as f:
+                version = json.load(f)["version"]
+            snapshot = _IndexSnapshot(os.path.join(self.directory, version))
+        except (OSError, ValueError, KeyError) as e:
+            if os.path.exists(self.current_path):
+                print(f"Gagal membuka indeks vektor ringkas di {self.directory}: {e}")
+            return False
+        with self._lock:
+            # Snapshot lama tidak ditutup: pencarian yang sedang berjalan mungkin masih memakainya
+            self._snapshot = snapshot
+            self._loaded_mtime = mtime
+        return True
+
+    def reload_if_changed(self):
+        try:
+            mtime = os.stat(self.current_path).st_mtime_ns
+        except OSError:
+            return False
+        if mtime == self._loaded_mtime:
+            return False
+        return self.load()
+
+    def is_stale(self, collection, dtype=COMPACT_INDEX_DTYPE):
+        """True jika snapshot aktif tidak ada atau tidak sesuai dengan koleksi/basis pengetahuan saat ini."""
+        snapshot = self._snapshot
+        if snapshot is None or snapshot.dtype != dtype:
+            return True
+        return (snapshot.manifest.get("knowledge_base_version") != get_knowledge_base_version()
+                or snapshot.count != collection.count())
+
+    def build_in_background(self, collection, dtype=COMPACT_INDEX_DTYPE):
+        """
+        Membangun ulang di thread latar belakang; snapshot lama tetap melayani pencarian sampai
+        versi baru aktif. Tidak memulai thread baru jika pembangunan sebelumnya masih berjalan.
+        """
+        with self._lock:
+            if self._background_build is not None and self._background_build.is_alive():
+                return self._background_build
+
+            def build():
+                try:
+                    if self.is_stale(collection, dtype):
+                        self.build_from_collection(collection, dtype=dtype)
+                except Exception as e:
+                    print(f"Gagal membangun ulang indeks vektor ringkas di latar belakang: {e}")
+
+            self._background_build = threading.Thread(target=build, name="compact-index-build", daemon=True)
+            self._background_build.start()
+            return self._background_build
+
+    def build_from_collection(self, collection, dtype=COMPACT_INDEX_DTYPE, page_size=COMPACT_INDEX_EXPORT_PAGE_SIZE):
+        """
+        Mengekspor seluruh koleksi Chroma per halaman ke versi indeks baru, lalu
+        mengaktifkannya. Memori yang dipakai sebanding dengan satu halaman, bukan seluruh koleksi.
+        """
+        if dtype not in COMPACT_INDEX_DTYPES:
+            raise ValueError(f"dtype indeks '{dtype}' tidak dikenal; pilih salah satu dari {COMPACT_INDEX_DTYPES}.")
+        with self._build_lock:
+            return self._build_from_collection(collection, dtype, page_size)
+
+    def _build_from_collection(self, collection, dtype, page_size):
+        started = time.monotonic()
+        # Dibaca sebelum ekspor: perubahan selama ekspor membuat snapshot ini terdeteksi usang
+        knowledge_base_version = get_knowledge_base_version()
+        expected = collection.count()
+        space = collection_distance_space(collection)
+        os.makedirs(self.directory, exist_ok=True)
+        version = f"v{time.time_ns()}_{os.getpid()}"
+        path = os.path.join(self.directory, version)
+        os.makedirs(path)
+        db = sqlite3.connect(os.path.join(path, "chunks.sqlite"))
+        db.execute("CREATE TABLE chunks (row INTEGER PRIMARY KEY, chunk_id TEXT NOT NULL, document TEXT, metadata TEXT)")
+        vectors = norms = scales = None
+        dim = 0
+        written = 0
+        try:
+            while written < expected:
+                page = collection.get(include=["embeddings", "documents", "metadatas"],
+                                      limit=min(page_size, expected - written), offset=written)
+                if not len(page["ids"]):
+                    break  # Koleksi menyusut selama ekspor; sisa baris tidak dipakai
+                embeddings = np.asarray(page["embeddings"], dtype=np.float32)
+                if vectors is None:
+                    dim = embeddings.shape[1]
+                    vectors = np.lib.format.open_memmap(os.path.join(path, "vectors.npy"), mode="w+",
+                                                        dtype=np.dtype(dtype), shape=(expected, dim))
+                    norms = np.zeros(expected, dtype=np.float32)
+                    scales = np.ones(expected, dtype=np.float32) if dtype == "int8" else None
+                end = written + len(page["ids"])
+                quantized, page_scales = quantize_vectors(embeddings, dtype)
+                vectors[written:end] = quantized
+                if scales is not None:
+                    scales[written:end] = page_scales
+                norms[written:end] = np.linalg.norm(dequantize_vectors(quantized, page_scales), axis=1)
+                db.executemany(
+                    "INSERT INTO chunks (row, chunk_id, document, metadata) VALUES (?, ?, ?, ?)",
+                    [(written + offset, chunk_id, document, json.dumps(metadata or {}, ensure_ascii=False))
+                     for offset, (chunk_id, document, metadata)
+                     in enumerate(zip(page["ids"], page["documents"], page["metadatas"]))]
+                )
+                written = end
+            if vectors is None:
+                vectors = np.lib.format.open_memmap(os.path.join(path, "vectors.npy"), mode="w+",
+                                                    dtype=np.dtype(dtype), shape=(0, 0))
+                norms = np.zeros(0, dtype=np.float32)
+            vectors.flush()
+            del vectors
+            np.save(os.path.join(path, "norms.npy"), norms[:written])
+            if scales is not None:
+                np.save(os.path.join(path, "scales.npy"), scales[:written])
+            db.commit()
+        except Exception:
+            db.close()
+            shutil.rmtree(path, ignore_errors=True)
+            raise
+        db.close()
+        manifest = {"count": written, "dim": dim, "dtype": dtype, "space": space, "built_at": time.time(),
+                    "knowledge_base_version": knowledge_base_version}
+        with open(os.path.join(path, "manifest.json"), "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+
+        tmp_path = f"{self.current_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": version}, f)
+        os.replace(tmp_path, self.current_path)
+        self._remove_old_versions(version)
+        self.load()
+        print(f"Indeks vektor ringkas dibangun: {written} chunk, {dim} dimensi, {dtype}, "
+              f"{time.monotonic() - started:.2f} detik ({version}).")
+        return manifest
+
+    def _remove_old_versions(self, current_version):
+        versions = sorted(
+            (name for name in os.listdir(self.directory)
+             if name.startswith("v") and os.path.isdir(os.path.join(self.directory, name))),
+            key=lambda name: os.stat(os.path.join(self.directory, name)).st_mtime_ns,
+        )
+        old_versions = [name for name in versions if name != current_version]
+        for name in old_versions[:max(0, len(old_versions) - (_KEEP_VERSIONS - 1))]:
+            shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+
+    def disk_usage(self):
+        """Ukuran file versi aktif dalam byte, per file."""
+        snapshot = self._snapshot
+        if snapshot is None:
+            return {}
+        return {name: os.path.getsize(os.path.join(snapshot.path, name)) for name in os.listdir(snapshot.path)}
+
+
+def is_compact_backend_enabled():
+    return VECTOR_STORE_BACKEND == "compact"
+
+
+_compact_index = None
+_compact_index_lock = threading.Lock()
+
+def get_compact_index():
+    """Indeks ringkas bersama untuk satu proses (dimuat dari COMPACT_INDEX_DIR jika ada)."""
+    global _compact_index
+    with _compact_index_lock:
+        if _compact_index is None:
+            index = CompactVectorIndex(COMPACT_INDEX_DIR)
+            index.load()
+            _compact_index = index
+    return _compact_index
+
+
+def ensure_compact_index(collection, background=False):
+    """
+    Memastikan indeks ringkas ada dan sesuai dengan versi basis pengetahuan dan jumlah baris
+    koleksi Chroma; jika tidak (indeks baru diaktifkan, atau koleksi diubah tanpa membangun
+    ulang indeks), dibangun ulang. Pembangunan ulang O(jumlah chunk); dengan background=True
+    snapshot lama yang masih ada tetap dipakai selama pembangunan, sehingga pemanggil di jalur
+    request tidak menunggu ekspor seluruh koleksi. Tanpa snapshot sama sekali, selalu sinkron.
+    """
+    index = get_compact_index()
+    index.reload_if_changed()
+    if not index.is_stale(collection):
+        return index
+    if background and index.snapshot() is not None:
+        print("Indeks vektor ringkas usang; dibangun ulang di latar belakang, snapshot lama tetap dipakai.")
+        index.build_in_background(collection)
+    else:
+        index.build_from_collection(collection)
+    return index
+
+
+def refresh_compact_index(collection):
+    """Dipanggil setelah ingestion mengubah koleksi; tidak melakukan apa-apa di backend chroma."""
+    if not is_compact_backend_enabled():
+        return None
+    try:
+        return get_compact_index().build_from_collection(collection)
+    except Exception as e:
+        print(f"Gagal membangun ulang indeks vektor ringkas: {e}")
+        return None
+
+
+class CompactVectorStore(VectorStore):
+    """
+    Vector store LangChain yang mencari di CompactVectorIndex dan meneruskan penulisan ke
+    Chroma. Atribut _collection menunjuk ke koleksi Chroma agar ingestion, relabel chunk,
+    dan indeks BM25 tetap bekerja seperti pada backend chroma.
+    """
+
+    def __init__(self, chroma_store, index):
+        self._chroma = chroma_store
+        self.index = index
+
+    @property
+    def _collection(self):
+        return self._chroma._collection
+
+    @property
+    def embeddings(self):
+        return self._chroma.embeddings
+
+    def add_texts(self, texts, metadatas=None, **kwargs):
+        # Baru terlihat di pencarian setelah indeks dibangun ulang (refresh_compact_index)
+        return self._chroma.add_texts(texts, metadatas=metadatas, **kwargs)
+
+    def delete(self, ids=None, **kwargs):
+        return self._chroma.delete(ids=ids, **kwargs)
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, **kwargs):
+        raise NotImplementedError("CompactVectorStore dibangun dari koleksi Chroma yang sudah ada.")
+
+    def _current_snapshot(self):
+        self.index.reload_if_changed()
+        return self.index.snapshot()
+
+    def similarity_search(self, query, k=4, **kwargs):
+        return self.similarity_search_by_vector(self.embeddings.embed_query(query), k=k)
+
+    def similarity_search_by_vector(self, embedding, k=4, **kwargs):
+        return self.search_by_vectors([embedding], "similarity", {"k": k})[0]
+
+    def max_marginal_relevance_search(self, query, k=4, fetch_k=20, lambda_mult=0.5, **kwargs):
+        return self.max_marginal_relevance_search_by_vector(
+            self.embeddings.embed_query(query), k=k, fetch_k=fetch_k, lambda_mult=lambda_mult
+        )
+
+    def max_marginal_relevance_search_by_vector(self, embedding, k=4, fetch_k=20, lambda_mult=0.5, **kwargs):
+        return self.search_by_vectors([embedding], "mmr", {"k": k, "fetch_k": fetch_k, "lambda_mult": lambda_mult})[0]
+
+    def search_by_vectors(self, query_embeddings, search_type, search_kwargs):
+        """Padanan utils_retrieval.search_collection_by_vectors: list Document per embedding."""
+        snapshot = self._current_snapshot()
+        if snapshot is None or not len(query_embeddings):
+            return [[] for _ in query_embeddings]
+        k = search_kwargs['k']
+        use_mmr = search_type == "mmr"
+        rows, _ = snapshot.search(query_embeddings, search_kwargs.get('fetch_k', 20) if use_mmr else k)
+        all_docs = []
+        for query_embedding, query_rows in zip(query_embeddings, rows):
+            if use_mmr and len(query_rows):
+                selected = maximal_marginal_relevance(
+                    query_embedding, snapshot.get_normalized_vectors(query_rows),
+                    k=k, lambda_mult=search_kwargs.get('lambda_mult', 0.5), normalized=True
+                )
+                query_rows = [query_rows[i] for i in sorted(selected)]
+            all_docs.append(snapshot.get_documents(query_rows[:k]))
+        return all_docs